@@ -0,0 +1,16 @@
+"""SQLite, в котором транзакцию можно начать с ``BEGIN IMMEDIATE``.
+
+Режим задает ``core.sqlite.immediate`` на время своего блока, остальные
+транзакции начинаются обычным отложенным ``BEGIN``.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    begin_mode = None
+
+    def _start_transaction_under_autocommit(self):
+        if self.begin_mode is None:
+            super()._start_transaction_under_autocommit()
+        else:
+            self.cursor().execute(f'BEGIN {self.begin_mode}')
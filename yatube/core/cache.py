@@ -0,0 +1,145 @@
+"""Кэш страниц с версиями и защитой от одновременной пересборки.
+
+Запись страницы хранит версию (значение ``version_key``) и время, до
+которого она свежая. Запись, влияющая на страницу, увеличивает версию
+(``bump_version``), и копия с прежней версией считается устаревшей.
+
+Устаревшую или истекшую запись пересобирает только один запрос — тот,
+кто захватил блокировку в кэше (``cache.add``). Остальные в это время
+получают устаревшую копию (stale-while-revalidate), а если копии нет,
+недолго ждут свежую и только потом собирают страницу сами. Блокировка
+не снимается, а истекает сама: ее ключ содержит версию, поэтому
+следующая смена версии берет уже другую блокировку.
+
+Копия, собранная по реплике, действует только до обновления реплики
+(``core.replicas.generation``), даже если версия не менялась.
+
+По умолчанию у каждого пользователя своя копия. Представление, которое
+не зависит от пользователя, может разрешить общую копию для всех
+авторизованных (``shared=True``). Имя пользователя в нее не попадает:
+тег ``{% username %}`` оставляет метку ``USERNAME_SLOT``, которую
+каждый ответ заменяет своим именем.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.utils.html import escape
+
+from core import replicas
+
+STALE_TIMEOUT = 60
+LOCK_TIMEOUT = 10
+WAIT = 0.5
+POLL_INTERVAL = 0.05
+USERNAME_SLOT = '<!-- username -->'
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def page_key(request, key_prefix, shared=False):
+    """Ключ страницы: полный путь и вариант.
+
+    Вариант — пользователь, а с ``shared`` — только аноним или нет.
+    """
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    user = request.user
+    if not user.is_authenticated:
+        variant = 'anon'
+    elif shared:
+        variant = 'auth'
+    else:
+        variant = f'user:{user.pk}'
+    return f'{key_prefix}:{path}:{variant}'
+
+
+def lock_key(key, version=None):
+    if version is None:
+        return f'{key}:lock'
+    return f'{key}:lock:{version}'
+
+
+def is_fresh(entry, version):
+    return (entry is not None
+            and entry['version'] == version
+            and entry['expires'] > time.time()
+            and replicas.is_current(entry.get('generation')))
+
+
+def wait_for_fresh(key, version, wait):
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        entry = cache.get(key)
+        if is_fresh(entry, version):
+            return entry
+    return None
+
+
+def personalize(request, response):
+    """Подставить имя пользователя на место ``USERNAME_SLOT``."""
+    if request.user.is_authenticated and not response.streaming:
+        response.content = response.content.replace(
+            USERNAME_SLOT.encode(),
+            escape(request.user.get_username()).encode())
+    return response
+
+
+def cache_view(timeout, key_prefix, version_key=None,
+               stale_timeout=STALE_TIMEOUT, lock_timeout=LOCK_TIMEOUT,
+               wait=WAIT, shared=False):
+    """Замена ``cache_page`` с версиями и single-flight пересборкой.
+
+    ``timeout`` — сколько копия свежая, ``stale_timeout`` — сколько
+    после этого ее еще можно отдавать, пока страница пересобирается.
+    Каждый авторизованный пользователь получает свою копию, с
+    ``shared`` — одну общую на всех; у анонимов копия всегда общая.
+    Ответы с cookies и не 200 не кэшируются. Блокировка живет не
+    дольше ``timeout``, чтобы не пережить свежую копию.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            key = page_key(request, key_prefix, shared)
+            version = get_version(version_key) if version_key else None
+            entry = cache.get(key)
+            if is_fresh(entry, version):
+                return personalize(request, entry['response'])
+            generation = replicas.generation()
+            # После обновления реплики пересборка берет новую блокировку.
+            lock = lock_key(key, version if generation is None
+                            else f'{version}:{generation}')
+            locked = cache.add(lock, 1, min(lock_timeout, timeout))
+            if not locked:
+                if entry is None:
+                    entry = wait_for_fresh(key, version, wait)
+                if entry is not None:
+                    return personalize(request, entry['response'])
+            request.page_cached = True
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.cookies:
+                cache.set(key, {
+                    'version': version,
+                    'generation': generation,
+                    'expires': time.time() + timeout,
+                    'response': response,
+                }, timeout + stale_timeout)
+            return personalize(request, response)
+        return wrapper
+    return decorator
@@ -0,0 +1,291 @@
+"""Кэш, общий для всех процессов на одном сервере.
+
+Данные лежат в файле SQLite, отображенном в память (``mmap_size``), в
+режиме WAL. Если файл находится в ``/dev/shm``, кэш целиком живет в
+разделяемой памяти, а SQLite берет на себя межпроцессные блокировки.
+Запись страниц и версий видна всем воркерам gunicorn сразу, а
+``incr`` выполняется атомарно одной транзакцией.
+
+Суммарный размер значений считают триггеры; при превышении
+``MAX_SIZE`` удаляются сначала просроченные, затем давно не читавшиеся
+записи (LRU).
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache_backend.SharedMemoryCache',
+            'LOCATION': '/dev/shm/yatube-cache.sqlite3',
+            'OPTIONS': {'MAX_SIZE': 64 * 1024 * 1024},
+        }
+    }
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+MAX_SIZE = 64 * 1024 * 1024
+MMAP_SIZE = 256 * 1024 * 1024
+BUSY_TIMEOUT = 5
+# Время последнего чтения обновляется не чаще раза в секунду, чтобы
+# чтения не превращались в запись на каждый запрос.
+ACCESS_RESOLUTION = 1
+EVICT_BATCH = 100
+NEVER = float('inf')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires);
+CREATE TABLE IF NOT EXISTS cache_size (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO cache_size (id, total) VALUES (1, 0);
+CREATE TRIGGER IF NOT EXISTS cache_size_insert AFTER INSERT ON cache
+BEGIN
+    UPDATE cache_size SET total = total + NEW.size WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_size_delete AFTER DELETE ON cache
+BEGIN
+    UPDATE cache_size SET total = total - OLD.size WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_size_update AFTER UPDATE OF size ON cache
+BEGIN
+    UPDATE cache_size SET total = total - OLD.size + NEW.size WHERE id = 1;
+END;
+'''
+
+
+def encode(value):
+    # Целые числа хранятся как есть, чтобы incr делался одним UPDATE.
+    if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+        return value
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def decode(value):
+    if isinstance(value, int):
+        return value
+    return pickle.loads(value)
+
+
+def size_of(value):
+    return len(value) if isinstance(value, bytes) else 8
+
+
+class SharedMemoryCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.location = location
+        self.max_size = int(options.get('MAX_SIZE', MAX_SIZE))
+        self.mmap_size = int(options.get('MMAP_SIZE', MMAP_SIZE))
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        # Соединение SQLite нельзя использовать после fork и из другого
+        # потока, поэтому оно свое у каждого потока каждого процесса.
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = self._connect()
+            local.pid = os.getpid()
+        return local.connection
+
+    def _connect(self):
+        directory = os.path.dirname(self.location)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(
+            self.location, timeout=BUSY_TIMEOUT, isolation_level=None,
+            check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=OFF')
+        connection.execute(f'PRAGMA mmap_size={self.mmap_size}')
+        connection.executescript(f'BEGIN IMMEDIATE;{SCHEMA}COMMIT;')
+        return connection
+
+    def _write(self, connection, operation):
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = operation()
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return result
+
+    def _expires(self, timeout):
+        expires = self.get_backend_timeout(timeout)
+        return NEVER if expires is None else expires
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _store(self, key, value, expires, only_missing=False):
+        value = encode(value)
+        now = time.time()
+        query = '''
+            INSERT INTO cache (key, value, expires, accessed, size)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value,
+                expires = excluded.expires, accessed = excluded.accessed,
+                size = excluded.size
+        '''
+        if only_missing:
+            query += ' WHERE cache.expires <= ?'
+            params = (key, value, expires, now, size_of(value), now)
+        else:
+            params = (key, value, expires, now, size_of(value))
+        return self.connection.execute(query, params).rowcount > 0
+
+    def _total(self):
+        total, = self.connection.execute(
+            'SELECT total FROM cache_size WHERE id = 1').fetchone()
+        return total
+
+    def _evict(self):
+        connection = self.connection
+        if self._total() <= self.max_size:
+            return
+        connection.execute(
+            'DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        # Истекшие записи могли освободить место, живые не трогаем зря.
+        excess = self._total() - self.max_size * 9 // 10
+        while excess > 0:
+            victims = []
+            rows = connection.execute(
+                'SELECT key, size FROM cache ORDER BY accessed LIMIT ?',
+                (EVICT_BATCH,)).fetchall()
+            for key, size in rows:
+                if excess <= 0:
+                    break
+                victims.append((key,))
+                excess -= size
+            if not victims:
+                return
+            connection.executemany('DELETE FROM cache WHERE key = ?', victims)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        expires = self._expires(timeout)
+
+        def operation():
+            added = self._store(key, value, expires, only_missing=True)
+            self._evict()
+            return added
+        return self._write(self.connection, operation)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        expires = self._expires(timeout)
+
+        def operation():
+            self._store(key, value, expires)
+            self._evict()
+        self._write(self.connection, operation)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self._expires(timeout)
+        items = [(self._key(key, version), value)
+                 for key, value in data.items()]
+
+        def operation():
+            for key, value in items:
+                self._store(key, value, expires)
+            self._evict()
+        self._write(self.connection, operation)
+        return []
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        if not keys:
+            return {}
+        now = time.time()
+        found = {}
+        stale = []
+        names = list(keys)
+        for start in range(0, len(names), 500):
+            batch = names[start:start + 500]
+            rows = self.connection.execute(
+                'SELECT key, value, accessed FROM cache '
+                f'WHERE key IN ({", ".join("?" * len(batch))}) '
+                'AND expires > ?', (*batch, now))
+            for name, value, accessed in rows:
+                found[keys[name]] = decode(value)
+                if now - accessed > ACCESS_RESOLUTION:
+                    stale.append((now, name))
+        if stale:
+            self.connection.executemany(
+                'UPDATE cache SET accessed = ? WHERE key = ?', stale)
+        return found
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        row = self.connection.execute(
+            'SELECT value, accessed FROM cache WHERE key = ? AND expires > ?',
+            (key, now)).fetchone()
+        if row is None:
+            return default
+        value, accessed = row
+        if now - accessed > ACCESS_RESOLUTION:
+            self.connection.execute(
+                'UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        return decode(value)
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self.connection.execute(
+            'SELECT 1 FROM cache WHERE key = ? AND expires > ?',
+            (key, time.time())).fetchone() is not None
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        return self.connection.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? AND expires > ?',
+            (self._expires(timeout), key, time.time())).rowcount > 0
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+
+        def operation():
+            row = self.connection.execute(
+                'SELECT value FROM cache WHERE key = ? AND expires > ?',
+                (key, time.time())).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = decode(row[0]) + delta
+            self.connection.execute(
+                'UPDATE cache SET value = ?, size = ? WHERE key = ?',
+                (encode(value), size_of(encode(value)), key))
+            return value
+        return self._write(self.connection, operation)
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        self.connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def delete_many(self, keys, version=None):
+        keys = [(self._key(key, version),) for key in keys]
+        self._write(self.connection, lambda: self.connection.executemany(
+            'DELETE FROM cache WHERE key = ?', keys))
+
+    def clear(self):
+        self.connection.execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Соединение живет все время работы потока: открывать файл
+        # заново на каждый запрос дороже, чем держать его открытым.
+        pass
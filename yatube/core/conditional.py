@@ -0,0 +1,65 @@
+"""Условные GET-запросы по ETag и Last-Modified.
+
+Декоратор ``conditional`` сначала спрашивает у функции состояния
+дешевый отпечаток страницы, и если у клиента та же версия, отвечает 304
+без вызова представления: без запроса ленты и без шаблона. Отпечаток
+включает пользователя, потому что страницы для разных пользователей
+отличаются, а для авторизованного — еще и CSRF-cookie: после нового
+входа формы на странице из кэша браузера несли бы старый токен.
+"""
+import hashlib
+from functools import wraps
+
+from django.utils.cache import (get_conditional_response,
+                                patch_cache_control, patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+
+
+def etag_of(parts):
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def _request_etag(request, parts):
+    user = request.user
+    if not user.is_authenticated:
+        return etag_of((None, parts))
+    # CsrfViewMiddleware кладет сюда cookie запроса, а get_token() при
+    # отрисовке формы — новый токен, который уйдет в ответе.
+    return etag_of((user.pk, request.META.get('CSRF_COOKIE'), parts))
+
+
+def conditional(state):
+    """Ответить 304, если состояние страницы не менялось.
+
+    ``state(request, *args, **kwargs)`` возвращает пару (части ETag,
+    дата последнего изменения или None) либо None, если объекта нет, —
+    тогда 404 отдает само представление.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            current = state(request, *args, **kwargs)
+            if current is None:
+                return view(request, *args, **kwargs)
+            parts, changed = current
+            etag = _request_etag(request, parts)
+            last_modified = changed and int(changed.timestamp())
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                etag = _request_etag(request, parts)
+            response.setdefault('ETag', etag)
+            if last_modified:
+                response.setdefault('Last-Modified', http_date(last_modified))
+            # Без no-cache браузер показывал бы копию по эвристике свежести
+            # от Last-Modified, не спросив сервер.
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
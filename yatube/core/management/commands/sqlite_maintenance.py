@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core import sqlite
+
+
+class Command(BaseCommand):
+    help = ('Обслуживание базы SQLite: перенос WAL в файл базы, '
+            'ANALYZE и инкрементальная очистка свободных страниц.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--skip-checkpoint', action='store_true')
+        parser.add_argument('--skip-analyze', action='store_true')
+        parser.add_argument(
+            '--vacuum-pages', type=int, default=sqlite.VACUUM_PAGES,
+            help='Сколько свободных страниц вернуть ОС, 0 — не чистить.')
+        parser.add_argument(
+            '--enable-auto-vacuum', action='store_true',
+            help='Включить auto_vacuum=INCREMENTAL (полный VACUUM).')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError('Команда работает только с SQLite')
+        if not options['skip_checkpoint']:
+            busy, log, moved = sqlite.checkpoint(connection)
+            self.stdout.write(f'checkpoint: {moved}/{log} страниц'
+                              + (', журнал занят читателями' if busy
+                                 else ''))
+        if not options['skip_analyze']:
+            sqlite.analyze(connection)
+            self.stdout.write('analyze: готово')
+        if options['vacuum_pages']:
+            freed = sqlite.vacuum(connection, options['vacuum_pages'],
+                                  options['enable_auto_vacuum'])
+            if freed is None:
+                self.stdout.write('vacuum: auto_vacuum выключен, '
+                                  'см. --enable-auto-vacuum')
+            else:
+                self.stdout.write(f'vacuum: освобождено {freed} страниц')
+        self.stdout.write(self.style.SUCCESS('Обслуживание завершено'))
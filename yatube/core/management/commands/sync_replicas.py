@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core import replicas
+
+
+class Command(BaseCommand):
+    help = 'Копирует основную базу SQLite в реплики для чтения.'
+
+    def handle(self, *args, **options):
+        aliases = replicas.replicas()
+        if not aliases:
+            self.stdout.write('Реплики не настроены (YATUBE_REPLICAS)')
+            return
+        for alias in aliases:
+            replicas.sync(alias)
+            self.stdout.write(f'{alias}: обновлена')
+        self.stdout.write(self.style.SUCCESS('Реплики обновлены'))
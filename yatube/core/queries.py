@@ -0,0 +1,142 @@
+"""Учет SQL-запросов по представлениям.
+
+``record_queries`` считает запросы и их суммарное время через
+``execute_wrapper`` на всех соединениях, поэтому работает и без
+``DEBUG``. ``QueryBudgetMiddleware`` делает это для каждого запроса,
+копит статистику по имени представления, отдает ее в заголовке
+``Server-Timing`` и пишет в лог представления, вышедшие за бюджет:
+
+    QUERY_BUDGET = 20
+    QUERY_BUDGETS = {'posts:index': 10}
+    SHARDED_QUERY_BUDGETS = {'posts:index': 12}
+
+Значения ``SHARDED_QUERY_BUDGETS`` заменяют ``QUERY_BUDGETS``, когда
+посты разложены по шардам (``POST_SHARDS``): страница тогда читает
+несколько баз.
+"""
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUDGET = 20
+# Больше имен представлений статистика не собирает.
+MAX_VIEWS = 500
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.time += time.perf_counter() - start
+                self.count += 1
+
+
+recording = threading.local()
+
+
+def active_stats():
+    """``QueryStats`` открытых в этом потоке блоков ``record_queries``."""
+    return getattr(recording, 'stats', ())
+
+
+@contextmanager
+def record_queries(stats=None):
+    """Считать запросы ко всем базам внутри блока.
+
+    Переданный ``stats`` позволяет добавить к счету запросы другого
+    потока, например пула, который выполняет часть работы запроса.
+    """
+    stats = stats or QueryStats()
+    previous = active_stats()
+    recording.stats = previous + (stats,)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            yield stats
+    finally:
+        recording.stats = previous
+
+
+def budget_for(view_name):
+    budgets = dict(getattr(settings, 'QUERY_BUDGETS', {}))
+    if getattr(settings, 'POST_SHARDS', None):
+        budgets.update(getattr(settings, 'SHARDED_QUERY_BUDGETS', {}))
+    return budgets.get(view_name,
+                       getattr(settings, 'QUERY_BUDGET', QUERY_BUDGET))
+
+
+class ViewTotals:
+    """Накопленная статистика по представлениям, общая для потоков.
+
+    Для имени представления хранится (число запросов к нему,
+    SQL-запросов, секунд). Имен не больше ``MAX_VIEWS``.
+    """
+
+    def __init__(self, max_views=MAX_VIEWS):
+        self.max_views = max_views
+        self.lock = threading.Lock()
+        self.totals = {}
+
+    def add(self, view_name, count, seconds):
+        with self.lock:
+            total = self.totals.get(view_name)
+            if total is None:
+                if len(self.totals) >= self.max_views:
+                    return
+                total = (0, 0, 0.0)
+            self.totals[view_name] = (total[0] + 1, total[1] + count,
+                                      total[2] + seconds)
+
+    def __getitem__(self, view_name):
+        with self.lock:
+            return self.totals.get(view_name, (0, 0, 0.0))
+
+    def clear(self):
+        with self.lock:
+            self.totals.clear()
+
+
+def view_name_of(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else None
+
+
+class QueryBudgetMiddleware:
+    """Число и время SQL-запросов по представлениям с бюджетом."""
+
+    totals = ViewTotals()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_queries() as stats:
+            response = self.get_response(request)
+        view_name = view_name_of(request)
+        if view_name is None:
+            return response
+        self.totals.add(view_name, stats.count, stats.time)
+        response['Server-Timing'] = (
+            f'sql;dur={stats.time * 1000:.1f};desc="{stats.count} queries"')
+        budget = budget_for(view_name)
+        if stats.count > budget:
+            logger.warning(
+                '%s: %d SQL-запросов (%.1f мс) при бюджете %d, %s',
+                view_name, stats.count, stats.time * 1000, budget,
+                request.get_full_path())
+        return response
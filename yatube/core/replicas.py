@@ -0,0 +1,140 @@
+"""Чтение лент с реплик базы, запись — в основную.
+
+``ReplicaRouter`` отправляет чтения на реплику только внутри GET-запросов
+к представлениям из ``REPLICA_VIEWS``: лентам, страницам постов и API.
+Реплику на запрос выбирает ``ReplicaMiddleware``. Все остальное, в том
+числе формы, админка и команды, читает основную базу, как и запрос,
+который уже что-то записал.
+
+После записи в POST-запросе (и других небезопасных методах) middleware
+ставит cookie, и еще ``REPLICA_PIN_SECONDS`` секунд пользователь читает
+основную базу, чтобы видеть свои изменения, пока реплика догоняет.
+Служебные записи во время GET (счетчики просмотров и т. п.) переводят
+на основную базу только остаток этого же запроса.
+
+Реплика может отставать от версий кэша: пост уже изменен и версия
+увеличена, а реплика отдает старый текст. Поэтому страницы и фрагменты,
+собранные по реплике, помечаются ее поколением (``generation``), которое
+меняет каждая ``sync``, и после обновления реплики больше не читаются::
+
+    DATABASE_REPLICAS = ['replica1']
+    DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.queries import view_name_of
+
+PIN_COOKIE = 'read_primary'
+PIN_SECONDS = 10
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+REPLICA_VIEWS = (
+    'posts:index',
+    'posts:group_list',
+    'posts:profile',
+    'posts:post_detail',
+    'posts:follow_index',
+    'posts:popular',
+    'posts:search',
+    'api:index',
+    'api:group_list',
+    'api:profile',
+    'api:post_detail',
+    'api:follow_index',
+)
+
+state = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def sync(alias):
+    """Скопировать основную базу SQLite в реплику ``alias``.
+
+    Замена настоящей репликации для разработки и тестов: резервная
+    копия SQLite переносит базу целиком и не мешает читателям.
+    """
+    source = connections[DEFAULT_DB_ALIAS]
+    target = connections[alias]
+    source.ensure_connection()
+    target.ensure_connection()
+    source.connection.backup(target.connection)
+    cache.set(generation_key(alias), time.time_ns(), None)
+
+
+def generation_key(alias):
+    return f'replica_generation:{alias}'
+
+
+def tag(alias):
+    return f'{alias}:{cache.get(generation_key(alias))}'
+
+
+def generation():
+    """Метка «реплика:поколение» запроса или None для основной базы.
+
+    Поколение читается до первого запроса к реплике, поэтому копия,
+    собранная во время ``sync``, получает прежнее поколение.
+    """
+    return getattr(state, 'generation', None)
+
+
+def is_current(generation):
+    """Собрана ли копия с меткой ``generation`` по актуальным данным."""
+    if generation is None:
+        return True
+    alias = generation.rsplit(':', 1)[0]
+    return tag(alias) == generation
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if getattr(state, 'wrote', False):
+            return DEFAULT_DB_ALIAS
+        return getattr(state, 'alias', None) or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state.alias = state.generation = None
+        state.wrote = False
+        try:
+            response = self.get_response(request)
+            wrote = state.wrote
+        finally:
+            state.alias = state.generation = None
+            state.wrote = False
+        if wrote and request.method not in SAFE_METHODS:
+            seconds = getattr(settings, 'REPLICA_PIN_SECONDS', PIN_SECONDS)
+            response.set_cookie(PIN_COOKIE, '1', max_age=seconds,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        aliases = replicas()
+        views = getattr(settings, 'REPLICA_VIEWS', REPLICA_VIEWS)
+        if (aliases and request.method in SAFE_METHODS
+                and PIN_COOKIE not in request.COOKIES
+                and view_name_of(request) in views):
+            state.alias = random.choice(aliases)
+            state.generation = tag(state.alias)
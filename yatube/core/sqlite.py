@@ -0,0 +1,122 @@
+"""Настройки соединений SQLite и обслуживание файла базы.
+
+При каждом новом соединении (сигнал ``connection_created``) применяется
+профиль PRAGMA из ``SQLITE_PROFILE``. В профиле ``tuned`` журнал WAL:
+читатели не ждут писателя, а писатели ждут друг друга до
+``busy_timeout`` вместо ошибки «database is locked». Профиль ``stock``
+возвращает умолчания SQLite, он нужен для сравнительного замера.
+Отдельные значения переопределяет ``SQLITE_PRAGMAS``.
+
+Транзакции записи открываются через ``immediate`` вместо ``atomic``: в
+профиле ``tuned`` они начинаются с ``BEGIN IMMEDIATE``. Отложенная
+транзакция, начавшая запись после чужого коммита, получает «database is
+locked» сразу, без ожидания. Для этого базе нужен движок
+``core.backends.sqlite3``, с обычным движком ``immediate`` — это просто
+``atomic``. Чтения, ``flush`` и служебные транзакции Django остаются
+отложенными.
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+PROFILES = {
+    'tuned': {
+        'journal_mode': 'WAL',
+        # В режиме WAL NORMAL не теряет целостность, только последние
+        # транзакции при отключении питания.
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -64 * 1024,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+    'stock': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+    },
+}
+TRANSACTION_MODES = {'tuned': 'IMMEDIATE', 'stock': 'DEFERRED'}
+DEFAULT_PROFILE = 'tuned'
+VACUUM_PAGES = 1000
+
+
+def profile():
+    return getattr(settings, 'SQLITE_PROFILE', DEFAULT_PROFILE)
+
+
+def pragmas():
+    return {**PROFILES[profile()], **getattr(settings, 'SQLITE_PRAGMAS', {})}
+
+
+def configure(sender, connection, **kwargs):
+    """Применить профиль к новому соединению SQLite."""
+    if connection.vendor != 'sqlite':
+        return
+    # Прямо через sqlite3: настройка соединения не идет в счет запросов
+    # страницы (core.queries).
+    for name, value in pragmas().items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+@contextmanager
+def immediate(using=DEFAULT_DB_ALIAS):
+    """``atomic`` для блока, который пишет в базу ``using``.
+
+    Внешняя транзакция начинается в режиме из ``TRANSACTION_MODES``
+    профиля, вложенный блок остается точкой сохранения.
+    """
+    connection = connections[using]
+    previous = getattr(connection, 'begin_mode', None)
+    if not connection.in_atomic_block:
+        connection.begin_mode = TRANSACTION_MODES[profile()]
+    try:
+        with transaction.atomic(using=using):
+            yield
+    finally:
+        connection.begin_mode = previous
+
+
+def pragma(cursor, name):
+    cursor.execute(f'PRAGMA {name}')
+    return cursor.fetchone()[0]
+
+
+def checkpoint(connection):
+    """Перенести WAL в файл базы и обрезать его.
+
+    Возвращает (занят ли журнал читателями, страниц в журнале,
+    перенесено страниц).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return cursor.fetchone()
+
+
+def analyze(connection):
+    """Обновить статистику индексов для планировщика."""
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+        cursor.execute('PRAGMA optimize')
+
+
+def vacuum(connection, pages=VACUUM_PAGES, enable=False):
+    """Вернуть ОС до ``pages`` свободных страниц, вернуть их число.
+
+    Инкрементальная очистка работает только при
+    ``auto_vacuum = INCREMENTAL``. ``enable`` включает его, для этого
+    нужен один полный ``VACUUM`` с перезаписью файла.
+    """
+    with connection.cursor() as cursor:
+        if pragma(cursor, 'auto_vacuum') != 2:
+            if not enable:
+                return None
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            cursor.execute('VACUUM')
+        free = pragma(cursor, 'freelist_count')
+        cursor.execute(f'PRAGMA incremental_vacuum({int(pages)})')
+        return free - pragma(cursor, 'freelist_count')
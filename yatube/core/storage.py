@@ -0,0 +1,62 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_NAME = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, раскладывающее файлы по хэшу содержимого.
+
+    Файл ``posts/photo.jpg`` сохраняется как
+    ``posts/ab/cd/abcd...ef.jpg``, где имя — SHA-256 содержимого, а два
+    уровня каталогов из его начала не дают одной папке разрастись.
+    Хэш считается по ходу записи чанков во временный файл. Если файл с
+    таким хэшем уже есть, временный удаляется и возвращается имя
+    существующего, поэтому повторная загрузка той же картинки не
+    занимает место и переиспользует ее миниатюры.
+    """
+
+    hash_name = hashlib.sha256
+    temp_directory = 'tmp'
+
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя определяется содержимым в _save.
+        return name
+
+    @classmethod
+    def is_content_name(cls, name):
+        return bool(HASH_NAME.search(name))
+
+    def content_name(self, name, digest):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return '/'.join(filter(None, (
+            directory, digest[:2], digest[2:4], digest + extension)))
+
+    def _save(self, name, content):
+        temp_directory = self.path(self.temp_directory)
+        os.makedirs(temp_directory, exist_ok=True)
+        digest = self.hash_name()
+        with tempfile.NamedTemporaryFile(dir=temp_directory,
+                                         delete=False) as temp:
+            for chunk in content.chunks():
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                digest.update(chunk)
+                temp.write(chunk)
+        name = self.content_name(name, digest.hexdigest())
+        if self.exists(name):
+            os.remove(temp.name)
+            return name
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        os.replace(temp.name, full_path)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
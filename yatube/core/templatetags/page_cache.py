@@ -0,0 +1,15 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from core.cache import USERNAME_SLOT
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def username(context):
+    """Имя пользователя или метка для него в общей копии страницы."""
+    request = context.get('request')
+    if getattr(request, 'page_cached', False):
+        return mark_safe(USERNAME_SLOT)
+    return context['user'].get_username()
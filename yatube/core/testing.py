@@ -0,0 +1,66 @@
+import re
+
+from core.queries import budget_for, record_queries
+
+# Строки плана SQLite: полный проход таблицы и сортировка во временном
+# B-дереве. ``SCAN ... USING INDEX`` — обход индекса в нужном порядке.
+FULL_SCAN = re.compile(r'\bSCAN (TABLE )?\S+( AS \S+)?$')
+TEMP_SORT = re.compile(r'USE TEMP B-TREE')
+
+
+class QueryBudgetMixin:
+    """Проверки числа SQL-запросов представлений для ``TestCase``."""
+
+    def get_within_budget(self, client, url, budget=None):
+        """Открыть ``url`` и проверить, что запросов не больше бюджета.
+
+        Бюджет по умолчанию берется из настроек ``QUERY_BUDGETS`` по
+        имени представления. Возвращает ответ и ``QueryStats``.
+        """
+        with record_queries() as stats:
+            response = client.get(url)
+        view_name = response.resolver_match.view_name
+        if budget is None:
+            budget = budget_for(view_name)
+        self.assertLessEqual(
+            stats.count, budget,
+            f'{view_name}: {stats.count} SQL-запросов при бюджете {budget}')
+        return response, stats
+
+    def get_pages_within_budget(self, client, url, budget=None):
+        """Первая страница и следующая по курсору — обе в бюджете.
+
+        Возвращает ответ и ``QueryStats`` первой страницы.
+        """
+        response, stats = self.get_within_budget(client, url, budget)
+        page_obj = (response.context.get('page_obj')
+                    if response.context else None)
+        if page_obj is not None and page_obj.has_next():
+            self.get_within_budget(
+                client, f'{url}?{page_obj.paginator.next_query}', budget)
+        return response, stats
+
+    def assertQueriesFlat(self, client, url, grow, budget=None):
+        """Число запросов не меняется, когда ``grow()`` добавляет данные.
+
+        После роста в бюджет укладывается и страница по курсору.
+        """
+        _, before = self.get_within_budget(client, url, budget)
+        grow()
+        _, after = self.get_pages_within_budget(client, url, budget)
+        self.assertEqual(after.count, before.count,
+                         f'{url}: число запросов растет с числом записей')
+
+
+class QueryPlanMixin:
+    """Проверки плана запроса (``EXPLAIN QUERY PLAN``) для ``TestCase``."""
+
+    def assertUsesIndexes(self, queryset):
+        """Запрос не читает таблицу целиком и не сортирует в памяти."""
+        plan = queryset.explain()
+        for line in plan.splitlines():
+            line = line.strip()
+            self.assertFalse(FULL_SCAN.search(line),
+                             f'Полный проход таблицы:\n{plan}')
+            self.assertFalse(TEMP_SORT.search(line),
+                             f'Сортировка без индекса:\n{plan}')
@@ -0,0 +1,382 @@
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.db import connections, transaction
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+    override_settings)
+from django.urls import reverse
+
+from core.cache import (
+    bump_version, cache_view, get_version, lock_key, page_key)
+from core.cache_backend import SharedMemoryCache
+from core.queries import QueryBudgetMiddleware, ViewTotals
+from core.replicas import PIN_COOKIE, ReplicaMiddleware, sync
+from core.sqlite import immediate, pragma
+from posts.models import Post, User
+
+VERSION_KEY = 'test_version'
+
+
+class CacheViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+        @cache_view(60, key_prefix='test', version_key=VERSION_KEY, wait=0.1)
+        def view(request):
+            self.calls += 1
+            return HttpResponse(str(self.calls))
+
+        self.view = view
+
+    def get(self):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        return self.view(request)
+
+    def lock(self):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        cache.add(lock_key(page_key(request, 'test'),
+                           get_version(VERSION_KEY)), 'other', 10)
+
+    def test_cached_until_version_changes(self):
+        '''Страница пересобирается только после смены версии.'''
+        self.assertEqual(self.get().content, b'1')
+        self.assertEqual(self.get().content, b'1')
+        bump_version(VERSION_KEY)
+        self.assertEqual(self.get().content, b'2')
+
+    def test_stale_copy_while_other_request_rebuilds(self):
+        '''Пока страницу пересобирает другой запрос,
+        отдается устаревшая копия.'''
+        self.get()
+        bump_version(VERSION_KEY)
+        self.lock()
+        self.assertEqual(self.get().content, b'1')
+        self.assertEqual(self.calls, 1)
+
+    def test_expired_copy_is_stale(self):
+        '''Истекшая копия пересобирается одним запросом.'''
+        self.get()
+        later = time.time() + 90
+        with mock.patch('core.cache.time.time', return_value=later):
+            self.lock()
+            self.assertEqual(self.get().content, b'1')
+            cache.clear()
+            self.assertEqual(self.get().content, b'2')
+
+    def test_waits_then_renders_without_stale_copy(self):
+        '''Без устаревшей копии запрос ждет и собирает страницу сам.'''
+        self.lock()
+        self.assertEqual(self.get().content, b'1')
+        self.assertEqual(self.calls, 1)
+
+    def test_version_change_takes_new_lock(self):
+        '''Блокировка прежней версии не мешает пересборке.'''
+        self.lock()
+        bump_version(VERSION_KEY)
+        self.assertEqual(self.get().content, b'1')
+        bump_version(VERSION_KEY)
+        self.assertEqual(self.get().content, b'2')
+
+    def test_username_rendered_outside_shared_copy(self):
+        '''Авторизованные пользователи делят копию, но видят свое имя.'''
+        template = Template('{% load page_cache %}{{ calls }} {% username %}')
+
+        @cache_view(60, key_prefix='names', version_key=VERSION_KEY,
+                    shared=True)
+        def view(request):
+            self.calls += 1
+            return HttpResponse(template.render(Context(
+                {'request': request, 'user': request.user,
+                 'calls': self.calls})))
+
+        for username in ('first', 'second'):
+            with self.subTest(username=username):
+                request = RequestFactory().get('/')
+                request.user = User(username=username, pk=len(username))
+                self.assertEqual(view(request).content,
+                                 f'1 {username}'.encode())
+
+    def test_copy_per_user_by_default(self):
+        '''Без shared каждый пользователь получает свою копию.'''
+        @cache_view(60, key_prefix='own', version_key=VERSION_KEY)
+        def view(request):
+            return HttpResponse(request.user.get_username())
+
+        for username in ('first', 'second', 'first'):
+            with self.subTest(username=username):
+                request = RequestFactory().get('/')
+                request.user = User(username=username, pk=len(username))
+                self.assertEqual(view(request).content, username.encode())
+
+
+def increment(location):
+    backend = SharedMemoryCache(location, {})
+    for _ in range(50):
+        backend.incr('counter')
+
+
+class SharedMemoryCacheTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+        self.backend = SharedMemoryCache(
+            self.location, {'OPTIONS': {'MAX_SIZE': 10_000}})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_cache_api(self):
+        '''Бэкенд поддерживает API кэша Django.'''
+        backend = self.backend
+        backend.set('key', {'value': [1, 2]})
+        self.assertEqual(backend.get('key'), {'value': [1, 2]})
+        self.assertFalse(backend.add('key', 'other'))
+        self.assertTrue(backend.add('new', 'value'))
+        backend.set_many({'a': 1, 'b': 'two'})
+        self.assertEqual(backend.get_many(['a', 'b', 'c']),
+                         {'a': 1, 'b': 'two'})
+        self.assertEqual(backend.incr('a', 5), 6)
+        self.assertEqual(backend.decr('a'), 5)
+        with self.assertRaises(ValueError):
+            backend.incr('missing')
+        self.assertTrue(backend.has_key('b'))
+        backend.delete_many(['a', 'b'])
+        self.assertIsNone(backend.get('a'))
+        backend.set('expired', 1, timeout=-1)
+        self.assertIsNone(backend.get('expired'))
+        self.assertTrue(backend.add('expired', 2))
+        backend.clear()
+        self.assertIsNone(backend.get('key'))
+
+    def test_least_recently_used_evicted(self):
+        '''При превышении размера удаляются давно не читавшиеся записи.'''
+        backend = self.backend
+        with mock.patch('core.cache_backend.time.time') as now:
+            for second in range(10):
+                now.return_value = 1000 + second * 10
+                backend.set(f'key{second}', b'x' * 1500, timeout=None)
+                backend.get('key0')
+        self.assertIsNotNone(backend.get('key0'))
+        self.assertIsNotNone(backend.get('key9'))
+        self.assertIsNone(backend.get('key1'))
+
+    def test_expired_entries_evicted_first(self):
+        '''Если места хватает после удаления истекших записей,
+        живые записи остаются.'''
+        backend = self.backend
+        with mock.patch('core.cache_backend.time.time') as now:
+            now.return_value = 1000
+            for number in range(3):
+                backend.set(f'expiring{number}', b'x' * 2500, timeout=5)
+            for number in range(2):
+                backend.set(f'live{number}', b'x' * 500, timeout=None)
+            now.return_value = 1010
+            backend.set('new', b'x' * 2000, timeout=None)
+            for key in ('live0', 'live1', 'new'):
+                with self.subTest(key=key):
+                    self.assertIsNotNone(backend.get(key))
+
+    def test_shared_between_processes(self):
+        '''Процессы видят общие данные, incr атомарен.'''
+        self.backend.set('counter', 0)
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=increment, args=[self.location])
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.backend.get('counter'), 200)
+
+
+class QueryBudgetMiddlewareTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        QueryBudgetMiddleware.totals.clear()
+
+    def test_queries_recorded_per_view(self):
+        '''Запросы учитываются по имени представления.'''
+        response = self.client.get('/')
+        self.assertIn('sql;dur=', response['Server-Timing'])
+        requests, queries, _ = QueryBudgetMiddleware.totals['posts:index']
+        self.assertEqual(requests, 1)
+        self.assertGreater(queries, 0)
+
+    @override_settings(QUERY_BUDGETS={'posts:index': 0})
+    def test_over_budget_logged(self):
+        '''Превышение бюджета пишется в лог.'''
+        with self.assertLogs('core.queries', 'WARNING') as logs:
+            self.client.get('/')
+        self.assertIn('posts:index', logs.output[0])
+
+    def test_totals_shared_between_threads(self):
+        '''Статистика не теряет данные потоков и не растет без предела.'''
+        totals = ViewTotals(max_views=2)
+
+        def record():
+            for _ in range(1000):
+                totals.add('first', 2, 0.0)
+
+        workers = [threading.Thread(target=record) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(totals['first'][:2], (4000, 8000))
+        totals.add('second', 1, 0.0)
+        totals.add('third', 1, 0.0)
+        self.assertEqual(totals['third'], (0, 0, 0.0))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTest(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        # Вторая база SQLite — отдельный файл, как у настоящей реплики.
+        connections.databases['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(cls.directory, 'replica.sqlite3'),
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections.databases['replica']
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='auth')
+        Post.objects.create(author=self.author, text='Старый пост')
+        self.client.force_login(self.author)
+        sync('replica')
+        self.url = reverse('posts:profile', args=['auth'])
+
+    def test_feeds_read_replica(self):
+        '''Ленты читаются с реплики, пока ее не обновят.'''
+        Post.objects.create(author=self.author, text='Новый пост')
+        reader = self.client_class()
+        self.assertNotContains(reader.get(self.url), 'Новый пост')
+        sync('replica')
+        self.assertContains(reader.get(self.url), 'Новый пост')
+
+    def test_cached_pages_refreshed_after_sync(self):
+        '''Страница и фрагменты, собранные по отставшей реплике, не
+        переживают ее обновление.'''
+        post = Post.objects.get()
+        post.text = 'Исправленный пост'
+        post.save()
+        reader = self.client_class()
+        url = reverse('posts:index')
+        self.assertNotContains(reader.get(url), 'Исправленный пост')
+        sync('replica')
+        self.assertContains(reader.get(url), 'Исправленный пост')
+
+    def test_author_reads_own_writes(self):
+        '''После записи автор читает основную базу и видит свой пост.'''
+        response = self.client.post(reverse('posts:post_create'),
+                                    {'text': 'Новый пост'})
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertContains(self.client.get(self.url), 'Новый пост')
+        self.assertNotContains(self.client_class().get(self.url),
+                               'Новый пост')
+
+    def test_get_side_effects_do_not_pin(self):
+        '''Запись во время GET не переводит читателя на основную базу.'''
+        def view(request):
+            Post.objects.update(text='Изменен')
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(view)
+        for method, pinned in (('get', False), ('post', True)):
+            with self.subTest(method=method):
+                request = getattr(RequestFactory(), method)('/')
+                self.assertEqual(PIN_COOKIE in middleware(request).cookies,
+                                 pinned)
+
+
+class SqliteProfileTest(SimpleTestCase):
+    databases = {'file'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        # Тестовая база в памяти, а WAL и mmap нужен файл.
+        connections.databases['file'] = {
+            'ENGINE': 'core.backends.sqlite3',
+            'NAME': os.path.join(cls.directory, 'db.sqlite3'),
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['file'].close()
+        del connections.databases['file']
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def tearDown(self):
+        connections['file'].close()
+
+    def pragmas(self, *names):
+        with connections['file'].cursor() as cursor:
+            return [pragma(cursor, name) for name in names]
+
+    def test_tuned_profile(self):
+        '''Новое соединение получает WAL и остальные настройки профиля.'''
+        self.assertEqual(
+            self.pragmas('journal_mode', 'synchronous', 'busy_timeout',
+                         'temp_store'),
+            ['wal', 1, 5000, 2])
+
+    @override_settings(SQLITE_PROFILE='stock',
+                       SQLITE_PRAGMAS={'busy_timeout': 100})
+    def test_stock_profile(self):
+        '''Профиль stock возвращает журнал DELETE, PRAGMA переопределяются.'''
+        self.assertEqual(self.pragmas('journal_mode', 'busy_timeout'),
+                         ['delete', 100])
+
+    def test_only_write_blocks_begin_immediate(self):
+        '''Блок immediate сразу занимает запись, обычный atomic — нет.'''
+        other = sqlite3.connect(connections.databases['file']['NAME'],
+                                timeout=0, isolation_level=None)
+        self.addCleanup(other.close)
+        connections['file'].ensure_connection()
+        for block, locked in ((transaction.atomic, False), (immediate, True)):
+            with self.subTest(block=block.__name__):
+                with block(using='file'):
+                    if locked:
+                        with self.assertRaises(sqlite3.OperationalError):
+                            other.execute('BEGIN IMMEDIATE')
+                    else:
+                        other.execute('BEGIN IMMEDIATE')
+                        other.execute('ROLLBACK')
+
+    def test_maintenance_command(self):
+        '''Команда обслуживания включает инкрементальную очистку.'''
+        output = StringIO()
+        call_command('sqlite_maintenance', database='file',
+                     enable_auto_vacuum=True, stdout=output)
+        self.assertIn('Обслуживание завершено', output.getvalue())
+        self.assertEqual(self.pragmas('auto_vacuum'), [2])
@@ -0,0 +1,124 @@
+"""JSON API лент и постов только для чтения.
+
+Ленты те же, что на страницах сайта (``feeds``), и листаются курсором
+``KeysetPaginator``: в ответе есть готовые ссылки ``next`` и
+``previous``. В постах только поля, нужные для показа ленты. ETag и
+Last-Modified считает ``changes``, поэтому клиент, который опрашивает
+ленту, получает 304 без тела, пока она не менялась.
+"""
+from django.http import JsonResponse
+
+from core.conditional import conditional
+
+from . import changes, feeds, shards, timeline
+from .constants import COMMENTS_PER_PAGE
+from .models import Group, Post, User
+from .paginator import KeysetPaginator
+
+POSTS_PER_PAGE = 10
+POST_FIELDS = ('text', 'pub_date', 'image', 'comments_count',
+               'author', 'author__username', 'group', 'group__slug')
+COMMENT_FIELDS = ('text', 'created', 'post', 'author', 'author__username')
+
+
+def json_response(data, status=200):
+    return JsonResponse(
+        data, status=status,
+        json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
+def not_found():
+    return json_response({'detail': 'Не найдено'}, status=404)
+
+
+def post_data(request, post):
+    return {
+        'id': post.pk,
+        'author': post.author.username,
+        'group': post.group.slug if post.group_id else None,
+        'text': post.text,
+        'pub_date': post.pub_date,
+        'image': (request.build_absolute_uri(post.image.url)
+                  if post.image else None),
+        'comments_count': post.comments_count,
+    }
+
+
+def comment_data(request, comment):
+    return {
+        'id': comment.pk,
+        'author': comment.author.username,
+        'text': comment.text,
+        'created': comment.created,
+    }
+
+
+def paginated(request, objects, serialize, per_page=POSTS_PER_PAGE,
+              **kwargs):
+    """Страница по курсору из запроса со ссылками на соседние."""
+    paginator = KeysetPaginator(objects, per_page, **kwargs)
+    page = paginator.paginate(request.GET)
+
+    def link(query):
+        return request.build_absolute_uri(f'{request.path}?{query}')
+
+    return {
+        'results': [serialize(request, obj) for obj in page],
+        'next': link(paginator.next_query) if page.has_next() else None,
+        'previous': (link(paginator.previous_query)
+                     if page.has_previous() else None),
+    }
+
+
+def posts_response(request, posts, **kwargs):
+    return json_response(
+        paginated(request, posts.only(*POST_FIELDS), post_data, **kwargs))
+
+
+@conditional(lambda request: changes.index())
+def index(request):
+    return posts_response(request, feeds.index_posts())
+
+
+@conditional(lambda request, slug: changes.group(slug))
+def group_posts(request, slug):
+    group = Group.objects.filter(slug=slug).first()
+    if group is None:
+        return not_found()
+    return posts_response(request, feeds.group_posts(group))
+
+
+@conditional(lambda request, username: changes.profile(username))
+def profile(request, username):
+    author = User.objects.filter(username=username).first()
+    if author is None:
+        return not_found()
+    return posts_response(request, feeds.author_posts(author))
+
+
+@conditional(lambda request, post_id: changes.post(post_id))
+def post_detail(request, post_id):
+    post = (shards.related(Post.objects.for_pk(post_id), 'author', 'group')
+            .only(*POST_FIELDS).first())
+    if post is None:
+        return not_found()
+    return json_response({
+        'post': post_data(request, post),
+        'comments': paginated(
+            request, feeds.post_comments(post).only(*COMMENT_FIELDS),
+            comment_data, COMMENTS_PER_PAGE, keys=('created', 'pk')),
+    })
+
+
+def follow_state(request):
+    if not request.user.is_authenticated:
+        return None
+    return changes.follow(request.user)
+
+
+@conditional(follow_state)
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return json_response({'detail': 'Нужна авторизация'}, status=401)
+    return posts_response(request, feeds.follow_posts(request.user),
+                          keys=timeline.FEED_KEYS)
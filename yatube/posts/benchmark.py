@@ -0,0 +1,195 @@
+"""Нагрузочный замер представлений постов.
+
+Несколько процессов открывают страницы по кругу и замеряют время
+каждого ответа. Запросы идут через тестовый клиент Django внутри
+процесса или по HTTP к уже запущенному серверу (``base_url``). Итог —
+пропускная способность и перцентили задержки по представлениям,
+пригодные для сравнения прогонов (``json.dumps``).
+"""
+import multiprocessing
+import random
+import re
+import time
+from collections import defaultdict
+from urllib.parse import urljoin
+
+import requests
+from django.conf import settings
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from .models import Group, Post, User
+
+VIEWS = ('index', 'group', 'profile', 'post_detail', 'follow', 'create',
+         'comment')
+PERCENTILES = (50, 95, 99)
+SAMPLE_SIZE = 200
+CSRF_TOKEN = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+def sample(size=SAMPLE_SIZE):
+    """Случайные адреса для замера: группы, профили, посты и читатели."""
+    return {
+        'groups': list(Group.objects.order_by('?')
+                       .values_list('slug', flat=True)[:size]),
+        'authors': list(User.objects.filter(posts__isnull=False).distinct()
+                        .order_by('?').values_list('username', flat=True)
+                        [:size]),
+        'posts': list(Post.objects.order_by('?')
+                      .values_list('pk', flat=True)[:size]),
+        'readers': list(User.objects.filter(follower__isnull=False)
+                        .distinct().order_by('?')
+                        .values_list('pk', flat=True)[:size]),
+    }
+
+
+class DjangoTransport:
+    """Запросы через тестовый клиент в этом же процессе."""
+
+    def __init__(self, user):
+        self.client = Client()
+        self.client.force_login(user)
+
+    def get(self, path):
+        return self.call(self.client.get, path)
+
+    def post(self, path, data):
+        return self.call(self.client.post, path, data)
+
+    def call(self, method, *args):
+        # Тестовый клиент пробрасывает исключения представления, а для
+        # замера это просто ответ 500, как у настоящего сервера.
+        try:
+            return method(*args).status_code
+        except Exception:
+            return 500
+
+
+class HttpTransport:
+    """Запросы по HTTP с сессией пользователя в cookie."""
+
+    def __init__(self, user, base_url):
+        client = Client()
+        client.force_login(user)
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.cookies.set(
+            settings.SESSION_COOKIE_NAME,
+            client.cookies[settings.SESSION_COOKIE_NAME].value)
+
+    def get(self, path):
+        return self.session.get(urljoin(self.base_url, path),
+                                allow_redirects=False).status_code
+
+    def post(self, path, data):
+        url = urljoin(self.base_url, path)
+        form = self.session.get(url)
+        token = CSRF_TOKEN.search(form.text)
+        data = {**data, 'csrfmiddlewaretoken': token and token.group(1)}
+        return self.session.post(url, data, headers={'Referer': url},
+                                 allow_redirects=False).status_code
+
+
+def request(transport, view, targets, rng):
+    """Открыть представление ``view``, вернуть код ответа."""
+    if view == 'index':
+        return transport.get(
+            f'{reverse("posts:index")}?page={rng.randint(1, 5)}')
+    if view == 'group':
+        return transport.get(reverse('posts:group_list',
+                                     args=[rng.choice(targets['groups'])]))
+    if view == 'profile':
+        return transport.get(reverse('posts:profile',
+                                     args=[rng.choice(targets['authors'])]))
+    if view == 'post_detail':
+        return transport.get(reverse('posts:post_detail',
+                                     args=[rng.choice(targets['posts'])]))
+    if view == 'follow':
+        return transport.get(reverse('posts:follow_index'))
+    if view == 'create':
+        return transport.post(reverse('posts:post_create'),
+                              {'text': f'Замер {rng.random()}'})
+    if view == 'comment':
+        return transport.post(reverse('posts:add_comment',
+                                      args=[rng.choice(targets['posts'])]),
+                              {'text': f'Замер {rng.random()}'})
+    raise ValueError(f'Неизвестное представление {view}')
+
+
+def worker(views, count, targets, seed, base_url=None):
+    """Выполнить ``count`` запросов по кругу, вернуть замеры.
+
+    Замер — тройка (представление, секунды, код ответа).
+    """
+    # Соединения родителя нельзя использовать после fork.
+    connections.close_all()
+    rng = random.Random(seed)
+    user = User.objects.get(pk=rng.choice(targets['readers']))
+    if base_url:
+        transport = HttpTransport(user, base_url)
+    else:
+        transport = DjangoTransport(user)
+    samples = []
+    for number in range(count):
+        view = views[number % len(views)]
+        start = time.perf_counter()
+        status = request(transport, view, targets, rng)
+        samples.append((view, time.perf_counter() - start, status))
+    connections.close_all()
+    return samples
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу для отсортированного списка."""
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[rank - 1]
+
+
+def report(samples, duration):
+    by_view = defaultdict(list)
+    errors = defaultdict(int)
+    for view, seconds, status in samples:
+        by_view[view].append(seconds)
+        if status >= 400:
+            errors[view] += 1
+    views = {}
+    for view, latencies in sorted(by_view.items()):
+        latencies.sort()
+        views[view] = {
+            'requests': len(latencies),
+            'errors': errors[view],
+            'throughput': round(len(latencies) / duration, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+            **{f'p{percent}_ms': round(percentile(latencies, percent) * 1000,
+                                       2)
+               for percent in PERCENTILES},
+        }
+    return {
+        'requests': len(samples),
+        'duration': round(duration, 3),
+        'throughput': round(len(samples) / duration, 2),
+        'views': views,
+    }
+
+
+def run(processes=4, requests_per_process=200, views=VIEWS, base_url=None,
+        seed=None):
+    """Запустить замер, вернуть отчет ``report``."""
+    targets = sample()
+    if not all(targets.values()):
+        raise ValueError('В базе нет данных для замера, '
+                         'сначала выполните generate_dataset')
+    rng = random.Random(seed)
+    jobs = [(tuple(views), requests_per_process, targets, rng.random(),
+             base_url) for _ in range(processes)]
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    start = time.perf_counter()
+    with context.Pool(processes) as pool:
+        results = pool.starmap(worker, jobs)
+    duration = time.perf_counter() - start
+    result = report([item for samples in results for item in samples],
+                    duration)
+    result.update(processes=processes, base_url=base_url)
+    return result
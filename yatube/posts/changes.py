@@ -0,0 +1,102 @@
+"""Состояние лент и постов для условных GET-запросов.
+
+Функции возвращают пару (части ETag, дата последнего изменения) для
+``core.conditional.conditional`` или None, если объекта нет. Каждая
+делает один-два запроса по индексам, не читая саму ленту.
+
+Дата изменения — ``Post.updated``: его сдвигают правка поста,
+комментарии и готовые варианты картинки. Удаление поста дату не
+двигает, поэтому в ETag входят счетчики постов, а имена авторов и
+названия групп — через версию ``NAMES_VERSION_KEY``.
+"""
+import hashlib
+
+from django.db.models import Max
+
+from core.cache import get_version
+
+from . import follow_graph, shards, trending
+from .constants import FEED_VERSION_KEY, NAMES_VERSION_KEY
+from .models import Group, Post, TimelineEntry, User, UserCounters
+
+
+def latest(posts):
+    return posts.aggregate(latest=Max('updated'))['latest']
+
+
+def following_digest(user_id):
+    return hashlib.md5(follow_graph.following(user_id).tobytes()).hexdigest()
+
+
+def state(parts, changed):
+    # Дата входит и в ETag: клиент с If-None-Match не смотрит на
+    # If-Modified-Since.
+    return (parts, changed), changed
+
+
+def index():
+    return state(get_version(FEED_VERSION_KEY),
+                 latest(Post.objects.everywhere()))
+
+
+def group(slug, viewer=None):
+    """Состояние группы; с ``viewer`` — еще и его подписки."""
+    values = (Group.objects.filter(slug=slug)
+              .values_list('pk', 'title', 'description', 'posts_count')
+              .first())
+    if values is None:
+        return None
+    # Лента группы отмечает авторов, на которых подписан читатель.
+    following = (viewer is not None and viewer.is_authenticated
+                 and following_digest(viewer.pk))
+    return state((values, following, get_version(NAMES_VERSION_KEY)),
+                 latest(Post.objects.everywhere().filter(group_id=values[0])))
+
+
+def profile(username, viewer=None):
+    """Состояние автора; с ``viewer`` — еще и подписан ли он на автора."""
+    values = (User.objects.filter(username=username)
+              .values_list('pk', 'first_name', 'last_name',
+                           'counters__posts_count',
+                           'counters__followers_count',
+                           'counters__following_count')
+              .first())
+    if values is None:
+        return None
+    following = (viewer is not None and viewer.is_authenticated
+                 and follow_graph.is_following(viewer.pk, values[0]))
+    return state((values, following, get_version(NAMES_VERSION_KEY)),
+                 latest(Post.objects.for_author(values[0])))
+
+
+def post(post_id):
+    fields = ('updated', 'comments_count', 'author_id', 'group_id')
+    if not shards.enabled():
+        fields += ('author__counters__posts_count',)
+    values = Post.objects.for_pk(post_id).values_list(*fields).first()
+    if values is None:
+        return None
+    if shards.enabled():
+        # Счетчики в основной базе, JOIN из шарда до них не дотянется.
+        values += (UserCounters.objects.filter(user_id=values[2])
+                   .values_list('posts_count', flat=True).first(),)
+    return (values, get_version(NAMES_VERSION_KEY)), values[0]
+
+
+def follow(user):
+    following = (UserCounters.objects.filter(user=user)
+                 .values_list('following_count', flat=True).first())
+    if shards.enabled():
+        changed = latest(Post.objects.everywhere().filter(
+            author_id__in=list(follow_graph.following(user.pk))))
+    else:
+        changed = (TimelineEntry.objects.filter(user=user)
+                   .aggregate(latest=Max('pub_date'))['latest'])
+    # Правки и комментарии в чужих постах видны только по версии лент.
+    return state((following, get_version(FEED_VERSION_KEY)), changed)
+
+
+def popular():
+    # Рейтинг меняет только пересчет, содержимое постов — версия лент.
+    computed = trending.computed()
+    return state((computed, get_version(FEED_VERSION_KEY)), computed)
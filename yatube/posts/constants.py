@@ -0,0 +1,8 @@
+from django.conf import settings
+
+# Версия лент: меняется при создании, изменении и удалении постов.
+FEED_VERSION_KEY = 'feed_version'
+# Версия имен авторов и названий групп, которые выводятся рядом с постами.
+NAMES_VERSION_KEY = 'names_version'
+INDEX_CACHE_TIMEOUT = getattr(settings, 'INDEX_CACHE_TIMEOUT', 60 * 60)
+COMMENTS_PER_PAGE = getattr(settings, 'COMMENTS_PER_PAGE', 20)
@@ -0,0 +1,164 @@
+"""Денормализованные счетчики постов, комментариев и подписок.
+
+Счетчики меняются атомарными ``UPDATE ... SET n = n + 1`` из сигналов
+моделей ``Post``, ``Comment`` и ``Follow``. Команда ``recount_counters``
+пересчитывает их пачками, если значения разошлись с таблицами. Посты
+пользователей и групп при этом считаются во всех шардах
+(``posts.shards``), комментарии — в шарде своего поста.
+"""
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from core.sqlite import immediate
+
+from . import shards
+
+CHUNK_SIZE = 1000
+
+
+def _add(queryset, **deltas):
+    return queryset.update(**{
+        field: Greatest(F(field) + delta, 0)
+        for field, delta in deltas.items()
+    })
+
+
+def change_user(user_id, **deltas):
+    UserCounters = global_apps.get_model('posts', 'UserCounters')
+    updated = _add(UserCounters.objects.filter(user_id=user_id), **deltas)
+    if not updated and max(deltas.values()) > 0:
+        recount_users([user_id])
+
+
+def change_group(group_id, delta):
+    if group_id is not None:
+        Group = global_apps.get_model('posts', 'Group')
+        _add(Group.objects.filter(pk=group_id), posts_count=delta)
+
+
+def change_post(post_id, delta):
+    Post = global_apps.get_model('posts', 'Post')
+    # Комментарий меняет и страницу поста, поэтому сдвигает дату изменения.
+    Post.objects.for_pk(post_id).update(
+        comments_count=Greatest(F('comments_count') + delta, 0),
+        updated=timezone.now())
+
+
+def _counts(queryset, key):
+    # Без order_by() Meta.ordering попадает в GROUP BY (Django 2.2).
+    return dict(queryset.order_by().values(key).annotate(total=Count('pk'))
+                .values_list(key, 'total'))
+
+
+def _post_databases(using, post_databases):
+    """Базы с постами для счетчиков из базы ``using``."""
+    if post_databases is not None:
+        return post_databases
+    return shards.databases() if using == DEFAULT_DB_ALIAS else [using]
+
+
+def _post_counts(apps, databases, key, ids):
+    """Число постов по ``key`` из ``ids``, сложенное по базам."""
+    Post = apps.get_model('posts', 'Post')
+    totals = {}
+    for database in databases:
+        counts = _counts(
+            Post.objects.using(database).filter(**{f'{key}__in': ids}), key)
+        for pk, total in counts.items():
+            totals[pk] = totals.get(pk, 0) + total
+    return totals
+
+
+def recount_users(ids, apps=global_apps, using=DEFAULT_DB_ALIAS,
+                  post_databases=None):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    ids = list(User.objects.using(using).filter(pk__in=ids)
+               .values_list('pk', flat=True))
+    Follow = apps.get_model('posts', 'Follow')
+    UserCounters = apps.get_model('posts', 'UserCounters')
+    posts = _post_counts(apps, _post_databases(using, post_databases),
+                         'author_id', ids)
+    followers = _counts(
+        Follow.objects.using(using).filter(author_id__in=ids), 'author_id')
+    following = _counts(
+        Follow.objects.using(using).filter(user_id__in=ids), 'user_id')
+    counters = [
+        UserCounters(user_id=user_id,
+                     posts_count=posts.get(user_id, 0),
+                     followers_count=followers.get(user_id, 0),
+                     following_count=following.get(user_id, 0))
+        for user_id in ids
+    ]
+    existing = set(UserCounters.objects.using(using).filter(user_id__in=ids)
+                   .values_list('user_id', flat=True))
+    UserCounters.objects.using(using).bulk_update(
+        [item for item in counters if item.user_id in existing],
+        ('posts_count', 'followers_count', 'following_count'))
+    UserCounters.objects.using(using).bulk_create(
+        [item for item in counters if item.user_id not in existing],
+        ignore_conflicts=True)
+
+
+def recount_groups(ids, apps=global_apps, using=DEFAULT_DB_ALIAS,
+                   post_databases=None):
+    Group = apps.get_model('posts', 'Group')
+    posts = _post_counts(apps, _post_databases(using, post_databases),
+                         'group_id', ids)
+    Group.objects.using(using).bulk_update(
+        [Group(pk=pk, posts_count=posts.get(pk, 0)) for pk in ids],
+        ('posts_count',))
+
+
+def recount_posts(ids, apps=global_apps, using=DEFAULT_DB_ALIAS):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    comments = _counts(
+        Comment.objects.using(using).filter(post_id__in=ids), 'post_id')
+    Post.objects.using(using).bulk_update(
+        [Post(pk=pk, comments_count=comments.get(pk, 0)) for pk in ids],
+        ('comments_count',))
+
+
+def chunks(queryset, chunk_size=CHUNK_SIZE):
+    """Первичные ключи таблицы пачками по ``chunk_size`` без OFFSET."""
+    last = None
+    queryset = queryset.order_by('pk').values_list('pk', flat=True)
+    while True:
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        ids = list(page[:chunk_size])
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+def recount(chunk_size=CHUNK_SIZE, apps=global_apps, using=DEFAULT_DB_ALIAS,
+            post_databases=None):
+    """Пересчитать все счетчики базы ``using``, вернуть число строк.
+
+    Посты читаются из ``post_databases``, по умолчанию — из всех шардов,
+    если пересчитывается основная база.
+    """
+    databases = _post_databases(using, post_databases)
+    processed = {}
+    for name, model, function in (
+        ('users', apps.get_model(settings.AUTH_USER_MODEL), recount_users),
+        ('groups', apps.get_model('posts', 'Group'), recount_groups),
+    ):
+        processed[name] = 0
+        for ids in chunks(model.objects.using(using), chunk_size):
+            with immediate(using):
+                function(ids, apps, using, databases)
+            processed[name] += len(ids)
+    processed['posts'] = 0
+    Post = apps.get_model('posts', 'Post')
+    for database in databases:
+        for ids in chunks(Post.objects.using(database), chunk_size):
+            with immediate(database):
+                recount_posts(ids, apps, database)
+            processed['posts'] += len(ids)
+    return processed
@@ -0,0 +1,176 @@
+"""Синтетические данные для нагрузочных замеров.
+
+Пользователи, группы, посты, комментарии и подписки пишутся пачками
+через ``bulk_create`` без сигналов, после чего счетчики и ленты
+подписок пересчитываются целиком (индекс поиска обновляют триггеры).
+Тексты берутся из пула, заранее созданного Faker, а картинок несколько
+и они общие для многих постов, как и бывает с хранилищем по хэшу.
+Популярность авторов подчиняется закону Ципфа: немногие авторы
+собирают большую часть подписок.
+"""
+import io
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db.models import Max
+from django.utils import timezone
+from faker import Faker
+from PIL import Image
+
+from core.cache import bump_version
+from core.sqlite import immediate
+
+from . import counters, shards, timeline
+from .constants import FEED_VERSION_KEY
+from .models import Comment, Follow, Group, Post, User
+
+BATCH_SIZE = 1000
+TEXT_POOL = 500
+PASSWORD = 'yatube-dataset'
+# Показатель закона Ципфа для популярности авторов.
+SKEW = 1.1
+PERIOD = timedelta(days=365)
+GROUP_SHARE = 0.7
+IMAGE_SIZE = (1200, 800)
+
+
+@contextmanager
+def keep_dates(*fields):
+    """Дать ``bulk_create`` записать свои значения в поля с auto_now_add."""
+    saved = [(field, field.auto_now_add) for field in fields]
+    for field, _ in saved:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now_add in saved:
+            field.auto_now_add = auto_now_add
+
+
+def batches(objects, batch_size):
+    objects = iter(objects)
+    while True:
+        batch = list(islice(objects, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def last_pk(model):
+    return model.objects.aggregate(last=Max('pk'))['last'] or 0
+
+
+def images(count, rng):
+    """Имена ``count`` разных картинок в хранилище постов."""
+    storage = Post._meta.get_field('image').storage
+    names = []
+    for _ in range(count):
+        color = tuple(rng.randrange(256) for _ in range(3))
+        content = io.BytesIO()
+        Image.new('RGB', IMAGE_SIZE, color).save(content, 'JPEG')
+        names.append(storage.save('posts/dataset.jpg',
+                                  ContentFile(content.getvalue())))
+    return names
+
+
+class Dataset:
+    def __init__(self, users=1000, groups=20, posts=20000, comments=50000,
+                 follows=20000, images=10, image_share=0.2,
+                 batch_size=BATCH_SIZE, seed=None, log=None):
+        self.sizes = {'users': users, 'groups': groups, 'posts': posts,
+                      'comments': comments, 'follows': follows}
+        self.images = images
+        self.image_share = image_share
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.log = log or (lambda message: None)
+        faker = Faker('ru_RU')
+        faker.seed_instance(seed)
+        self.faker = faker
+        self.texts = [faker.text(max_nb_chars=self.rng.randint(80, 1200))
+                      for _ in range(TEXT_POOL)]
+        self.prefix = f'bench{self.rng.randrange(16 ** 6):06x}'
+        self.weights = []
+
+    def date(self):
+        return timezone.now() - PERIOD * self.rng.random()
+
+    def write(self, model, objects, total, **kwargs):
+        """Записать объекты пачками, вернуть диапазон их первичных ключей.
+
+        Ключи SQLite выдает подряд, поэтому диапазон берется по
+        максимальному ключу до и после записи и не хранится в памяти.
+        """
+        first = last_pk(model) + 1
+        written = 0
+        for batch in batches(objects, self.batch_size):
+            with immediate():
+                model.objects.bulk_create(batch, **kwargs)
+            written += len(batch)
+            self.log(f'{model._meta.model_name}: {written}/{total}')
+        return range(first, last_pk(model) + 1)
+
+    def generate(self):
+        shards.require_default('Генерация данных')
+        sizes = self.sizes
+        password = make_password(PASSWORD)
+        users = self.write(User, (
+            User(username=f'{self.prefix}_{number}', password=password,
+                 first_name=self.faker.first_name(),
+                 last_name=self.faker.last_name())
+            for number in range(sizes['users'])), sizes['users'])
+        groups = self.write(Group, (
+            Group(title=self.faker.sentence(nb_words=3)[:200],
+                  slug=f'{self.prefix}-{number}',
+                  description=self.rng.choice(self.texts))
+            for number in range(sizes['groups'])), sizes['groups'])
+        self.weights = list(accumulate(
+            1 / rank ** SKEW for rank in range(1, len(users) + 1)))
+        pictures = images(self.images, self.rng)
+        with keep_dates(Post._meta.get_field('pub_date'),
+                        Comment._meta.get_field('created')):
+            posts = self.write(Post, self.posts(users, groups, pictures),
+                               sizes['posts'])
+            self.write(Comment, self.comments(users, posts),
+                       sizes['comments'])
+        self.write(Follow, self.follows(users), sizes['follows'],
+                   ignore_conflicts=True)
+        self.log('Пересчет счетчиков и лент подписок')
+        counters.recount()
+        timeline.rebuild()
+        bump_version(FEED_VERSION_KEY)
+        return {'prefix': self.prefix, 'password': PASSWORD, **sizes}
+
+    def posts(self, users, groups, pictures):
+        rng = self.rng
+        for _ in range(self.sizes['posts']):
+            image = group_id = None
+            if pictures and rng.random() < self.image_share:
+                image = rng.choice(pictures)
+            if groups and rng.random() < GROUP_SHARE:
+                group_id = rng.choice(groups)
+            yield Post(author_id=self.author(users), group_id=group_id,
+                       text=rng.choice(self.texts), image=image or '',
+                       pub_date=self.date())
+
+    def comments(self, users, posts):
+        for _ in range(self.sizes['comments'] if posts else 0):
+            yield Comment(post_id=self.rng.choice(posts),
+                          author_id=self.rng.choice(users),
+                          text=self.rng.choice(self.texts)[:300],
+                          created=self.date())
+
+    def follows(self, users):
+        for _ in range(self.sizes['follows'] if len(users) > 1 else 0):
+            user_id = self.rng.choice(users)
+            author_id = self.author(users)
+            if author_id != user_id:
+                yield Follow(user_id=user_id, author_id=author_id)
+
+    def author(self, users):
+        """Автор по закону Ципфа: первые пользователи популярнее."""
+        return self.rng.choices(users, cum_weights=self.weights)[0]
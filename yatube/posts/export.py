@@ -0,0 +1,107 @@
+"""Выгрузка постов и комментариев пользователя в NDJSON или CSV.
+
+Записи читаются через ``iterator(chunk_size=...)`` и сразу
+превращаются в строки вывода, поэтому ни запрос, ни команда не держат в
+памяти всю выгрузку. Поля записей совпадают с форматом
+``import_data``, так что выгрузку можно загрузить обратно.
+"""
+import csv
+import json
+from datetime import datetime
+
+from . import shards
+from .models import Comment, Group, Post
+
+CHUNK_SIZE = 2000
+# Строки склеиваются в куски такого размера, чтобы не писать в сокет
+# по одной короткой строке.
+BUFFER_SIZE = 64 * 1024
+FORMATS = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+FIELDS = ('type', 'id', 'post', 'author', 'text', 'group', 'pub_date',
+          'created', 'image', 'image_url')
+
+
+def records(user, absolute_url=None):
+    """Посты, затем комментарии пользователя в виде словарей.
+
+    ``absolute_url`` превращает путь картинки в полный адрес, например
+    ``request.build_absolute_uri``.
+    """
+    storage = Post._meta.get_field('image').storage
+    # Группы лежат в основной базе, а посты могут быть в шарде, поэтому
+    # slug берется отдельным запросом для каждой новой группы.
+    slugs = {None: ''}
+    posts = (Post.objects.for_author(user.pk).order_by('pk')
+             .values_list('pk', 'text', 'group_id', 'pub_date', 'image')
+             .iterator(chunk_size=CHUNK_SIZE))
+    for pk, text, group_id, pub_date, image in posts:
+        if group_id not in slugs:
+            slugs[group_id] = (Group.objects.filter(pk=group_id)
+                               .values_list('slug', flat=True).first() or '')
+        image_url = ''
+        if image:
+            image_url = storage.url(image)
+            if absolute_url is not None:
+                image_url = absolute_url(image_url)
+        yield {'type': 'post', 'id': pk, 'author': user.username,
+               'text': text, 'group': slugs[group_id], 'pub_date': pub_date,
+               'image': image, 'image_url': image_url}
+    # Диапазоны id шардов идут по возрастанию, порядок по pk сохраняется.
+    for using in shards.databases():
+        comments = (Comment.objects.using(using).filter(author=user)
+                    .order_by('pk')
+                    .values_list('pk', 'post_id', 'text', 'created')
+                    .iterator(chunk_size=CHUNK_SIZE))
+        for pk, post_id, text, created in comments:
+            yield {'type': 'comment', 'id': pk, 'post': post_id,
+                   'author': user.username, 'text': text,
+                   'created': created}
+
+
+def plain(record):
+    # Даты — полный ISO 8601 с микросекундами, чтобы импорт их не терял.
+    return {key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in record.items()}
+
+
+def ndjson(records):
+    for record in records:
+        yield json.dumps(plain(record), ensure_ascii=False) + '\n'
+
+
+class Line:
+    """Файл для ``csv.writer``, который возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(records):
+    writer = csv.DictWriter(Line(), FIELDS)
+    yield writer.writeheader()
+    for record in records:
+        yield writer.writerow(plain(record))
+
+
+def buffered(lines, size=BUFFER_SIZE):
+    buffer = []
+    length = 0
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def lines(records, file_format):
+    """Куски текста выгрузки в формате ``file_format``."""
+    if file_format == 'csv':
+        return buffered(csv_lines(records))
+    return buffered(ndjson(records))
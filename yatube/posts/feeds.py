@@ -0,0 +1,41 @@
+"""Ленты постов, общие для страниц сайта и JSON API."""
+from django.db.models import F
+
+from . import follow_graph, shards, timeline
+from .models import Post
+
+
+def index_posts():
+    return shards.related(Post.objects.everywhere(), 'author', 'group')
+
+
+def group_posts(group):
+    return shards.related(
+        Post.objects.everywhere().filter(group=group), 'author', 'group')
+
+
+def author_posts(author):
+    return shards.related(author.posts.all(), 'author', 'group')
+
+
+def follow_posts(user):
+    if shards.enabled():
+        # Ленты подписок не раскладываются по шардам: посты авторов
+        # собираются из всех шардов в порядке ключей ``FEED_KEYS``.
+        followed = list(follow_graph.following(user.pk))
+        return shards.related(
+            Post.objects.everywhere().filter(author_id__in=followed)
+            .annotate(feed_pub_date=F('pub_date'), feed_post_id=F('pk')),
+            'author', 'group')
+    return timeline.feed(user)
+
+
+def post(post_id):
+    """Пост со всем, что нужно его странице, из одного шарда."""
+    return (shards.related(Post.objects.for_pk(post_id),
+                           'author__counters', 'group')
+            .prefetch_related('image_variants'))
+
+
+def post_comments(post):
+    return shards.related(post.comments.all(), 'author')
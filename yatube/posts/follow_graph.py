@@ -0,0 +1,151 @@
+"""Граф подписок в кэше: отсортированные массивы id для каждого пользователя.
+
+Для пользователя хранятся два массива ``array('q')``: на кого он
+подписан и кто подписан на него. Проверка «подписан ли» — бинарный
+поиск, проверка целой страницы авторов — один ``get``. Массив читается
+из таблицы ``Follow`` при первом обращении, а подписка и отписка после
+коммита обновляют уже загруженные массивы на месте (write-through).
+
+У каждого массива есть версия в отдельном ключе, массив хранится вместе
+с версией, прочитанной до запроса к таблице. Подписка увеличивает
+версию сразу и еще раз после коммита, поэтому массив, прочитанный до
+коммита, уже не совпадет с версией и будет прочитан заново. После
+коммита массив меняется на месте, только если с начала транзакции
+версию никто другой не менял, иначе он тоже читается заново.
+
+Массив служит только для чтения: решать, что писать в базу, по нему
+нельзя, представления подписки проверяют саму таблицу.
+"""
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Follow
+
+TIMEOUT = getattr(settings, 'FOLLOW_GRAPH_TIMEOUT', 60 * 60)
+TYPECODE = 'q'
+# Направление: поле, по которому отбираются подписки, и поле с id.
+DIRECTIONS = {
+    'following': ('user_id', 'author_id'),
+    'followers': ('author_id', 'user_id'),
+}
+
+
+def graph_key(direction, user_id):
+    return f'follow_graph:{direction}:{user_id}'
+
+
+def version_key(key):
+    return f'{key}:version'
+
+
+def unpack(data):
+    ids = array(TYPECODE)
+    ids.frombytes(data)
+    return ids
+
+
+def cached(key):
+    """Версия массива и сам массив, если он этой версии."""
+    values = cache.get_many([key, version_key(key)])
+    version = values.get(version_key(key))
+    entry = values.get(key)
+    if entry is None or version is None or entry[0] != version:
+        return version, None
+    return version, unpack(entry[1])
+
+
+def load(direction, user_id):
+    """Массив id из кэша или из таблицы подписок."""
+    key = graph_key(direction, user_id)
+    version, ids = cached(key)
+    if ids is not None:
+        return ids
+    if version is None:
+        cache.add(version_key(key), time.time_ns(), TIMEOUT)
+        version = cache.get(version_key(key))
+    by, field = DIRECTIONS[direction]
+    ids = array(TYPECODE, Follow.objects.filter(**{by: user_id})
+                .order_by(field).values_list(field, flat=True))
+    if version is not None:
+        cache.set(key, (version, ids.tobytes()), TIMEOUT)
+    return ids
+
+
+def following(user_id):
+    """Отсортированные id авторов, на которых подписан пользователь."""
+    return load('following', user_id)
+
+
+def followers(user_id):
+    """Отсортированные id подписчиков автора."""
+    return load('followers', user_id)
+
+
+def contains(ids, value):
+    position = bisect_left(ids, value)
+    return position < len(ids) and ids[position] == value
+
+
+def is_following(user_id, author_id):
+    return contains(following(user_id), author_id)
+
+
+def followed_among(user_id, author_ids):
+    """Id из ``author_ids``, на которых подписан пользователь."""
+    ids = following(user_id)
+    return {author_id for author_id in author_ids
+            if contains(ids, author_id)}
+
+
+def invalidate(key):
+    """Увеличить версию массива, вернуть новую или None."""
+    try:
+        return cache.incr(version_key(key))
+    except ValueError:
+        return None
+
+
+def update(key, bumped, other_id, add):
+    """После коммита изменить массив на месте.
+
+    ``bumped`` — версия после увеличения в транзакции. Массив меняется,
+    если он прежней версии, а версию с тех пор никто другой не менял.
+    """
+    entry = cache.get(key)
+    new_version = invalidate(key)
+    if (entry is None or bumped is None or entry[0] != bumped - 1
+            or new_version != bumped + 1):
+        return
+    ids = unpack(entry[1])
+    position = bisect_left(ids, other_id)
+    present = position < len(ids) and ids[position] == other_id
+    if add and not present:
+        ids.insert(position, other_id)
+    elif not add and present:
+        del ids[position]
+    cache.set(key, (new_version, ids.tobytes()), TIMEOUT)
+
+
+def change(user_id, author_id, add):
+    changes = [(graph_key('following', user_id), author_id),
+               (graph_key('followers', author_id), user_id)]
+    bumped = [invalidate(key) for key, _ in changes]
+
+    def write_through():
+        for (key, other_id), version in zip(changes, bumped):
+            update(key, version, other_id, add)
+
+    transaction.on_commit(write_through)
+
+
+def add(user_id, author_id):
+    change(user_id, author_id, add=True)
+
+
+def remove(user_id, author_id):
+    change(user_id, author_id, add=False)
@@ -0,0 +1,83 @@
+"""Кэш отрисованных фрагментов ``posts/includes/post.html``.
+
+Ключ фрагмента содержит версии поста, его автора и группы. Сигналы
+увеличивают версию при изменении или удалении объекта, поэтому старый
+фрагмент просто перестает читаться и вытесняется по таймауту. Фрагменты,
+отрисованные по реплике, еще и помечены ее поколением: реплика могла не
+успеть получить изменение, версия которого уже увеличена.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from core import replicas
+from core.cache import bump_version
+
+from . import shards
+
+TEMPLATE = 'posts/includes/post.html'
+TIMEOUT = getattr(settings, 'POST_FRAGMENT_TIMEOUT', 60 * 60 * 24)
+
+
+def version_key(kind, pk):
+    return f'fragment_version:{kind}:{pk}'
+
+
+def bump(kind, pk):
+    """Сделать недействительными фрагменты, зависящие от объекта."""
+    bump_version(version_key(kind, pk))
+
+
+def _versions(posts):
+    keys = {
+        version_key(kind, pk)
+        for post in posts
+        for kind, pk in (('post', post.pk),
+                         ('user', post.author_id),
+                         ('group', post.group_id))
+    }
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys - versions.keys()}
+    if missing:
+        for key, version in missing.items():
+            cache.add(key, version, None)
+        versions.update(cache.get_many(missing))
+    return versions
+
+
+def fragment_key(post, versions, variant):
+    return 'post_fragment:{}:{}:{}:{}:{}:{}'.format(
+        post.pk,
+        versions.get(version_key('post', post.pk)),
+        versions.get(version_key('user', post.author_id)),
+        versions.get(version_key('group', post.group_id)),
+        variant,
+        replicas.generation(),
+    )
+
+
+def render_many(posts, group=None):
+    """Пары (пост, html) для страницы ленты.
+
+    Все фрагменты страницы читаются одним ``get_many``, недостающие
+    отрисовываются и сохраняются одним ``set_many``.
+    """
+    posts = list(posts)
+    variant = 'group' if group else 'feed'
+    versions = _versions(posts)
+    keys = [fragment_key(post, versions, variant) for post in posts]
+    cached = cache.get_many(keys)
+    missing = [post for post, key in zip(posts, keys) if key not in cached]
+    shards.prefetch(missing, 'image_variants')
+    rendered = {}
+    for post, key in zip(posts, keys):
+        if key not in cached:
+            rendered[key] = render_to_string(
+                TEMPLATE, {'post': post, 'group': group})
+    if rendered:
+        cache.set_many(rendered, TIMEOUT)
+    cached.update(rendered)
+    return [(post, mark_safe(cached[key])) for post, key in zip(posts, keys)]
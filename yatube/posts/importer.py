@@ -0,0 +1,318 @@
+"""Массовый импорт постов, комментариев и подписок.
+
+Записи читаются из JSONL или CSV по одной и пишутся пачками через
+``bulk_create``: каждая пачка — одна транзакция, в которой же
+сохраняется позиция в файле (``ImportCheckpoint``). Поэтому прерванный
+импорт продолжается с первой незаписанной пачки, без пропусков и
+повторов. Пользователи и группы ищутся по username и slug через словари
+в памяти, недостающие создаются. В памяти держатся только эти словари и
+текущая пачка, так что размер входного файла не важен.
+
+Форматы записей (в CSV — столбцы, тип можно задать для всего файла)::
+
+    {"type": "post", "id": 1, "author": "leo", "text": "...",
+     "group": "cats", "pub_date": "2020-01-01T10:00:00", "image": ""}
+    {"type": "comment", "post": 1, "author": "ann", "text": "..."}
+    {"type": "follow", "user": "ann", "author": "leo"}
+
+``id`` поста — его номер в источнике, а не первичный ключ: посты
+получают новые ключи, а соответствие сохраняется в ``ImportedPost`` в
+той же транзакции, что и пачка. По нему комментарии находят свои посты,
+в том числе записанные прошлым запуском, а повтор поста с тем же ``id``
+пропускается. ``id`` необязателен, но без него на пост нельзя сослаться
+из комментария.
+"""
+import csv
+import json
+import time
+from collections import defaultdict
+
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.cache import bump_version
+from core.sqlite import immediate
+
+from . import counters, shards, timeline
+from .constants import FEED_VERSION_KEY
+from .dataset import batches, keep_dates, last_pk
+from .models import (Comment, Follow, Group, ImportCheckpoint, ImportedPost,
+                     Post, User)
+
+BATCH_SIZE = 1000
+# Сколько значений подставлять в один запрос ``IN (...)``.
+LOOKUP_CHUNK = 500
+# Сколько сообщений об ошибочных записях хранить для отчета.
+MAX_ERRORS = 100
+KINDS = ('post', 'comment', 'follow')
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def read_jsonl(stream):
+    """Пары (позиция после записи, строка JSON) из бинарного потока."""
+    while True:
+        line = stream.readline()
+        if not line:
+            return
+        if line.strip():
+            yield stream.tell(), line.decode('utf-8')
+
+
+def read_csv(stream, kind=None):
+    """Пары (позиция после записи, словарь) из бинарного потока CSV.
+
+    Заголовок читается с начала файла, даже если поток уже перемотан к
+    сохраненной позиции.
+    """
+    start = stream.tell()
+    stream.seek(0)
+    header = next(csv.reader([stream.readline().decode('utf-8-sig')]))
+    stream.seek(max(start, stream.tell()))
+    position = stream.tell()
+
+    def lines():
+        nonlocal position
+        while True:
+            line = stream.readline()
+            if not line:
+                return
+            position = stream.tell()
+            yield line.decode('utf-8')
+
+    for row in csv.DictReader(lines(), fieldnames=header):
+        if kind:
+            row.setdefault('type', kind)
+        yield position, row
+
+
+def required(record, field):
+    value = record.get(field)
+    if value is None or str(value).strip() == '':
+        raise InvalidRecord(f'нет поля {field}')
+    return str(value).strip()
+
+
+def number(record, field, optional=False):
+    value = record.get(field)
+    if optional and value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InvalidRecord(f'{field} должно быть числом')
+
+
+def date(record, field):
+    value = record.get(field)
+    if not value:
+        return timezone.now()
+    parsed = parse_datetime(str(value))
+    if parsed is None:
+        raise InvalidRecord(f'{field}: неверная дата')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class Importer:
+    def __init__(self, name, batch_size=BATCH_SIZE, create_missing=True,
+                 log=None):
+        shards.require_default('Импорт')
+        self.name = name
+        self.batch_size = batch_size
+        self.create_missing = create_missing
+        self.log = log or (lambda message: None)
+        self.users = {}
+        self.groups = {}
+        self.checkpoint_id = None
+        self.stats = defaultdict(int)
+        self.errors = []
+
+    def checkpoint(self, restart=False):
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(
+            name=self.name)
+        if restart:
+            checkpoint.offset = checkpoint.records = 0
+            checkpoint.save()
+        self.checkpoint_id = checkpoint.pk
+        return checkpoint
+
+    def run(self, items, records=0):
+        """Импортировать пары (позиция, запись), начиная со счета ``records``.
+
+        Возвращает статистику: сколько записей каждого типа записано,
+        сколько пропущено и сколько оказались ошибочными.
+        """
+        started = time.monotonic()
+        self.stats['records'] = records
+        for batch in batches(items, self.batch_size):
+            self.write(batch)
+            rate = ((self.stats['records'] - records)
+                    / max(time.monotonic() - started, 1e-6))
+            self.log(f'{self.stats["records"]} записей, {rate:.0f}/с')
+        return dict(self.stats)
+
+    def parse(self, record):
+        if isinstance(record, str):
+            try:
+                record = json.loads(record)
+            except ValueError as error:
+                raise InvalidRecord(f'неверный JSON: {error}')
+        if not isinstance(record, dict):
+            raise InvalidRecord('запись должна быть объектом')
+        kind = record.get('type')
+        if kind not in KINDS:
+            raise InvalidRecord(f'неизвестный тип {kind!r}')
+        return kind, getattr(self, f'parse_{kind}')(record)
+
+    def parse_post(self, record):
+        return {'id': number(record, 'id', optional=True),
+                'author': required(record, 'author'),
+                'group': (record.get('group') or '').strip() or None,
+                'text': required(record, 'text'),
+                'pub_date': date(record, 'pub_date'),
+                'image': (record.get('image') or '').strip()}
+
+    def parse_comment(self, record):
+        return {'post': number(record, 'post'),
+                'author': required(record, 'author'),
+                'text': required(record, 'text'),
+                'created': date(record, 'created')}
+
+    def parse_follow(self, record):
+        follow = {'user': required(record, 'user'),
+                  'author': required(record, 'author')}
+        if follow['user'] == follow['author']:
+            raise InvalidRecord('подписка на самого себя')
+        return follow
+
+    def write(self, batch):
+        """Записать пачку и позицию после нее в одной транзакции."""
+        parsed = defaultdict(list)
+        for offset, record in batch:
+            self.stats['records'] += 1
+            try:
+                kind, values = self.parse(record)
+            except InvalidRecord as error:
+                self.stats['invalid'] += 1
+                if len(self.errors) < MAX_ERRORS:
+                    self.errors.append(
+                        f'запись {self.stats["records"]}: {error}')
+                continue
+            parsed[kind].append(values)
+        with immediate():
+            self.resolve(parsed)
+            self.write_posts(parsed['post'])
+            self.write_comments(parsed['comment'])
+            self.write_follows(parsed['follow'])
+            ImportCheckpoint.objects.filter(name=self.name).update(
+                offset=batch[-1][0], records=self.stats['records'],
+                updated=timezone.now())
+
+    def resolve(self, parsed):
+        usernames = {values[field] for kind in parsed
+                     for values in parsed[kind]
+                     for field in ('author', 'user') if field in values}
+        slugs = {values['group'] for values in parsed['post']
+                 if values['group']}
+        self.lookup(self.users, User, 'username', usernames,
+                    lambda username: User(username=username,
+                                          password=make_password(None)))
+        self.lookup(self.groups, Group, 'slug', slugs,
+                    lambda slug: Group(slug=slug, title=slug,
+                                       description=''))
+
+    def lookup(self, known, model, field, keys, make):
+        """Дополнить словарь ``known`` ключами ``keys`` из базы."""
+        missing = list(keys - known.keys())
+        for chunk in batches(missing, LOOKUP_CHUNK):
+            known.update(model.objects.filter(**{f'{field}__in': chunk})
+                         .values_list(field, 'pk'))
+        new = [key for key in missing if key not in known]
+        if not new or not self.create_missing:
+            return
+        model.objects.bulk_create([make(key) for key in new],
+                                  ignore_conflicts=True)
+        self.stats[f'created_{model._meta.model_name}s'] += len(new)
+        for chunk in batches(new, LOOKUP_CHUNK):
+            known.update(model.objects.filter(**{f'{field}__in': chunk})
+                         .values_list(field, 'pk'))
+
+    def skip(self, kind, count):
+        self.stats[f'skipped_{kind}s'] += count
+
+    def imported(self, source_ids):
+        """Ключи уже импортированных постов по их ``id`` в источнике."""
+        found = {}
+        for chunk in batches(source_ids, LOOKUP_CHUNK):
+            found.update(ImportedPost.objects.filter(
+                checkpoint_id=self.checkpoint_id, source_id__in=chunk)
+                .values_list('source_id', 'post_id'))
+        return found
+
+    def write_posts(self, rows):
+        known = self.imported({row['id'] for row in rows
+                               if row['id'] is not None})
+        new = []
+        for row in rows:
+            if row['author'] not in self.users or row['id'] in known:
+                continue
+            if row['id'] is not None:
+                known[row['id']] = None
+            new.append(row)
+        self.skip('post', len(rows) - len(new))
+        # Пачка пишется в транзакции BEGIN IMMEDIATE, а SQLite выдает
+        # ключи подряд, поэтому новые ключи — все, что больше прежнего
+        # максимума, в порядке вставки.
+        last = last_pk(Post)
+        with keep_dates(Post._meta.get_field('pub_date')):
+            Post.objects.bulk_create([
+                Post(author_id=self.users[row['author']],
+                     group_id=self.groups.get(row['group']),
+                     text=row['text'], pub_date=row['pub_date'],
+                     image=row['image'])
+                for row in new])
+        ids = Post.objects.filter(pk__gt=last).order_by('pk').values_list(
+            'pk', flat=True)
+        ImportedPost.objects.bulk_create([
+            ImportedPost(checkpoint_id=self.checkpoint_id,
+                         source_id=row['id'], post_id=pk)
+            for row, pk in zip(new, ids) if row['id'] is not None])
+        self.stats['posts'] += len(new)
+
+    def write_comments(self, rows):
+        posts = self.imported({row['post'] for row in rows})
+        existing = set()
+        for chunk in batches(set(posts.values()), LOOKUP_CHUNK):
+            existing.update(Post.objects.filter(pk__in=chunk)
+                            .values_list('pk', flat=True))
+        comments = [Comment(post_id=posts[row['post']],
+                            author_id=self.users[row['author']],
+                            text=row['text'], created=row['created'])
+                    for row in rows
+                    if posts.get(row['post']) in existing
+                    and row['author'] in self.users]
+        self.skip('comment', len(rows) - len(comments))
+        with keep_dates(Comment._meta.get_field('created')):
+            Comment.objects.bulk_create(comments)
+        self.stats['comments'] += len(comments)
+
+    def write_follows(self, rows):
+        follows = [Follow(user_id=self.users[row['user']],
+                          author_id=self.users[row['author']])
+                   for row in rows
+                   if row['user'] in self.users
+                   and row['author'] in self.users]
+        self.skip('follow', len(rows) - len(follows))
+        Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        self.stats['follows'] += len(follows)
+
+    def finish(self):
+        """Пересчитать то, что обычно поддерживают сигналы моделей."""
+        counters.recount()
+        timeline.rebuild()
+        bump_version(FEED_VERSION_KEY)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from posts import suggestions
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рекомендации авторов для подписки.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top', type=int, default=suggestions.TOP_K,
+            help='Сколько авторов рекомендовать каждому пользователю.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=suggestions.CHUNK_SIZE,
+            help='Скольким пользователям заменять рекомендации за '
+                 'транзакцию.')
+
+    def handle(self, *args, **options):
+        result = suggestions.compute(options['top'], options['chunk_size'])
+        for name, total in result.items():
+            self.stdout.write(f'{name}: {total}')
+        self.stdout.write(self.style.SUCCESS('Рекомендации пересчитаны'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает ленту «Популярное».'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', type=int, default=trending.SIZE,
+            help='Сколько постов держать в рейтинге.')
+
+    def handle(self, *args, **options):
+        ranking = trending.compute(options['size'])
+        self.stdout.write(f'posts: {len(ranking)}')
+        self.stdout.write(self.style.SUCCESS('Рейтинг пересчитан'))
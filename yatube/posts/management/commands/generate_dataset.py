@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.dataset import BATCH_SIZE, Dataset
+
+
+class Command(BaseCommand):
+    help = ('Создает синтетических пользователей, группы, посты, '
+            'комментарии и подписки для нагрузочных замеров.')
+
+    def add_arguments(self, parser):
+        for name, default in (('users', 1000), ('groups', 20),
+                              ('posts', 20000), ('comments', 50000),
+                              ('follows', 20000), ('images', 10)):
+            parser.add_argument(f'--{name}', type=int, default=default)
+        parser.add_argument(
+            '--image-share', type=float, default=0.2,
+            help='Доля постов с картинкой.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь')
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        summary = Dataset(
+            users=options['users'], groups=options['groups'],
+            posts=options['posts'], comments=options['comments'],
+            follows=options['follows'], images=options['images'],
+            image_share=options['image_share'],
+            batch_size=options['batch_size'], seed=options['seed'],
+            log=log).generate()
+        self.stdout.write(json.dumps(summary, ensure_ascii=False))
+        self.stdout.write(self.style.SUCCESS('Данные созданы'))
@@ -0,0 +1,58 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.importer import (BATCH_SIZE, KINDS, Importer, read_csv,
+                            read_jsonl)
+
+
+class Command(BaseCommand):
+    help = ('Импортирует посты, комментарии и подписки из JSONL или CSV '
+            'пачками; прерванный импорт продолжается с места остановки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл JSONL или CSV.')
+        parser.add_argument('--format', choices=('jsonl', 'csv'),
+                            help='Формат файла, по умолчанию по расширению.')
+        parser.add_argument('--type', choices=KINDS,
+                            help='Тип записей CSV без столбца type.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Начать файл заново, забыв сохраненную позицию.')
+        parser.add_argument(
+            '--no-create', action='store_true',
+            help='Пропускать записи с неизвестными пользователями и '
+                 'группами вместо их создания.')
+        parser.add_argument(
+            '--skip-recount', action='store_true',
+            help='Не пересчитывать счетчики и ленты подписок в конце.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f'Нет файла {path}')
+        file_format = options['format'] or (
+            'csv' if path.lower().endswith('.csv') else 'jsonl')
+        importer = Importer(
+            os.path.abspath(path), batch_size=options['batch_size'],
+            create_missing=not options['no_create'],
+            log=self.stdout.write if options['verbosity'] > 0 else None)
+        checkpoint = importer.checkpoint(restart=options['restart'])
+        if checkpoint.records:
+            self.stdout.write(
+                f'Продолжение с записи {checkpoint.records + 1}')
+        with open(path, 'rb') as stream:
+            stream.seek(checkpoint.offset)
+            if file_format == 'csv':
+                items = read_csv(stream, options['type'])
+            else:
+                items = read_jsonl(stream)
+            stats = importer.run(items, checkpoint.records)
+        for error in importer.errors:
+            self.stderr.write(error)
+        if not options['skip_recount']:
+            importer.finish()
+        self.stdout.write(json.dumps(stats, ensure_ascii=False))
+        self.stdout.write(self.style.SUCCESS('Импорт завершен'))
@@ -0,0 +1,59 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from core.sqlite import DEFAULT_PROFILE, PROFILES
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный замер лент, профиля, поста и создания поста; '
+            'печатает пропускную способность и p50/p95/p99 в JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Сколько запросов выполняет каждый процесс.')
+        parser.add_argument(
+            '--views', default=','.join(benchmark.VIEWS),
+            help='Представления через запятую: '
+                 f'{", ".join(benchmark.VIEWS)}.')
+        parser.add_argument(
+            '--url', default=None,
+            help='Адрес запущенного сервера; без него запросы идут '
+                 'через тестовый клиент Django.')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument(
+            '--sqlite-profile', choices=sorted(PROFILES), default=None,
+            help='Профиль PRAGMA для соединений замера (core.sqlite), '
+                 'например stock для сравнения с умолчаниями SQLite.')
+        parser.add_argument('--output', default=None,
+                            help='Файл для отчета вместо stdout.')
+
+    def handle(self, *args, **options):
+        views = [view for view in options['views'].split(',') if view]
+        unknown = set(views) - set(benchmark.VIEWS)
+        if unknown or not views:
+            raise CommandError(
+                f'Неизвестные представления: {", ".join(sorted(unknown))}')
+        profile = options['sqlite_profile'] or getattr(
+            settings, 'SQLITE_PROFILE', DEFAULT_PROFILE)
+        try:
+            with override_settings(SQLITE_PROFILE=profile):
+                result = benchmark.run(
+                    processes=options['processes'],
+                    requests_per_process=options['requests'],
+                    views=views, base_url=options['url'],
+                    seed=options['seed'])
+        except ValueError as error:
+            raise CommandError(error)
+        result['sqlite_profile'] = profile
+        report = json.dumps(result, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report)
+        else:
+            self.stdout.write(report)
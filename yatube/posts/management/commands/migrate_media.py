@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.cache import bump_version
+from core.storage import ContentAddressedStorage
+from posts import fragments, shards
+from posts.constants import FEED_VERSION_KEY
+from posts.counters import CHUNK_SIZE
+from posts.models import Post, PostImageVariant
+
+
+def old_names(posts, chunk_size):
+    """Имена картинок в старой раскладке пачками, по возрастанию имени."""
+    names = (posts.exclude(image='').order_by('image')
+             .values_list('image', flat=True).distinct())
+    last = ''
+    while True:
+        page = list(names.filter(image__gt=last)[:chunk_size])
+        if not page:
+            return
+        yield [name for name in page
+               if not ContentAddressedStorage.is_content_name(name)]
+        last = page[-1]
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки постов в раскладку по хэшу содержимого '
+            'и объединяет одинаковые файлы.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Сколько файлов обрабатывать за один запрос.')
+        parser.add_argument(
+            '--keep-old', action='store_true',
+            help='Не удалять файлы из старой раскладки.')
+
+    def handle(self, *args, **options):
+        self.storage = Post._meta.get_field('image').storage
+        self.keep_old = options['keep_old']
+        self.stats = {'files': 0, 'posts': 0, 'missing': 0}
+        for using in shards.databases():
+            posts = Post.objects.using(using)
+            for names in old_names(posts, options['chunk_size']):
+                for name in names:
+                    self.move(posts, name)
+                # Прогресс виден сразу: страницы и вывод обновляются
+                # после каждой пачки, а не в конце.
+                bump_version(FEED_VERSION_KEY)
+                self.stdout.write(self.report())
+        self.stdout.write(self.style.SUCCESS('Картинки перенесены'))
+
+    def move(self, posts, name):
+        """Перенести один файл и все посты, которые на него ссылаются."""
+        if not self.storage.exists(name):
+            self.stats['missing'] += 1
+            self.stderr.write(f'Нет файла {name}')
+            return
+        with self.storage.open(name) as content:
+            new_name = self.storage.save(name, content)
+        ids = list(posts.filter(image=name).values_list('pk', flat=True))
+        posts.filter(pk__in=ids).update(
+            image=new_name, updated=timezone.now())
+        (PostImageVariant.objects.using(posts.db)
+         .filter(post_id__in=ids, source=name).update(source=new_name))
+        for pk in ids:
+            fragments.bump('post', pk)
+        if not self.keep_old:
+            self.storage.delete(name)
+        self.stats['files'] += 1
+        self.stats['posts'] += len(ids)
+
+    def report(self):
+        return ', '.join(f'{key}: {value}'
+                         for key, value in self.stats.items())
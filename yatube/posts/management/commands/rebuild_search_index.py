@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import search, shards
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=search.CHUNK_SIZE,
+            help='Сколько постов индексировать за одну транзакцию.')
+
+    def handle(self, *args, **options):
+        total = sum(search.rebuild(options['chunk_size'], connections[using])
+                    for using in shards.databases())
+        self.stdout.write(f'posts: {total}')
+        self.stdout.write(self.style.SUCCESS('Индекс перестроен'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики постов, комментариев и подписок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=counters.CHUNK_SIZE,
+            help='Сколько строк пересчитывать за один запрос.')
+
+    def handle(self, *args, **options):
+        processed = counters.recount(options['chunk_size'])
+        for name, total in processed.items():
+            self.stdout.write(f'{name}: {total}')
+        self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = ('Дописывает в ленты подписок пропущенные посты авторов, '
+            'у которых снова немного подписчиков.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'authors: {timeline.resume()}')
+        self.stdout.write(self.style.SUCCESS('Раскладка возобновлена'))
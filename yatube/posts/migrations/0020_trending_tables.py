@@ -0,0 +1,44 @@
+# Generated by Django 2.2.16 on 2026-10-18 07:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_importedpost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostViews',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post_id', models.BigIntegerField(verbose_name='Id поста')),
+                ('hour', models.DateTimeField(verbose_name='Час')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Просмотров')),
+            ],
+            options={
+                'verbose_name': 'Просмотры поста за час',
+                'verbose_name_plural': 'Просмотры постов по часам',
+            },
+        ),
+        migrations.CreateModel(
+            name='TrendingPost',
+            fields=[
+                ('rank', models.PositiveIntegerField(primary_key=True, serialize=False, verbose_name='Место')),
+                ('post_id', models.BigIntegerField(verbose_name='Id поста')),
+                ('score', models.FloatField(verbose_name='Оценка')),
+                ('computed', models.DateTimeField(verbose_name='Рассчитано')),
+            ],
+            options={
+                'verbose_name': 'Популярный пост',
+                'verbose_name_plural': 'Популярные посты',
+                'ordering': ('rank',),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='postviews',
+            constraint=models.UniqueConstraint(fields=('hour', 'post_id'), name='unique_post_views_hour_post'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.16 on 2026-10-18 07:18
+
+from django.db import migrations, models
+
+
+def pause_celebrities(apps, schema_editor):
+    # Посты популярных авторов не раскладывались, пока их было
+    # больше TIMELINE_FANOUT_LIMIT: при возобновлении нужны все.
+    from posts.timeline import EPOCH, FANOUT_LIMIT
+
+    UserCounters = apps.get_model('posts', 'UserCounters')
+    UserCounters.objects.using(schema_editor.connection.alias).filter(
+        followers_count__gt=FANOUT_LIMIT).update(fanout_paused=EPOCH)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_trending_tables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercounters',
+            name='fanout_paused',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Раскладка по лентам приостановлена'),
+        ),
+        migrations.RunPython(pause_celebrities, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,10 @@
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from core.storage import ContentAddressedStorage
+
+from .shards import RoutedManager, ShardedManager
+
 User = get_user_model()
 
 
@@ -33,10 +37,35 @@ class Post(models.Model):
         'Картинка',
         upload_to='posts/',
         blank=True,
+        storage=ContentAddressedStorage(),
+    )
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число комментариев'
+    )
+    updated = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name='Дата изменения'
     )
 
+    objects = ShardedManager()
+
     class Meta:
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date_idx'),
+            models.Index(fields=['group', 'updated'],
+                         name='post_group_updated_idx'),
+            models.Index(fields=['author', 'updated'],
+                         name='post_author_updated_idx'),
+        ]
         default_related_name = 'posts'
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
@@ -51,6 +80,11 @@ class Group(models.Model):
         unique=True
     )
     description = models.TextField()
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число постов'
+    )
 
     class Meta:
         verbose_name = 'Группа'
@@ -81,7 +115,16 @@ class Comment(models.Model):
         verbose_name='Дата публикации комментария'
     )
 
+    objects = RoutedManager()
+
     class Meta:
+        ordering = ('created', 'pk')
+        indexes = [
+            models.Index(fields=['post', 'created', 'id'],
+                         name='comment_post_created_idx'),
+            models.Index(fields=['created', 'post'],
+                         name='comment_created_idx'),
+        ]
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
 
@@ -107,3 +150,222 @@ class Follow(models.Model):
             models.UniqueConstraint(fields=['user', 'author'],
                                     name='unique_user_author')
         ]
+
+
+class PostImageVariant(models.Model):
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        verbose_name='Пост',
+        related_name='image_variants'
+    )
+    source = models.CharField(
+        max_length=255,
+        verbose_name='Исходная картинка'
+    )
+    image = models.ImageField(
+        'Картинка',
+        max_length=255,
+    )
+    format = models.CharField(
+        max_length=10,
+        verbose_name='Формат'
+    )
+    width = models.PositiveIntegerField(verbose_name='Ширина')
+    height = models.PositiveIntegerField(verbose_name='Высота')
+
+    class Meta:
+        ordering = ('width',)
+        verbose_name = 'Вариант картинки'
+        verbose_name_plural = 'Варианты картинок'
+
+
+class UserCounters(models.Model):
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name='Пользователь',
+        related_name='counters'
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число постов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число подписчиков'
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число подписок'
+    )
+    # С этого момента посты автора не раскладываются по лентам (timeline).
+    fanout_paused = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Раскладка по лентам приостановлена'
+    )
+
+    class Meta:
+        verbose_name = 'Счетчики пользователя'
+        verbose_name_plural = 'Счетчики пользователей'
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Подписчик',
+        related_name='timeline'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        verbose_name='Пост',
+        related_name='timeline_entries'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Автор',
+        related_name='+'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации поста'
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Записи ленты подписок'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='unique_timeline_user_post')
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_pub_date_idx'),
+            models.Index(fields=['user', 'author', '-pub_date'],
+                         name='timeline_user_author_idx'),
+        ]
+
+
+class Suggestion(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='suggestions'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Автор',
+        related_name='+'
+    )
+    score = models.FloatField(
+        verbose_name='Оценка'
+    )
+
+    class Meta:
+        verbose_name = 'Рекомендация автора'
+        verbose_name_plural = 'Рекомендации авторов'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'],
+                                    name='unique_suggestion_user_author')
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score'],
+                         name='suggestion_user_score_idx'),
+        ]
+
+
+class ImportCheckpoint(models.Model):
+    name = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name='Источник'
+    )
+    offset = models.BigIntegerField(
+        default=0,
+        verbose_name='Позиция в файле'
+    )
+    records = models.BigIntegerField(
+        default=0,
+        verbose_name='Обработано записей'
+    )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Обновлено'
+    )
+
+    class Meta:
+        verbose_name = 'Позиция импорта'
+        verbose_name_plural = 'Позиции импорта'
+
+
+class ImportedPost(models.Model):
+    checkpoint = models.ForeignKey(
+        ImportCheckpoint,
+        on_delete=models.CASCADE,
+        verbose_name='Импорт',
+        related_name='posts'
+    )
+    source_id = models.BigIntegerField(
+        verbose_name='Id в источнике'
+    )
+    # Не внешний ключ: пост может лежать в другом шарде.
+    post_id = models.BigIntegerField(
+        verbose_name='Id поста'
+    )
+
+    class Meta:
+        verbose_name = 'Импортированный пост'
+        verbose_name_plural = 'Импортированные посты'
+        constraints = [
+            models.UniqueConstraint(fields=['checkpoint', 'source_id'],
+                                    name='unique_imported_post_source')
+        ]
+
+
+class PostViews(models.Model):
+    # Не внешний ключ: пост может лежать в другом шарде.
+    post_id = models.BigIntegerField(
+        verbose_name='Id поста'
+    )
+    hour = models.DateTimeField(
+        verbose_name='Час'
+    )
+    count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Просмотров'
+    )
+
+    class Meta:
+        verbose_name = 'Просмотры поста за час'
+        verbose_name_plural = 'Просмотры постов по часам'
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'post_id'],
+                                    name='unique_post_views_hour_post')
+        ]
+
+
+class TrendingPost(models.Model):
+    rank = models.PositiveIntegerField(
+        primary_key=True,
+        verbose_name='Место'
+    )
+    post_id = models.BigIntegerField(
+        verbose_name='Id поста'
+    )
+    score = models.FloatField(
+        verbose_name='Оценка'
+    )
+    computed = models.DateTimeField(
+        verbose_name='Рассчитано'
+    )
+
+    class Meta:
+        ordering = ('rank',)
+        verbose_name = 'Популярный пост'
+        verbose_name_plural = 'Популярные посты'
@@ -0,0 +1,242 @@
+from datetime import datetime, timedelta
+from math import ceil
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import DateTimeField, Q
+from django.utils import timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+CURSOR_SEPARATOR = '_'
+
+
+class KeysetPaginator(Paginator):
+    """Пагинатор по ключу (курсору) вместо OFFSET и COUNT(*).
+
+    Страница ищется по значениям ключевых полей последнего (``after``)
+    или первого (``before``) поста соседней страницы, поэтому глубокая
+    страница стоит столько же, сколько первая. Старые ссылки вида
+    ``?page=N`` без курсора по-прежнему открываются через OFFSET.
+    Общее число страниц не считается: ``num_pages`` — нижняя оценка по
+    ключам, прочитанным вперёд на ``window`` страниц.
+    """
+
+    page_kwarg = 'page'
+    after_kwarg = 'after'
+    before_kwarg = 'before'
+
+    def __init__(self, object_list, per_page, keys=('-pub_date', '-pk'),
+                 window=2, **kwargs):
+        self.keys = tuple(key.lstrip('-') for key in keys)
+        self.descending = tuple(key.startswith('-') for key in keys)
+        self.window = window
+        super().__init__(object_list.order_by(*keys), per_page, **kwargs)
+        self.params = None
+        self.number = 1
+        self._ahead = []
+        self._behind = []
+        self._first_keys = None
+        self._last_keys = None
+
+    @property
+    def num_pages(self):
+        return self.number + ceil(len(self._ahead) / self.per_page)
+
+    @property
+    def page_range(self):
+        return range(max(1, self.number - self.window),
+                     min(self.num_pages, self.number + self.window) + 1)
+
+    @property
+    def links(self):
+        """Пары (номер страницы, query string) для окна ссылок."""
+        return [(number, self.query(number)) for number in self.page_range]
+
+    @property
+    def first_query(self):
+        return self.query(1)
+
+    @property
+    def previous_query(self):
+        return self.query(self.number - 1)
+
+    @property
+    def next_query(self):
+        return self.query(self.number + 1)
+
+    def paginate(self, params):
+        """Вернуть страницу по GET-параметрам запроса."""
+        self.params = params
+        try:
+            number = max(1, int(params.get(self.page_kwarg, 1)))
+        except (TypeError, ValueError):
+            number = 1
+        after = self.decode(params.get(self.after_kwarg))
+        before = self.decode(params.get(self.before_kwarg))
+        if after is not None:
+            objects = list(
+                self.object_list.filter(self.beyond(after))[:self.per_page])
+        elif before is not None:
+            objects = self.fetch_before(before)
+            if len(objects) < self.per_page:
+                number, objects = 1, self.fetch_offset(1)
+        else:
+            objects = self.fetch_offset(number)
+            if not objects and number > 1:
+                number = max(1, ceil(
+                    self.object_list.count() / self.per_page))
+                objects = self.fetch_offset(number)
+        self.number = number if objects else 1
+        if objects:
+            self._first_keys = self.key_of(objects[0])
+            self._last_keys = self.key_of(objects[-1])
+            self._ahead = list(
+                self.object_list
+                .filter(self.beyond(self._last_keys))
+                .values_list(*self.keys)[:self.per_page * self.window + 1])
+        if objects and self.number > 1:
+            self._behind = list(
+                self.object_list.reverse()
+                .filter(self.beyond(self._first_keys, reverse=True))
+                .values_list(*self.keys)[:self.per_page * self.window])
+        return self._get_page(objects, self.number, self)
+
+    def fetch_offset(self, number):
+        bottom = (number - 1) * self.per_page
+        return list(self.object_list[bottom:bottom + self.per_page])
+
+    def fetch_before(self, key):
+        objects = list(
+            self.object_list.reverse()
+            .filter(self.beyond(key, reverse=True))[:self.per_page])
+        objects.reverse()
+        return objects
+
+    def beyond(self, key, reverse=False):
+        """Условие «после ключа» в порядке сортировки ленты."""
+        condition = Q()
+        for position in reversed(range(len(self.keys))):
+            name = self.keys[position]
+            descending = self.descending[position] != reverse
+            lookup = f'{name}__{"lt" if descending else "gt"}'
+            step = Q(**{lookup: key[position]})
+            if position < len(self.keys) - 1:
+                step |= Q(**{name: key[position]}) & condition
+            condition = step
+        return condition
+
+    def key_of(self, obj):
+        return tuple(getattr(obj, name) for name in self.keys)
+
+    def query(self, number):
+        """Query string ссылки на страницу ``number`` текущего окна."""
+        params = self.params.copy()
+        for kwarg in (self.after_kwarg, self.before_kwarg):
+            params.pop(kwarg, None)
+        params[self.page_kwarg] = str(number)
+        offset = number - self.number
+        if number > 1 and offset > 0 and offset <= self.window:
+            keys = self._current_last_keys(offset)
+            if keys is not None:
+                params[self.after_kwarg] = self.encode(keys)
+        elif number > 1 and offset < 0 and -offset <= self.window:
+            keys = self._current_first_keys(-offset)
+            if keys is not None:
+                params[self.before_kwarg] = self.encode(keys)
+        return params.urlencode()
+
+    def _current_last_keys(self, offset):
+        if offset == 1:
+            return self._last_keys
+        index = (offset - 1) * self.per_page - 1
+        if index < len(self._ahead):
+            return self._ahead[index]
+        return None
+
+    def _current_first_keys(self, offset):
+        if offset == 1:
+            return self._first_keys
+        index = (offset - 1) * self.per_page - 1
+        if index < len(self._behind):
+            return self._behind[index]
+        return None
+
+    def encode(self, key):
+        return CURSOR_SEPARATOR.join(
+            str((value - EPOCH) // MICROSECOND)
+            if isinstance(value, datetime) else str(value)
+            for value in key)
+
+    def decode(self, cursor):
+        if not cursor:
+            return None
+        parts = cursor.split(CURSOR_SEPARATOR)
+        if len(parts) != len(self.keys):
+            return None
+        try:
+            return tuple(
+                self.decode_value(name, part)
+                for name, part in zip(self.keys, parts))
+        except (TypeError, ValueError, OverflowError, ValidationError):
+            return None
+
+    def decode_value(self, name, value):
+        if isinstance(self.key_field(name), DateTimeField):
+            return EPOCH + int(value) * MICROSECOND
+        return self.key_field(name).to_python(value)
+
+    def key_field(self, name):
+        opts = self.object_list.model._meta
+        if name == 'pk':
+            return opts.pk
+        annotation = self.object_list.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return opts.get_field(name)
+
+
+class OffsetPaginator(Paginator):
+    """Пагинатор по номеру страницы со ссылками как у KeysetPaginator.
+
+    Нужен там, где порядок нельзя выразить ключами модели, например для
+    результатов поиска по релевантности. Шаблон навигации у них общий.
+    """
+
+    page_kwarg = 'page'
+
+    def __init__(self, object_list, per_page, window=2, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.window = window
+        self.params = None
+        self.number = 1
+
+    @property
+    def links(self):
+        return [(number, self.query(number))
+                for number in range(max(1, self.number - self.window),
+                                    min(self.num_pages,
+                                        self.number + self.window) + 1)]
+
+    @property
+    def first_query(self):
+        return self.query(1)
+
+    @property
+    def previous_query(self):
+        return self.query(self.number - 1)
+
+    @property
+    def next_query(self):
+        return self.query(self.number + 1)
+
+    def paginate(self, params):
+        self.params = params
+        page = self.get_page(params.get(self.page_kwarg))
+        self.number = page.number
+        return page
+
+    def query(self, number):
+        params = self.params.copy()
+        params[self.page_kwarg] = str(number)
+        return params.urlencode()
@@ -0,0 +1,208 @@
+"""Полнотекстовый поиск по постам на индексе SQLite FTS5.
+
+Индекс ``posts_post_fts`` хранит только токены текста (external
+content), сами тексты берутся из ``posts_post``. Синхронность
+поддерживают триггеры в базе, поэтому индекс обновляется и при
+``bulk_create`` и ``QuerySet.update``, которые не шлют сигналов.
+Триггеры пересоздаются после каждой миграции: SQLite при изменении
+столбцов пересоздает таблицу постов, и триггеры старой таблицы
+пропадают вместе с ней.
+
+У каждого шарда постов (``posts.shards``) свой индекс, ``SearchResults``
+опрашивает все и сливает результаты по релевантности.
+"""
+import re
+
+from django.db import connection as default_connection
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from core.sqlite import immediate
+
+from . import shards
+from .counters import chunks
+from .models import Post
+
+TABLE = 'posts_post_fts'
+CHUNK_SIZE = 1000
+SNIPPET_TOKENS = 24
+# Невидимые маркеры подсветки заменяются на <mark> после экранирования.
+MARK_START, MARK_END = '\x02', '\x03'
+WORD = re.compile(r'\w+')
+
+SCHEMA = (
+    f'''CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5(
+        text, content='posts_post', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')''',
+)
+TRIGGERS = (
+    f'''CREATE TRIGGER IF NOT EXISTS {TABLE}_insert
+        AFTER INSERT ON posts_post BEGIN
+            INSERT INTO {TABLE} (rowid, text) VALUES (new.id, new.text);
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {TABLE}_delete
+        AFTER DELETE ON posts_post BEGIN
+            INSERT INTO {TABLE} ({TABLE}, rowid, text)
+            VALUES ('delete', old.id, old.text);
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {TABLE}_update
+        AFTER UPDATE OF text ON posts_post BEGIN
+            INSERT INTO {TABLE} ({TABLE}, rowid, text)
+            VALUES ('delete', old.id, old.text);
+            INSERT INTO {TABLE} (rowid, text) VALUES (new.id, new.text);
+        END''',
+)
+DROP = (
+    f'DROP TRIGGER IF EXISTS {TABLE}_insert',
+    f'DROP TRIGGER IF EXISTS {TABLE}_delete',
+    f'DROP TRIGGER IF EXISTS {TABLE}_update',
+    f'DROP TABLE IF EXISTS {TABLE}',
+)
+
+
+def available(connection=default_connection):
+    return connection.vendor == 'sqlite'
+
+
+def install(connection=default_connection, fill=False):
+    """Создать индекс и триггеры, если их нет.
+
+    С ``fill`` индекс сразу заполняется всеми постами одной командой
+    ``rebuild`` — это нужно при первом создании в миграции.
+    """
+    if not available(connection):
+        return
+    with connection.cursor() as cursor:
+        for statement in SCHEMA + TRIGGERS:
+            cursor.execute(statement)
+        if fill:
+            cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('rebuild')")
+
+
+def uninstall(connection=default_connection):
+    if not available(connection):
+        return
+    with connection.cursor() as cursor:
+        for statement in DROP:
+            cursor.execute(statement)
+
+
+def rebuild(chunk_size=CHUNK_SIZE, connection=default_connection):
+    """Заново проиндексировать все посты пачками по ``chunk_size``.
+
+    Каждая пачка пишется в своей транзакции, так что запись постов не
+    блокируется на все время перестройки. Возвращает число постов.
+    """
+    if not available(connection):
+        return 0
+    install(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('delete-all')")
+    total = 0
+    for ids in chunks(Post.objects.using(connection.alias), chunk_size):
+        with immediate(connection.alias), connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {TABLE} (rowid, text) '
+                f'SELECT id, text FROM posts_post '
+                f'WHERE id IN ({", ".join(["%s"] * len(ids))})', ids)
+        total += len(ids)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return total
+
+
+def match_query(text):
+    """Запрос FTS5 из пользовательского ввода.
+
+    Слова берутся как фразы в кавычках, а последнее — как префикс,
+    поэтому синтаксис FTS5 в строке поиска не вызывает ошибок.
+    """
+    words = WORD.findall(text or '')
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def filter_posts(queryset, text):
+    """Оставить в ``queryset`` посты, подходящие под запрос."""
+    match = match_query(text)
+    if match is None:
+        return queryset.none()
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s', (match,)))
+
+
+def highlight(snippet):
+    return mark_safe(escape(snippet)
+                     .replace(MARK_START, '<mark>')
+                     .replace(MARK_END, '</mark>'))
+
+
+class SearchResults:
+    """Результаты поиска по релевантности для ``Paginator``.
+
+    ``count()`` и срезы выполняются запросами к индексам шардов, посты
+    среза получаются одним запросом на шард, у каждого есть ``snippet``
+    с подсветкой.
+    """
+
+    def __init__(self, text):
+        self.match = match_query(text)
+
+    def count(self):
+        if self.match is None:
+            return 0
+        total = 0
+        for using in shards.databases():
+            with connections[using].cursor() as cursor:
+                cursor.execute(
+                    f'SELECT count(*) FROM {TABLE} WHERE {TABLE} MATCH %s',
+                    (self.match,))
+                total += cursor.fetchone()[0]
+        return total
+
+    def __len__(self):
+        return self.count()
+
+    def rows(self, using, limit, offset):
+        """Тройки (rank, id поста, фрагмент) из индекса базы ``using``."""
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f'SELECT rank, rowid, snippet({TABLE}, 0, %s, %s, %s, %s) '
+                f'FROM {TABLE} WHERE {TABLE} MATCH %s '
+                f'ORDER BY rank LIMIT %s OFFSET %s',
+                (MARK_START, MARK_END, '…', SNIPPET_TOKENS, self.match,
+                 limit, offset))
+            return cursor.fetchall()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        if self.match is None:
+            return []
+        start = key.start or 0
+        databases = shards.databases()
+        # Одна база отдает страницу через OFFSET, из нескольких берутся
+        # первые строки каждой и сливаются по rank.
+        offset = start if len(databases) == 1 else 0
+        rows = sorted(row for using in databases
+                      for row in self.rows(using, key.stop - offset, offset))
+        rows = rows[start - offset:key.stop - offset]
+        by_db = {}
+        for _, pk, _ in rows:
+            by_db.setdefault(shards.for_post(pk), []).append(pk)
+        posts = {}
+        for using, ids in by_db.items():
+            posts.update(shards.related(Post.objects.using(using),
+                                        'author', 'group').in_bulk(ids))
+        results = []
+        for _, pk, snippet in rows:
+            post = posts.get(pk)
+            if post is not None:
+                post.snippet = highlight(snippet)
+                results.append(post)
+        return results
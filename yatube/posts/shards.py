@@ -0,0 +1,323 @@
+"""Разбиение постов и комментариев по базам-шардам по автору.
+
+Выключено, пока список ``POST_SHARDS`` пуст. Включенное, оно держит
+посты автора в шарде ``POST_SHARDS[author_id % N]``, а комментарии и
+варианты картинок — в шарде их поста. Пользователи, группы, подписки и
+счетчики остаются в основной базе, первым шардом тоже служит она.
+
+Первичные ключи постов и комментариев у каждого шарда свои: счетчик
+AUTOINCREMENT шарда с номером ``i`` начинается с ``i << SHARD_BITS``,
+поэтому шард поста известен по одному его id и страница поста читает
+ровно одну базу. Ленты автора тоже читают один шард, а главная и лента
+группы — все шарды параллельно, со слиянием по ключу сортировки
+(``MergedFeed``).
+
+Связи между базами SQLite не проверяет, поэтому в шардах, кроме
+основной базы, внешние ключи выключены. Полнотекстовый индекс у каждого
+шарда свой, поиск опрашивает все. Импорт и синтетические данные пишут
+только в основную базу и при включенных шардах отказываются работать
+(``require_default``), пересчет счетчиков тоже читает только ее.
+
+Запросы ``MergedFeed`` к базе первого из них выполняются в потоке
+вызова, к остальным базам — в пуле потоков. Соединения потоков пула
+остаются открытыми и служат следующим запросам: у каждого потока свои,
+их число ограничено ``POST_SHARD_WORKERS`` на шард.
+"""
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import cmp_to_key
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, models
+from django.db.models import Count, Max, Min, Sum, prefetch_related_objects
+
+from core.queries import active_stats, record_queries
+
+SHARD_BITS = 40
+SHARDED_MODELS = ('post', 'comment', 'postimagevariant')
+SEQUENCE_TABLES = ('posts_post', 'posts_comment')
+
+executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'POST_SHARD_WORKERS', 4),
+    thread_name_prefix='shards')
+
+
+def aliases():
+    return getattr(settings, 'POST_SHARDS', [])
+
+
+def enabled():
+    return bool(aliases())
+
+
+def databases():
+    """Базы с постами: шарды или одна основная."""
+    return aliases() or [DEFAULT_DB_ALIAS]
+
+
+def require_default(feature):
+    """Отказать, если посты разложены по шардам."""
+    if enabled():
+        raise ImproperlyConfigured(
+            f'{feature} работает только с основной базой, '
+            f'а посты разложены по шардам (POST_SHARDS).')
+
+
+def for_author(author_id):
+    shards = aliases()
+    return shards[author_id % len(shards)] if shards else DEFAULT_DB_ALIAS
+
+
+def for_post(post_id):
+    shards = aliases()
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    index = int(post_id) >> SHARD_BITS
+    return shards[index] if index < len(shards) else DEFAULT_DB_ALIAS
+
+
+def related(queryset, *fields):
+    """Связанные объекты: JOIN в одной базе, отдельный запрос из шарда."""
+    if enabled():
+        return queryset.prefetch_related(*fields)
+    return queryset.select_related(*fields)
+
+
+def prefetch(objects, *lookups):
+    """``prefetch_related_objects`` для объектов из разных шардов."""
+    by_db = {}
+    for obj in objects:
+        by_db.setdefault(obj._state.db, []).append(obj)
+    for group in by_db.values():
+        prefetch_related_objects(group, *lookups)
+
+
+def configure(connection):
+    if connection.alias in aliases() and connection.alias != DEFAULT_DB_ALIAS:
+        connection.connection.execute('PRAGMA foreign_keys = OFF')
+
+
+def install_sequences(connection):
+    """Начать id постов и комментариев шарда с его диапазона."""
+    shards = aliases()
+    if connection.alias not in shards:
+        return
+    base = shards.index(connection.alias) << SHARD_BITS
+    if not base:
+        return
+    with connection.cursor() as cursor:
+        for table in SEQUENCE_TABLES:
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s',
+                           [table])
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) '
+                               'VALUES (%s, %s)', [table, base])
+            elif row[0] < base:
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s '
+                               'WHERE name = %s', [base, table])
+
+
+class ShardRouter:
+    """Шард для постов, комментариев и вариантов картинок.
+
+    Шард берется из объекта-подсказки: своего (при записи), поста (для
+    ``post.comments``) или автора (для ``author.posts``). Без подсказки
+    решает следующий роутер, поэтому запросы по всем шардам строятся
+    явно через ``ShardedManager``.
+    """
+
+    def db_for(self, model, instance=None, **hints):
+        if not enabled() or model._meta.model_name not in SHARDED_MODELS:
+            return None
+        if instance is None:
+            return None
+        name = instance._meta.model_name
+        if name == 'post':
+            return for_author(instance.author_id)
+        if name in SHARDED_MODELS:
+            return for_post(instance.post_id)
+        if name == 'user' and model._meta.model_name == 'post':
+            return for_author(instance.pk)
+        return None
+
+    db_for_read = db_for
+    db_for_write = db_for
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if enabled():
+            return True
+        return None
+
+
+class RoutedManager(models.Manager):
+    """Менеджер, который создает объект в базе, выбранной роутером."""
+
+    def create(self, **kwargs):
+        # QuerySet.create пишет в базу запроса, а шард зависит от объекта.
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+
+class ShardedManager(RoutedManager):
+    """Менеджер постов: запросы к шарду поста, автора или ко всем."""
+
+    def for_pk(self, pk):
+        return self.using(for_post(pk)).filter(pk=pk)
+
+    def for_author(self, author_id):
+        return self.using(for_author(author_id)).filter(author_id=author_id)
+
+    def everywhere(self):
+        """Запрос по всем шардам: ``MergedFeed`` или обычный QuerySet."""
+        if not enabled():
+            return self.all()
+        return MergedFeed([self.using(alias) for alias in aliases()])
+
+
+def fetch(queryset):
+    return list(queryset)
+
+
+def count(queryset):
+    return queryset.count()
+
+
+def aggregate(queryset, kwargs):
+    return queryset.aggregate(**kwargs)
+
+
+def counted(stats, function, *args):
+    with ExitStack() as stack:
+        for item in stats:
+            stack.enter_context(record_queries(item))
+        return function(*args)
+
+
+def run(function, querysets, *args):
+    """``function`` для каждого запроса в порядке запросов.
+
+    Запросы к базе первого запроса выполняются в этом потоке, к
+    остальным базам — в пуле. Запросы пула идут в счет ``record_queries``
+    вызывающего потока.
+    """
+    local = querysets[0].db
+    stats = active_stats()
+    futures = [None if queryset.db == local
+               else executor.submit(counted, stats, function, queryset, *args)
+               for queryset in querysets]
+    return [function(queryset, *args) if future is None
+            else future.result()
+            for queryset, future in zip(querysets, futures)]
+
+
+def combine_sum(values):
+    return sum(values)
+
+
+# Как свести значения агрегата из шардов в одно.
+COMBINE = {Max: max, Min: min, Sum: combine_sum, Count: combine_sum}
+
+
+def ordering_key(queryset):
+    """Функция сравнения объектов или кортежей по ORDER BY запроса."""
+    query = queryset.query
+    ordering = query.order_by or queryset.model._meta.ordering
+    if not query.standard_ordering:
+        ordering = [name[1:] if name.startswith('-') else f'-{name}'
+                    for name in ordering]
+    fields = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+    names = getattr(queryset, '_fields', None)
+    if names:
+        # Кортежи ``values_list`` идут в порядке перечисленных полей.
+        position = {name: index for index, name in enumerate(names)}
+
+        def value(row, name):
+            return row[position[name]]
+    else:
+        def value(row, name):
+            return getattr(row, name)
+
+    def compare(left, right):
+        for name, descending in fields:
+            a, b = value(left, name), value(right, name)
+            if a != b:
+                return (-1 if a < b else 1) * (-1 if descending else 1)
+        return 0
+
+    return cmp_to_key(compare)
+
+
+class MergedFeed:
+    """Запрос, выполняемый во всех шардах сразу.
+
+    Поддерживает то, что нужно ``KeysetPaginator``: цепочки методов
+    QuerySet, срезы, ``count`` и ``aggregate``. Срез ``[a:b]`` читает из
+    каждого шарда первые ``b`` строк параллельно и сливает их по ORDER BY.
+    """
+
+    ordered = True
+
+    def __init__(self, querysets):
+        self.querysets = querysets
+
+    @property
+    def model(self):
+        return self.querysets[0].model
+
+    @property
+    def query(self):
+        return self.querysets[0].query
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            return MergedFeed([getattr(queryset, name)(*args, **kwargs)
+                               for queryset in self.querysets])
+        return method
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        querysets = self.querysets
+        if stop is not None:
+            querysets = [queryset[:stop] for queryset in querysets]
+        results = run(fetch, querysets)
+        merged = heapq.merge(*results, key=ordering_key(self.querysets[0]))
+        return list(merged)[start:stop]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __len__(self):
+        return len(self[:])
+
+    def count(self):
+        return sum(run(count, self.querysets))
+
+    def aggregate(self, **kwargs):
+        """Агрегаты по шардам: ``Max``, ``Min``, ``Sum`` и ``Count``.
+
+        Другие агрегаты и ``Count(distinct=True)`` из значений шардов не
+        сводятся, для них ``TypeError``.
+        """
+        combine = {}
+        for name, expression in kwargs.items():
+            combine[name] = COMBINE.get(type(expression))
+            if combine[name] is None or getattr(expression, 'distinct',
+                                                False):
+                raise TypeError(
+                    f'{expression!r} нельзя свести по шардам')
+        results = run(aggregate, self.querysets, kwargs)
+        totals = {}
+        for name in kwargs:
+            values = [result[name] for result in results
+                      if result[name] is not None]
+            totals[name] = combine[name](values) if values else None
+        return totals
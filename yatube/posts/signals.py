@@ -0,0 +1,118 @@
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (
+    post_delete, post_migrate, post_save, pre_save)
+from django.dispatch import receiver
+
+from core.cache import bump_version
+
+from . import counters, follow_graph, fragments, search, shards, timeline
+from .constants import FEED_VERSION_KEY, NAMES_VERSION_KEY
+from .models import Comment, Follow, Group, Post, UserCounters
+
+User = get_user_model()
+
+FRAGMENT_USER_FIELDS = {'username', 'first_name', 'last_name'}
+
+
+def changed(kind, pk):
+    """Сбросить фрагменты объекта и закэшированные ленты."""
+    fragments.bump(kind, pk)
+    bump_version(FEED_VERSION_KEY)
+    if kind != 'post':
+        bump_version(NAMES_VERSION_KEY)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, update_fields=None,
+               **kwargs):
+    if created and not raw:
+        UserCounters.objects.get_or_create(user=instance)
+    if update_fields is None or set(update_fields) & FRAGMENT_USER_FIELDS:
+        changed('user', instance.pk)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    changed('group', instance.pk)
+
+
+@receiver(pre_save, sender=Post)
+def post_changing(sender, instance, raw=False, **kwargs):
+    if instance.pk is not None and not raw:
+        instance._saved_group_id = (
+            Post.objects.for_pk(instance.pk)
+            .values_list('group_id', flat=True).first())
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    changed('post', instance.pk)
+    if raw:
+        return
+    if created:
+        counters.change_user(instance.author_id, posts_count=1)
+        counters.change_group(instance.group_id, 1)
+        # Записи ленты подписок в основной базе не могут ссылаться на
+        # посты из шардов, с шардами лента собирается при чтении.
+        if not shards.enabled():
+            timeline.fan_out(instance)
+        return
+    saved_group_id = getattr(instance, '_saved_group_id', instance.group_id)
+    if saved_group_id != instance.group_id:
+        counters.change_group(saved_group_id, -1)
+        counters.change_group(instance.group_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    changed('post', instance.pk)
+    counters.change_user(instance.author_id, posts_count=-1)
+    counters.change_group(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_post(instance.post_id, 1)
+        changed('post', instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.change_post(instance.post_id, -1)
+    changed('post', instance.post_id)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        follow_graph.add(instance.user_id, instance.author_id)
+        counters.change_user(instance.author_id, followers_count=1)
+        counters.change_user(instance.user_id, following_count=1)
+        if not shards.enabled():
+            timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    follow_graph.remove(instance.user_id, instance.author_id)
+    counters.change_user(instance.author_id, followers_count=-1)
+    counters.change_user(instance.user_id, following_count=-1)
+    if not shards.enabled():
+        timeline.prune(instance.user_id, instance.author_id)
+
+
+@receiver(post_migrate)
+def search_index_installed(sender, using, **kwargs):
+    # Миграции могут пересоздать таблицу постов вместе с триггерами.
+    if sender.name == 'posts':
+        search.install(connections[using])
+        shards.install_sequences(connections[using])
+
+
+@receiver(connection_created)
+def shard_connected(sender, connection, **kwargs):
+    shards.configure(connection)
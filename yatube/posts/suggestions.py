@@ -0,0 +1,142 @@
+"""Рекомендации «на кого подписаться», которые считает фоновая задача.
+
+Команда ``compute_suggestions`` читает подписки и активность в группах
+в массивы смежности (CSR: ``offsets`` и ``targets`` из ``array('q')``)
+и оценивает кандидатов для каждого пользователя:
+
+* ``FOLLOW_WEIGHT`` за каждого автора, на которого подписан
+  пользователь и который сам подписан на кандидата;
+* ``GROUP_WEIGHT`` за каждую группу, где писали оба.
+
+Первые ``SUGGESTIONS_PER_USER`` кандидатов записываются в
+``Suggestion``, и страница подписок читает их одним запросом по индексу
+``(user, -score)``. Подписки, сделанные после расчета, отсекает граф
+подписок в кэше (``follow_graph``).
+"""
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+from core.sqlite import immediate
+
+from . import follow_graph, shards
+from .models import Follow, Post, Suggestion, User
+
+TOP_K = getattr(settings, 'SUGGESTIONS_PER_USER', 5)
+FOLLOW_WEIGHT = 1.0
+GROUP_WEIGHT = 0.5
+CHUNK_SIZE = 500
+TYPECODE = 'q'
+
+
+class Adjacency:
+    """Списки смежности в двух массивах, индекс вершины — ее id.
+
+    Строится из пар (вершина, сосед), отсортированных по возрастанию.
+    Соседи вершины ``i`` — ``targets[offsets[i]:offsets[i + 1]]``.
+    """
+
+    def __init__(self, pairs):
+        self.offsets = array(TYPECODE, [0])
+        self.targets = array(TYPECODE)
+        for source, target in pairs:
+            missing = source + 2 - len(self.offsets)
+            if missing > 0:
+                self.offsets.extend([len(self.targets)] * missing)
+            self.targets.append(target)
+            self.offsets[source + 1] = len(self.targets)
+
+    def __getitem__(self, index):
+        if index + 1 >= len(self.offsets):
+            return self.targets[:0]
+        return self.targets[self.offsets[index]:self.offsets[index + 1]]
+
+
+def contains(ids, value):
+    position = bisect_left(ids, value)
+    return position < len(ids) and ids[position] == value
+
+
+def group_pairs():
+    """Пары (автор, группа) по постам во всех шардах."""
+    pairs = set()
+    for using in shards.databases():
+        pairs.update(Post.objects.using(using).filter(group__isnull=False)
+                     .values_list('author_id', 'group_id').distinct()
+                     .iterator())
+    return pairs
+
+
+def load():
+    """Подписки, группы пользователей и авторы групп в массивах."""
+    following = Adjacency(
+        Follow.objects.order_by('user_id', 'author_id')
+        .values_list('user_id', 'author_id').iterator())
+    pairs = group_pairs()
+    groups = Adjacency(sorted(pairs))
+    members = Adjacency(sorted((group, author) for author, group in pairs))
+    return following, groups, members
+
+
+def score(user_id, following, groups, members, top=TOP_K):
+    """Первые ``top`` пар (автор, оценка) для пользователя."""
+    scores = defaultdict(float)
+    followed = following[user_id]
+    for author_id in followed:
+        for candidate in following[author_id]:
+            scores[candidate] += FOLLOW_WEIGHT
+    for group_id in groups[user_id]:
+        for candidate in members[group_id]:
+            scores[candidate] += GROUP_WEIGHT
+    scores.pop(user_id, None)
+    # При равной оценке выше автор с меньшим id, чтобы порядок был
+    # одинаковым от запуска к запуску.
+    return heapq.nlargest(
+        top,
+        ((candidate, value) for candidate, value in scores.items()
+         if not contains(followed, candidate)),
+        key=lambda item: (item[1], -item[0]))
+
+
+def store(user_ids, suggestions):
+    with immediate():
+        Suggestion.objects.filter(user_id__in=user_ids).delete()
+        Suggestion.objects.bulk_create(suggestions)
+
+
+def compute(top=TOP_K, chunk_size=CHUNK_SIZE):
+    """Пересчитать рекомендации всех пользователей.
+
+    Старые рекомендации заменяются пачками по ``chunk_size``
+    пользователей, поэтому страница подписок не видит пустую таблицу.
+    Возвращает число пользователей и записанных рекомендаций.
+    """
+    following, groups, members = load()
+    user_ids = list(User.objects.order_by('pk')
+                    .values_list('pk', flat=True))
+    stored = 0
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        suggestions = [
+            Suggestion(user_id=user_id, author_id=author_id, score=value)
+            for user_id in chunk
+            for author_id, value in score(user_id, following, groups,
+                                          members, top)
+        ]
+        store(chunk, suggestions)
+        stored += len(suggestions)
+    return {'users': len(user_ids), 'suggestions': stored}
+
+
+def ranked(user):
+    return (Suggestion.objects.filter(user=user)
+            .select_related('author').order_by('-score'))
+
+
+def for_user(user, limit=TOP_K):
+    """Авторы для боковой панели без тех, на кого уже подписан."""
+    return [suggestion.author for suggestion in ranked(user)[:limit]
+            if not follow_graph.is_following(user.pk, suggestion.author_id)]
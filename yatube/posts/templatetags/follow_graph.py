@@ -0,0 +1,15 @@
+from django import template
+
+from posts import follow_graph
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def followed_authors(context, posts):
+    """Id авторов страницы, на которых подписан пользователь."""
+    user = context['request'].user
+    if not user.is_authenticated:
+        return set()
+    return follow_graph.followed_among(
+        user.pk, {post.author_id for post in posts})
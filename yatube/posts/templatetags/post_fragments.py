@@ -0,0 +1,10 @@
+from django import template
+
+from posts import fragments
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_fragments(context, posts):
+    return fragments.render_many(posts, group=context.get('group'))
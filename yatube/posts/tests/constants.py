@@ -1,3 +1,5 @@
+import hashlib
+
 
 CREATE_POST_TEMPLATE = 'posts/create_post.html'
 INDEX_TEMPLATE = 'posts/index.html'
@@ -5,6 +7,7 @@ FOLLOW_PAGE_TEMPLATE = 'posts/follow.html'
 GROUP_LIST_TEMPLATE = 'posts/group_list.html'
 PROFILE_TEMPLATE = 'posts/profile.html'
 POST_DETAIL_TEMPLATE = 'posts/post_detail.html'
+POPULAR_TEMPLATE = 'posts/popular.html'
 UNEXISTING_PAGE_TEMPLATE = 'core/404.html'
 
 
@@ -16,6 +19,9 @@ PROFILE_URL = 'posts:profile'
 POST_DETAIL_URL = 'posts:post_detail'
 UNEXISTING_PAGE_URL = '/unexisting_page/'
 UPDATE_POST_URL = 'posts:update_post'
+SEARCH_URL = 'posts:search'
+POPULAR_URL = 'posts:popular'
+EXPORT_URL = 'posts:export'
 
 ADD_COMMENT_URL = 'posts:add_comment'
 PROFILE_FOLLOW_URL = 'posts:profile_follow'
@@ -30,4 +36,11 @@ TEST_IMAGE = (
     b'\x0A\x00\x3B'
 )
 NAME_OF_IMAGE = 'test.gif'
-IMAGE = f'posts/{NAME_OF_IMAGE}'
+IMAGE_HASH = hashlib.sha256(TEST_IMAGE).hexdigest()
+IMAGE = f'posts/{IMAGE_HASH[:2]}/{IMAGE_HASH[2:4]}/{IMAGE_HASH}.gif'
+
+API_INDEX_URL = 'api:index'
+API_GROUP_LIST_URL = 'api:group_list'
+API_PROFILE_URL = 'api:profile'
+API_POST_DETAIL_URL = 'api:post_detail'
+API_FOLLOW_URL = 'api:follow_index'
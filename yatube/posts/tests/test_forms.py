@@ -1,7 +1,11 @@
-
+import os
 import shutil
 import tempfile
+from io import StringIO
 
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
 from django.test import Client, override_settings, TestCase
 from django.urls import reverse
 from django.conf import settings
@@ -115,3 +119,58 @@ class PostFormTest(TestCase):
         self.assertEqual(Post.objects.count(), comments_count + 1)
         comment = Comment.objects.first()
         self.assertEqual(comment.text, form_data['text'])
+
+    def test_same_image_stored_once(self):
+        '''Одинаковые картинки хранятся одним файлом.'''
+        for text in ('Первый пост', 'Второй пост'):
+            self.authorized_client.post(reverse(CREATE_POST_URL), data={
+                'text': text,
+                'image': SimpleUploadedFile(
+                    name=NAME_OF_IMAGE,
+                    content=TEST_IMAGE,
+                    content_type='image/gif'
+                ),
+            })
+        images = set(Post.objects.exclude(image='')
+                     .values_list('image', flat=True))
+        self.assertEqual(images, {IMAGE})
+        directory = os.path.join(TEMP_MEDIA_ROOT, os.path.dirname(IMAGE))
+        self.assertEqual(os.listdir(directory), [os.path.basename(IMAGE)])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MigrateMediaTest(TestCase):
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_migrate_media(self):
+        '''Команда переносит старые файлы в раскладку по хэшу.'''
+        user = User.objects.create_user(username='auth')
+        storage = FileSystemStorage()
+        old_names = [storage.save(f'posts/{name}', ContentFile(TEST_IMAGE))
+                     for name in ('first.gif', 'second.gif')]
+        for name in old_names:
+            post = Post.objects.create(author=user, text=name)
+            Post.objects.filter(pk=post.pk).update(image=name)
+        call_command('migrate_media', stdout=StringIO())
+        self.assertEqual(set(Post.objects.values_list('image', flat=True)),
+                         {IMAGE})
+        self.assertTrue(storage.exists(IMAGE))
+        for name in old_names:
+            self.assertFalse(storage.exists(name))
+
+    def test_shared_file_moved_for_every_post(self):
+        '''Файл нескольких постов переносится для всех и удаляется
+        один раз.'''
+        user = User.objects.create_user(username='auth')
+        storage = FileSystemStorage()
+        name = storage.save('posts/shared.gif', ContentFile(TEST_IMAGE))
+        for text in ('first', 'second'):
+            post = Post.objects.create(author=user, text=text)
+            Post.objects.filter(pk=post.pk).update(image=name)
+        out = StringIO()
+        call_command('migrate_media', chunk_size=1, stdout=out)
+        self.assertEqual(list(Post.objects.values_list('image', flat=True)),
+                         [IMAGE, IMAGE])
+        self.assertFalse(storage.exists(name))
+        self.assertIn('files: 1, posts: 2, missing: 0', out.getvalue())
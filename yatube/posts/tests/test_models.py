@@ -1,7 +1,19 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from itertools import islice
 
-from django.test import TestCase
 
-from posts.models import Comment, Follow, Group, Post, User
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from posts import benchmark, importer
+from posts.models import (Comment, Follow, Group, Post, TimelineEntry, User,
+                          UserCounters)
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
 class PostModelTest(TestCase):
@@ -91,3 +103,201 @@ class PostModelTest(TestCase):
                 self.assertEqual(
                     self.follow._meta.get_field(field).verbose_name,
                     expected_value)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.follower = User.objects.create_user(username='follower')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.group2 = Group.objects.create(
+            title='Тестовая группа 2',
+            slug='test-slug2',
+            description='Тестовое описание 2',
+        )
+
+    def assertCounters(self, user, **expected):
+        counters = UserCounters.objects.get(user=user)
+        for field, value in expected.items():
+            with self.subTest(field=field):
+                self.assertEqual(getattr(counters, field), value)
+
+    def test_post_counters(self):
+        """Счетчики постов автора и группы меняются вместе с постами."""
+        post = Post.objects.create(author=self.user, text='Пост',
+                                   group=self.group)
+        self.assertCounters(self.user, posts_count=1)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 1)
+        post.group = self.group2
+        post.save()
+        self.group.refresh_from_db()
+        self.group2.refresh_from_db()
+        self.assertEqual((self.group.posts_count, self.group2.posts_count),
+                         (0, 1))
+        post.delete()
+        self.assertCounters(self.user, posts_count=0)
+        self.group2.refresh_from_db()
+        self.assertEqual(self.group2.posts_count, 0)
+
+    def test_comment_and_follow_counters(self):
+        """Счетчики комментариев и подписок меняются вместе с записями."""
+        post = Post.objects.create(author=self.user, text='Пост')
+        comment = Comment.objects.create(post=post, author=self.follower,
+                                         text='Комментарий')
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        follow = Follow.objects.create(user=self.follower, author=self.user)
+        self.assertCounters(self.user, followers_count=1)
+        self.assertCounters(self.follower, following_count=1)
+        follow.delete()
+        self.assertCounters(self.user, followers_count=0)
+        self.assertCounters(self.follower, following_count=0)
+
+    def test_recount_counters_repairs_drift(self):
+        """Команда recount_counters исправляет разошедшиеся счетчики."""
+        post = Post.objects.create(author=self.user, text='Пост',
+                                   group=self.group)
+        Comment.objects.create(post=post, author=self.user, text='Текст')
+        Follow.objects.create(user=self.follower, author=self.user)
+        UserCounters.objects.update(posts_count=7, followers_count=7)
+        UserCounters.objects.filter(user=self.follower).delete()
+        Group.objects.update(posts_count=7)
+        Post.objects.update(comments_count=7)
+        call_command('recount_counters', chunk_size=1, stdout=StringIO())
+        self.assertCounters(self.user, posts_count=1, followers_count=1)
+        self.assertCounters(self.follower, following_count=1)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 1)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class DatasetTest(TestCase):
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_generate_dataset(self):
+        '''Команда создает данные и пересчитывает счетчики и ленты.'''
+        call_command('generate_dataset', users=20, groups=3, posts=200,
+                     comments=300, follows=60, images=2, seed=1,
+                     batch_size=50, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 300)
+        self.assertLessEqual(
+            Post.objects.exclude(image='').values('image').distinct()
+            .count(), 2)
+        author = UserCounters.objects.order_by('-followers_count').first()
+        self.assertEqual(author.followers_count,
+                         Follow.objects.filter(author=author.user).count())
+        self.assertEqual(
+            TimelineEntry.objects.count(),
+            sum(Post.objects.filter(author_id=author_id).count()
+                for author_id in Follow.objects.values_list(
+                    'author_id', flat=True)))
+        dates = Post.objects.values_list('pub_date', flat=True)
+        self.assertGreater(len(set(date.date() for date in dates)), 1)
+
+
+class BenchmarkReportTest(TestCase):
+    def test_report_percentiles(self):
+        '''Отчет замера считает перцентили и ошибки по представлениям.'''
+        samples = [('index', number / 1000, 200) for number in range(1, 101)]
+        samples.append(('create', 0.5, 500))
+        result = benchmark.report(samples, duration=2)
+        index = result['views']['index']
+        self.assertEqual(index['p50_ms'], 50)
+        self.assertEqual(index['p95_ms'], 95)
+        self.assertEqual(index['p99_ms'], 99)
+        self.assertEqual(index['throughput'], 50)
+        self.assertEqual(result['views']['create']['errors'], 1)
+
+
+class ImportDataTest(TestCase):
+    RECORDS = (
+        '{"type": "post", "id": 501, "author": "leo", "text": "Первый",'
+        ' "group": "cats", "pub_date": "2020-01-01T10:00:00"}\n'
+        '{"type": "post", "id": 502, "author": "leo", "text": "Второй"}\n'
+        '{"type": "comment", "post": 501, "author": "ann", "text": "Да"}\n'
+        'не JSON\n'
+        '{"type": "follow", "user": "ann", "author": "leo"}\n'
+    )
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(handle, 'w') as output:
+            output.write(self.RECORDS)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def import_data(self, path=None, **options):
+        call_command('import_data', path or self.path, stdout=StringIO(),
+                     stderr=StringIO(), **options)
+
+    def test_import_jsonl(self):
+        '''Импорт создает записи, авторов и группы, пересчитывает счетчики.'''
+        self.import_data(batch_size=2)
+        post = Post.objects.get(text='Первый')
+        self.assertEqual(post.author.username, 'leo')
+        self.assertEqual(post.group.slug, 'cats')
+        self.assertEqual(post.pub_date.year, 2020)
+        self.assertEqual(post.comments.get().author.username, 'ann')
+        self.assertEqual(post.comments_count, 1)
+        self.assertTrue(Follow.objects.filter(
+            user__username='ann', author__username='leo').exists())
+        self.assertEqual(TimelineEntry.objects.filter(
+            user__username='ann').count(), 2)
+
+    def test_resume_from_checkpoint(self):
+        '''Прерванный импорт продолжается без повторов.'''
+        name = os.path.abspath(self.path)
+        first = importer.Importer(name, batch_size=2)
+        first.checkpoint()
+        with open(self.path, 'rb') as stream:
+            first.run(islice(importer.read_jsonl(stream), 2))
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertFalse(Comment.objects.exists())
+        self.import_data()
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.import_data()
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_source_ids_not_used_as_keys(self):
+        '''Id из источника не затирает существующий пост, комментарий
+        попадает к импортированному посту.'''
+        author = User.objects.create_user(username='owner')
+        existing = Post.objects.create(pk=501, author=author, text='Свой')
+        runner = importer.Importer(os.path.abspath(self.path))
+        runner.checkpoint()
+        with open(self.path, 'rb') as stream:
+            result = runner.run(importer.read_jsonl(stream))
+        self.assertEqual(result['posts'], 2)
+        self.assertEqual(result['comments'], 1)
+        self.assertFalse(existing.comments.exists())
+        self.assertEqual(
+            Post.objects.get(text='Первый').comments.get().text, 'Да')
+
+    def test_import_csv(self):
+        '''CSV с многострочными полями читается целиком.'''
+        User.objects.create_user(username='leo')
+        with open(self.path, 'w') as output:
+            output.write('author,text,group\nleo,"Две\nстроки",\n'
+                         'nobody,Текст,\n')
+        self.import_data(self.path, format='csv', type='post',
+                         no_create=True)
+        self.assertEqual(list(Post.objects.values_list('text', flat=True)),
+                         ['Две\nстроки'])
@@ -1,15 +1,37 @@
 
+import csv
+import io
+import json
+import os
 import shutil
 import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-from django.test import Client, TestCase, override_settings
+from django.test import (
+    Client, TestCase, TransactionTestCase, override_settings)
 from django.urls import reverse
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import Avg, Count, Max, Min, Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-from posts.models import Post, Group, Comment, Follow, User
+from core.replicas import sync
+from core.testing import FULL_SCAN, QueryBudgetMixin, QueryPlanMixin
+from posts import (export, feeds, follow_graph, importer, search, shards,
+                   suggestions, thumbnails, timeline, trending)
+from posts.models import (Comment, Follow, Group, Post, PostImageVariant,
+                          PostViews, Suggestion, TimelineEntry, User,
+                          UserCounters)
 from posts.forms import PostForm, CommentForm
+from posts.constants import COMMENTS_PER_PAGE
+from posts.paginator import KeysetPaginator
 from posts.tests.constants import (
     INDEX_TEMPLATE,
     GROUP_LIST_TEMPLATE,
@@ -20,14 +42,23 @@ from posts.tests.constants import (
     TEST_IMAGE,
 )
 from posts.tests.constants import (
+    API_FOLLOW_URL,
+    API_GROUP_LIST_URL,
+    API_INDEX_URL,
+    API_POST_DETAIL_URL,
+    API_PROFILE_URL,
     CREATE_POST_URL,
     INDEX_URL,
+    EXPORT_URL,
     FOLLOW_PAGE_URL,
     GROUP_LIST_URL,
     PROFILE_URL,
     PROFILE_FOLLOW_URL,
     PROFILE_UNFOLLOW_URL,
+    POPULAR_TEMPLATE,
+    POPULAR_URL,
     POST_DETAIL_URL,
+    SEARCH_URL,
     UPDATE_POST_URL
 )
 
@@ -223,18 +254,24 @@ class PostPagesTests(TestCase):
                 self.assertEqual(self.post.image, first_object_image)
 
     def test_cache_index_page(self):
-        '''Проверка кэширования главной страницы'''
+        '''Главная страница кэшируется, пока посты не меняются.'''
         response = self.client.get(reverse(INDEX_URL))
-        Post.objects.all().delete()
+        Post.objects.all().update(text='Изменено в обход сигналов')
+        response_before_write = self.client.get(reverse(INDEX_URL)).content
+        self.assertEqual(response.content, response_before_write)
+        Post.objects.create(author=self.user, text='Новый пост')
         response = self.client.get(reverse(INDEX_URL))
-        response_before_cache_clear = response.content
-        self.assertEqual(response.content,
-                         response_before_cache_clear)
-        cache.clear()
+        self.assertNotEqual(response_before_write, response.content)
+        self.assertContains(response, 'Новый пост')
+
+    def test_cache_index_page_variants(self):
+        '''Анонимный и авторизованный пользователи получают
+        разные копии главной страницы.'''
+        self.client.get(reverse(INDEX_URL))
+        response = self.authorized_client.get(reverse(INDEX_URL))
+        self.assertContains(response, 'Пользователь: auth')
         response = self.client.get(reverse(INDEX_URL))
-        after_cache_clear_content = response.content
-        self.assertNotEqual(response_before_cache_clear,
-                            after_cache_clear_content)
+        self.assertNotContains(response, 'Пользователь: auth')
 
     def test_authorised_user_following_authors(self):
         '''Авторизованный пользователь может подписываться на других
@@ -263,3 +300,1155 @@ class PostPagesTests(TestCase):
                                             args=[self.user.username]))
         response = self.authorized_client1.get(reverse(FOLLOW_PAGE_URL))
         self.assertNotEqual(post, response.context['page_obj'].object_list[0])
+
+
+class PaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        Post.objects.bulk_create(
+            Post(author=cls.user, text='Тестовый пост' + str(i))
+            for i in range(35)
+        )
+        cls.expected = list(Post.objects.order_by('-pub_date', '-pk'))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cursor_pages_match_offset_pages(self):
+        '''Страницы по курсору совпадают со страницами по номеру.'''
+        response = self.client.get(reverse(INDEX_URL))
+        paginator = response.context['page_obj'].paginator
+        for number, query in paginator.links[1:]:
+            with self.subTest(number=number):
+                self.assertIn('after=', query)
+                cache.clear()
+                response = self.client.get(f'{reverse(INDEX_URL)}?{query}')
+                page_obj = response.context['page_obj']
+                self.assertEqual(page_obj.number, number)
+                self.assertEqual(
+                    list(page_obj),
+                    self.expected[(number - 1) * 10:number * 10])
+
+    def test_previous_page_by_cursor(self):
+        '''Ссылка назад с курсором before ведет на предыдущую страницу.'''
+        response = self.client.get(f'{reverse(INDEX_URL)}?page=3')
+        query = response.context['page_obj'].paginator.previous_query
+        self.assertIn('before=', query)
+        cache.clear()
+        response = self.client.get(f'{reverse(INDEX_URL)}?{query}')
+        self.assertEqual(list(response.context['page_obj']),
+                         self.expected[10:20])
+
+    def test_page_links_window(self):
+        '''Выводится только окно ссылок вокруг текущей страницы.'''
+        response = self.client.get(reverse(INDEX_URL))
+        page_obj = response.context['page_obj']
+        self.assertEqual(list(page_obj.paginator.page_range), [1, 2, 3])
+        self.assertTrue(page_obj.has_next())
+        response = self.client.get(f'{reverse(INDEX_URL)}?page=100')
+        self.assertEqual(response.context['page_obj'].number, 4)
+        self.assertFalse(response.context['page_obj'].has_next())
+
+
+class TimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.old_post = Post.objects.create(author=cls.author, text='Старый')
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def feed(self):
+        response = self.reader_client.get(reverse(FOLLOW_PAGE_URL))
+        return list(response.context['page_obj'])
+
+    def test_follow_backfills_and_unfollow_prunes_timeline(self):
+        '''Подписка добавляет посты автора в ленту, отписка убирает.'''
+        self.reader_client.get(reverse(PROFILE_FOLLOW_URL,
+                                       args=[self.author.username]))
+        new_post = Post.objects.create(author=self.author, text='Новый')
+        self.assertEqual(self.feed(), [new_post, self.old_post])
+        self.assertEqual(TimelineEntry.objects.filter(
+            user=self.reader).count(), 2)
+        self.reader_client.get(reverse(PROFILE_UNFOLLOW_URL,
+                                       args=[self.author.username]))
+        self.assertEqual(self.feed(), [])
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    def test_celebrity_posts_are_merged_on_read(self):
+        '''Посты популярного автора не раскладываются при записи,
+        а сливаются с лентой при чтении, которое ничего не пишет.'''
+        Follow.objects.create(user=self.reader, author=self.author)
+        with mock.patch.object(timeline, 'FANOUT_LIMIT', 0):
+            new_post = Post.objects.create(author=self.author, text='Новый')
+            self.assertEqual(self.feed(), [new_post, self.old_post])
+            self.assertFalse(TimelineEntry.objects.filter(
+                post=new_post).exists())
+
+    def test_fanout_resumed_only_by_command_below_threshold(self):
+        '''Отписка не раскладывает пропущенные посты; команда делает это,
+        когда подписчиков стало не больше порога возобновления.'''
+        others = [User.objects.create_user(username=f'other{number}')
+                  for number in range(2)]
+        for user in (self.reader, *others):
+            Follow.objects.create(user=user, author=self.author)
+        with mock.patch.object(timeline, 'FANOUT_LIMIT', 2), \
+                mock.patch.object(timeline, 'RESUME_LIMIT', 1):
+            new_post = Post.objects.create(author=self.author, text='Новый')
+            Follow.objects.filter(user=others[0]).delete()
+            call_command('resume_timelines', stdout=StringIO())
+            self.assertFalse(TimelineEntry.objects.filter(
+                post=new_post).exists())
+            self.assertEqual(self.feed(), [new_post, self.old_post])
+            Follow.objects.filter(user=others[1]).delete()
+            call_command('resume_timelines', stdout=StringIO())
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=new_post).exists())
+        self.assertIsNone(UserCounters.objects.get(
+            user=self.author).fanout_paused)
+        self.assertEqual(self.feed(), [new_post, self.old_post])
+
+
+class PostFragmentCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(author=cls.user, text='Старый текст',
+                                       group=cls.group)
+        cls.url = reverse(PROFILE_URL, args=[cls.user.username])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_fragment_is_cached_until_post_changes(self):
+        '''Фрагмент поста берется из кэша, пока пост не изменился.'''
+        self.client.get(self.url)
+        Post.objects.filter(pk=self.post.pk).update(text='Новый текст')
+        self.assertContains(self.client.get(self.url), 'Старый текст')
+        self.post.refresh_from_db()
+        self.post.save()
+        self.assertContains(self.client.get(self.url), 'Новый текст')
+
+    def test_fragment_invalidated_by_author_and_group(self):
+        '''Фрагмент перерисовывается при изменении автора и группы.'''
+        self.client.get(self.url)
+        self.user.first_name = 'Лев'
+        self.user.save()
+        self.assertContains(self.client.get(self.url), 'Лев')
+        self.group.slug = 'new-slug'
+        self.group.save()
+        self.assertContains(self.client.get(self.url), '/group/new-slug/')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailPregenerationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(name=NAME_OF_IMAGE, content=TEST_IMAGE,
+                                     content_type='image/gif'),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        thumbnails.pending.clear()
+
+    def test_original_image_until_variants_ready(self):
+        '''Пока вариантов картинки нет, выводится исходная картинка,
+        а подготовка вариантов ставится в очередь.'''
+        with mock.patch.object(thumbnails, 'get_thumbnail') as get:
+            response = self.client.get(reverse(POST_DETAIL_URL,
+                                               args=[self.post.id]))
+        get.assert_not_called()
+        self.assertContains(response, self.post.image.url)
+        self.assertFalse(
+            PostImageVariant.objects.filter(post=self.post).exists())
+
+    def test_variants_generated_after_commit(self):
+        '''После коммита варианты для тестовой базы создаются сразу,
+        без пула потоков.'''
+        with mock.patch('django.db.transaction.on_commit',
+                        side_effect=lambda func, using=None: func()), \
+                mock.patch.object(thumbnails.executor, 'submit') as submit:
+            self.client.get(reverse(POST_DETAIL_URL, args=[self.post.id]))
+        submit.assert_not_called()
+        self.assertTrue(
+            PostImageVariant.objects.filter(post=self.post).exists())
+        self.assertNotIn(self.post.id, thumbnails.pending)
+
+    def test_rollback_leaves_nothing_pending(self):
+        '''Откат транзакции не оставляет пост в очереди.'''
+        with self.assertRaises(DatabaseError):
+            with transaction.atomic():
+                thumbnails.queue_post(self.post)
+                raise DatabaseError
+        self.assertNotIn(self.post.id, thumbnails.pending)
+
+    def test_variants_used_when_ready(self):
+        '''Готовые варианты выводятся через srcset с размерами.'''
+        thumbnails.generate(self.post.id)
+        variants = PostImageVariant.objects.filter(post=self.post)
+        self.assertEqual(
+            variants.count(),
+            len(thumbnails.FORMATS) * len(thumbnails.VARIANT_WIDTHS))
+        response = self.client.get(reverse(POST_DETAIL_URL,
+                                           args=[self.post.id]))
+        variant = variants.get(format='jpeg', width=960)
+        self.assertContains(response, f'{variant.image.url} 960w')
+        self.assertContains(response, 'width="960" height="339"')
+        self.assertContains(response, 'loading="lazy"')
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(
+            author=cls.user, text='Кошки любят <b>рыбу</b> и молоко')
+        Post.objects.bulk_create([
+            Post(author=cls.user, text=f'Пост {number} про собак')
+            for number in range(12)
+        ])
+
+    def search(self, query, **params):
+        return self.client.get(reverse(SEARCH_URL), {'q': query, **params})
+
+    def test_search_highlights_escaped_snippet(self):
+        '''Найденный текст подсвечивается, HTML в нем экранируется.'''
+        response = self.search('рыбу')
+        self.assertEqual(list(response.context['page_obj']), [self.post])
+        self.assertContains(response, '&lt;b&gt;<mark>рыбу</mark>')
+
+    def test_search_paginates_and_keeps_query(self):
+        '''Результаты делятся на страницы, запрос сохраняется в ссылках.'''
+        response = self.search('собак')
+        self.assertEqual(len(response.context['page_obj']), 10)
+        self.assertEqual(response.context['page_obj'].paginator.count, 12)
+        self.assertContains(response, 'q=%D1%81%D0%BE%D0%B1%D0%B0%D0%BA')
+        response = self.search('собак', page=2)
+        self.assertEqual(len(response.context['page_obj']), 2)
+
+    def test_index_follows_changes(self):
+        '''Индекс обновляется при изменении и удалении постов.'''
+        Post.objects.filter(pk=self.post.pk).update(text='Кошки спят')
+        self.assertFalse(search.SearchResults('рыбу').count())
+        self.assertEqual(search.SearchResults('спят')[0:1], [self.post])
+        Post.objects.filter(pk=self.post.pk).delete()
+        self.assertFalse(search.SearchResults('кошки').count())
+
+    def test_query_syntax_is_not_an_error(self):
+        '''Спецсимволы FTS5 в запросе не ломают поиск.'''
+        for query in ('"', 'AND OR', 'кош*', '(-:', ''):
+            self.assertEqual(self.search(query).status_code, 200)
+        self.assertEqual(list(self.search('кош*').context['page_obj']),
+                         [self.post])
+
+    def test_rebuild_command(self):
+        '''Команда перестраивает индекс по всем постам.'''
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {search.TABLE} ({search.TABLE}) "
+                f"VALUES ('delete-all')")
+        self.assertFalse(search.SearchResults('собак').count())
+        call_command('rebuild_search_index', chunk_size=5, stdout=StringIO())
+        self.assertEqual(search.SearchResults('собак').count(), 12)
+
+
+class PostCommentsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(author=cls.user, text='Тестовый пост')
+        cls.url = reverse(POST_DETAIL_URL, args=[cls.post.id])
+
+    def add_comments(self, count):
+        for number in range(count):
+            author = User.objects.create_user(
+                username=f'reader{Comment.objects.count()}')
+            Comment.objects.create(post=self.post, author=author,
+                                   text=f'Комментарий {number}')
+
+    def queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(self.url)
+        return len(context)
+
+    def test_comments_paginated_in_order(self):
+        '''Комментарии выводятся по дате постранично.'''
+        self.add_comments(25)
+        response = self.client.get(self.url)
+        comments = list(response.context['page_obj'])
+        self.assertEqual(comments, list(Comment.objects.all()[:20]))
+        response = self.client.get(
+            self.url + '?' + response.context['page_obj'].paginator
+            .next_query)
+        self.assertEqual(list(response.context['page_obj']),
+                         list(Comment.objects.all()[20:]))
+
+    def test_comment_authors_without_extra_queries(self):
+        '''Число запросов не растет с числом комментариев.'''
+        self.add_comments(2)
+        queries = self.queries()
+        self.add_comments(15)
+        self.assertEqual(self.queries(), queries)
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='test-slug')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.post = Post.objects.create(author=cls.author, text='Пост',
+                                       group=cls.group)
+        Comment.objects.create(post=cls.post, author=cls.reader,
+                               text='Комментарий')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def add_posts(self, count=12, author=None, group=None):
+        for number in range(count):
+            index = Post.objects.count()
+            Post.objects.create(
+                author=author or User.objects.create_user(
+                    username=f'author{index}'),
+                group=group or Group.objects.create(
+                    title=f'Группа {index}', slug=f'group-{index}'),
+                text=f'Пост {index}')
+        cache.clear()
+
+    def add_comments(self, count=COMMENTS_PER_PAGE + 1):
+        for number in range(count):
+            index = Comment.objects.count()
+            Comment.objects.create(
+                post=self.post, text=f'Комментарий {index}',
+                author=User.objects.create_user(username=f'reader{index}'))
+        cache.clear()
+
+    def test_index_budget(self):
+        '''Главная укладывается в бюджет при любом числе постов.'''
+        self.assertQueriesFlat(self.client, reverse(INDEX_URL),
+                               self.add_posts)
+
+    def test_group_list_budget(self):
+        '''Страница группы укладывается в бюджет.'''
+        self.assertQueriesFlat(
+            self.client, reverse(GROUP_LIST_URL, args=[self.group.slug]),
+            lambda: self.add_posts(group=self.group))
+
+    def test_profile_budget(self):
+        '''Профиль укладывается в бюджет.'''
+        self.assertQueriesFlat(
+            self.client, reverse(PROFILE_URL, args=[self.author.username]),
+            lambda: self.add_posts(author=self.author))
+
+    def test_follow_index_budget(self):
+        '''Лента подписок укладывается в бюджет.'''
+        self.assertQueriesFlat(
+            self.client, reverse(FOLLOW_PAGE_URL),
+            lambda: self.add_posts(author=self.author))
+
+    def test_post_detail_budget(self):
+        '''Страница поста укладывается в бюджет.'''
+        self.assertQueriesFlat(
+            self.client, reverse(POST_DETAIL_URL, args=[self.post.id]),
+            self.add_comments)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(title='Группа', slug='test-slug')
+        cls.post = Post.objects.create(
+            author=cls.user, text='Пост', group=cls.group,
+            image=SimpleUploadedFile(name=NAME_OF_IMAGE, content=TEST_IMAGE,
+                                     content_type='image/gif'))
+        cls.comment = Comment.objects.create(post=cls.post, author=cls.user,
+                                             text='Комментарий')
+        other = User.objects.create_user(username='other')
+        Post.objects.create(author=other, text='Чужой пост')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_ndjson(self):
+        '''Выгрузка NDJSON содержит только свои посты и комментарии.'''
+        response = self.client.get(reverse(EXPORT_URL))
+        self.assertIn('attachment; filename="auth.ndjson"',
+                      response['Content-Disposition'])
+        records = [json.loads(line)
+                   for line in self.content(response).splitlines()]
+        self.assertEqual([record['type'] for record in records],
+                         ['post', 'comment'])
+        self.assertEqual(records[0]['group'], 'test-slug')
+        self.assertEqual(records[0]['image_url'],
+                         f'http://testserver{self.post.image.url}')
+        self.assertEqual(records[1]['post'], self.post.pk)
+
+    def test_export_csv(self):
+        '''Выгрузка CSV начинается с заголовка.'''
+        response = self.client.get(reverse(EXPORT_URL), {'format': 'csv'})
+        rows = list(csv.DictReader(io.StringIO(self.content(response))))
+        self.assertEqual([row['text'] for row in rows],
+                         ['Пост', 'Комментарий'])
+
+    def test_export_command_round_trip(self):
+        '''Выгрузку команды можно загрузить обратно через import_data.'''
+        output = StringIO()
+        call_command('export_user', 'auth', stdout=output)
+        Post.objects.filter(author=self.user).delete()
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as dump:
+            dump.write(output.getvalue())
+            dump.flush()
+            call_command('import_data', dump.name, stdout=StringIO())
+        post = Post.objects.get(author=self.user)
+        self.assertEqual(post.comments.get().text, 'Комментарий')
+        self.assertEqual(post.pub_date, self.post.pub_date)
+
+
+class ApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='test-slug')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        Post.objects.bulk_create(
+            Post(author=cls.author, text=f'Пост {number}')
+            for number in range(EXPECTED_POSTS_ON_FIRST_PAGE))
+        cls.post = Post.objects.create(author=cls.author, text='Пост',
+                                       group=cls.group)
+        Comment.objects.create(post=cls.post, author=cls.reader,
+                               text='Комментарий')
+
+    def setUp(self):
+        cache.clear()
+
+    def get_json(self, url, **extra):
+        response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_index_pages_by_cursor(self):
+        '''Лента API листается по ссылке next до конца.'''
+        data = self.get_json(reverse(API_INDEX_URL))
+        self.assertEqual(len(data['results']), EXPECTED_POSTS_ON_FIRST_PAGE)
+        self.assertEqual(data['results'][0], {
+            'id': self.post.pk, 'author': 'auth', 'group': 'test-slug',
+            'text': 'Пост', 'pub_date': data['results'][0]['pub_date'],
+            'image': None, 'comments_count': 1})
+        self.assertIsNone(data['previous'])
+        self.assertIn('after=', data['next'])
+        rest = self.get_json(data['next'])
+        self.assertEqual(len(rest['results']), 1)
+        self.assertIsNone(rest['next'])
+
+    def test_group_and_profile(self):
+        '''Ленты группы и автора совпадают с лентами сайта.'''
+        data = self.get_json(reverse(API_GROUP_LIST_URL,
+                                     args=[self.group.slug]))
+        self.assertEqual([post['id'] for post in data['results']],
+                         [self.post.pk])
+        data = self.get_json(reverse(API_PROFILE_URL, args=['reader']))
+        self.assertEqual(data['results'], [])
+        response = self.client.get(reverse(API_GROUP_LIST_URL,
+                                           args=['missing']))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_post_detail_with_comments(self):
+        '''Пост отдается вместе со страницей комментариев.'''
+        data = self.get_json(reverse(API_POST_DETAIL_URL,
+                                     args=[self.post.pk]))
+        self.assertEqual(data['post']['id'], self.post.pk)
+        self.assertEqual(
+            [(comment['author'], comment['text'])
+             for comment in data['comments']['results']],
+            [('reader', 'Комментарий')])
+
+    def test_follow_requires_login(self):
+        '''Лента подписок API доступна только авторизованным.'''
+        response = self.client.get(reverse(API_FOLLOW_URL))
+        self.assertEqual(response.status_code, 401)
+        self.client.force_login(self.reader)
+        data = self.get_json(reverse(API_FOLLOW_URL))
+        self.assertEqual(data['results'][0]['id'], self.post.pk)
+
+    def test_not_modified_until_changed(self):
+        '''Неизменный пост отдается как 304, комментарий меняет ETag.'''
+        url = reverse(API_POST_DETAIL_URL, args=[self.post.pk])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        Comment.objects.create(post=self.post, author=self.author,
+                               text='Ответ')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_deleted_post_changes_feed_etag(self):
+        '''Удаление поста меняет ETag ленты группы.'''
+        url = reverse(API_GROUP_LIST_URL, args=[self.group.slug])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Post.objects.filter(pk=self.post.pk).delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [])
+
+
+class ConditionalPagesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='test-slug')
+        cls.post = Post.objects.create(author=cls.author, text='Пост',
+                                       group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_pages_not_rendered(self):
+        '''Неизменные страницы отдаются как 304 без шаблона.'''
+        for url in (reverse(GROUP_LIST_URL, args=[self.group.slug]),
+                    reverse(PROFILE_URL, args=[self.author.username]),
+                    reverse(POST_DETAIL_URL, args=[self.post.pk])):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.revalidate(url, etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.templates, [])
+                # Текст постов читают только лента и сам пост.
+                self.assertFalse(any(
+                    '"posts_post"."text"' in query['sql']
+                    for query in queries.captured_queries))
+
+    def test_edit_changes_post_page(self):
+        '''Правка поста меняет ETag его страницы и страницы группы.'''
+        urls = (reverse(POST_DETAIL_URL, args=[self.post.pk]),
+                reverse(GROUP_LIST_URL, args=[self.group.slug]))
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Новый текст'
+        post.save()
+        for url, etag in zip(urls, etags):
+            with self.subTest(url=url):
+                response = self.revalidate(url, etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'Новый текст')
+
+    def test_follow_changes_profile(self):
+        '''Подписка меняет профиль только для подписавшегося.'''
+        url = reverse(PROFILE_URL, args=[self.author.username])
+        etag = self.client.get(url)['ETag']
+        Follow.objects.create(user=self.reader, author=self.author)
+        response = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Отписаться')
+
+    def test_viewers_get_different_etags(self):
+        '''Анонимный и авторизованный пользователи не делят ETag.'''
+        url = reverse(POST_DETAIL_URL, args=[self.post.pk])
+        etag = self.client.get(url)['ETag']
+        self.client.logout()
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_new_login_changes_etag(self):
+        '''После нового входа страница поста приходит с новым CSRF-токеном
+        и комментарий принимается.'''
+        User.objects.create_user(username='commenter', password='password')
+        self.client.post(reverse('users:login'),
+                         {'username': 'commenter', 'password': 'password'})
+        url = reverse(POST_DETAIL_URL, args=[self.post.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.revalidate(url, etag).status_code, 304)
+        self.client.logout()
+        self.client.post(reverse('users:login'),
+                         {'username': 'commenter', 'password': 'password'})
+        response = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.revalidate(url, response['ETag']).status_code,
+                         304)
+        token = self.client.cookies[settings.CSRF_COOKIE_NAME].value
+        csrf_client = Client(enforce_csrf_checks=True)
+        csrf_client.cookies = self.client.cookies
+        response = csrf_client.post(
+            reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': 'Комментарий', 'csrfmiddlewaretoken': token})
+        self.assertRedirects(response, url)
+
+    def test_author_rename_changes_group_page(self):
+        '''Новое имя автора видно на странице группы.'''
+        url = reverse(GROUP_LIST_URL, args=[self.group.slug])
+        etag = self.client.get(url)['ETag']
+        self.author.first_name = 'Лев'
+        self.author.save()
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+
+class QueryPlanTest(QueryPlanMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='test-slug')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.post = Post.objects.create(author=cls.author, text='Пост',
+                                       group=cls.group)
+
+    def assertPagesUseIndexes(self, objects, keys=('-pub_date', '-pk')):
+        '''Первая страница и страницы по курсору в обе стороны.'''
+        paginator = KeysetPaginator(objects, 10, keys=keys)
+        key = (self.post.pub_date, self.post.pk)
+        feed = paginator.object_list
+        for name, queryset in (
+            ('first', feed),
+            ('after', feed.filter(paginator.beyond(key))),
+            ('before', feed.reverse().filter(
+                paginator.beyond(key, reverse=True))),
+        ):
+            with self.subTest(page=name):
+                self.assertUsesIndexes(queryset[:paginator.per_page])
+
+    def test_index(self):
+        '''Главная читает индекс по дате публикации.'''
+        self.assertPagesUseIndexes(feeds.index_posts())
+
+    def test_group_list(self):
+        '''Лента группы читает индекс (group, -pub_date).'''
+        self.assertPagesUseIndexes(feeds.group_posts(self.group))
+
+    def test_profile(self):
+        '''Лента автора читает индекс (author, -pub_date).'''
+        self.assertPagesUseIndexes(feeds.author_posts(self.author))
+
+    def test_follow_index(self):
+        '''Лента подписок читает индекс записей ленты.'''
+        self.assertPagesUseIndexes(feeds.follow_posts(self.reader),
+                                   keys=timeline.FEED_KEYS)
+
+    def test_post_comments(self):
+        '''Комментарии поста читают индекс (post, created).'''
+        self.assertPagesUseIndexes(feeds.post_comments(self.post),
+                                   keys=('created', 'pk'))
+
+    def test_trending_comments(self):
+        '''Расчет популярного читает только окно индекса по дате.'''
+        now = timezone.now()
+        plan = trending.comments_per_hour(
+            Comment.objects.all(), now - timedelta(hours=1), now).explain()
+        self.assertIn('comment_created_idx', plan)
+        for line in plan.splitlines():
+            self.assertFalse(FULL_SCAN.search(line.strip()),
+                             f'Полный проход таблицы:\n{plan}')
+
+    def test_suggestions(self):
+        '''Рекомендации читают индекс (user, -score).'''
+        self.assertUsesIndexes(
+            suggestions.ranked(self.reader)[:suggestions.TOP_K])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT,
+                   POST_SHARDS=['default', 'shard'])
+class ShardTest(QueryBudgetMixin, TransactionTestCase):
+    databases = {'default', 'shard'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        # Шард — отдельный файл SQLite, основная база служит первым шардом.
+        connections.databases['shard'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(cls.directory, 'shard.sqlite3'),
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['shard'].close()
+        del connections.databases['shard']
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        # Схема шарда — копия пустой основной базы.
+        sync('shard')
+        shards.install_sequences(connections['shard'])
+        self.group = Group.objects.create(title='Группа', slug='test-slug')
+        self.authors = [User.objects.create_user(username=f'auth{number}')
+                        for number in range(2)]
+        self.posts = [
+            Post.objects.create(author=self.authors[number % 2],
+                                text=f'Пост {number}', group=self.group)
+            for number in range(EXPECTED_POSTS_ON_FIRST_PAGE + 3)
+        ]
+        self.client.force_login(self.authors[0])
+
+    def other_shard(self, author):
+        return connections[
+            'shard' if shards.for_author(author.pk) == 'default'
+            else 'default']
+
+    def test_posts_stored_in_author_shard(self):
+        '''Пост лежит в шарде автора, шард виден по его id.'''
+        for post in self.posts:
+            with self.subTest(post=post.text):
+                using = shards.for_author(post.author_id)
+                self.assertEqual(post._state.db, using)
+                self.assertEqual(shards.for_post(post.pk), using)
+                self.assertTrue(
+                    Post.objects.using(using).filter(pk=post.pk).exists())
+        self.assertEqual(
+            {shards.for_author(author.pk) for author in self.authors},
+            {'default', 'shard'})
+
+    def test_migrate_new_shard_leaves_default(self):
+        '''migrate --database нового шарда не пишет в основную базу.'''
+        reader = User.objects.create_user(username='reader')
+        post = next(post for post in self.posts
+                    if shards.for_author(post.author_id) == 'default')
+        Follow.objects.create(user=reader, author=post.author)
+        TimelineEntry.objects.create(user=reader, post=post,
+                                     author=post.author,
+                                     pub_date=post.pub_date)
+        counters = list(UserCounters.objects.order_by('pk').values_list())
+        connections.databases['fresh'] = {
+            'ENGINE': 'core.backends.sqlite3',
+            'NAME': os.path.join(self.directory, 'fresh.sqlite3'),
+        }
+        self.addCleanup(connections.databases.pop, 'fresh')
+        self.addCleanup(connections['fresh'].close)
+        with override_settings(POST_SHARDS=['default', 'shard', 'fresh']):
+            call_command('migrate', database='fresh', verbosity=0)
+        self.assertEqual(TimelineEntry.objects.count(), 1)
+        self.assertEqual(
+            list(UserCounters.objects.order_by('pk').values_list()),
+            counters)
+        self.assertFalse(
+            Post.objects.using('fresh').exists())
+
+    def test_recount_counts_every_shard(self):
+        '''Пересчет счетчиков складывает посты из всех шардов.'''
+        post = next(post for post in self.posts
+                    if shards.for_author(post.author_id) == 'shard')
+        Comment.objects.create(post=post, author=self.authors[0],
+                               text='Комментарий')
+        UserCounters.objects.update(posts_count=0)
+        Group.objects.update(posts_count=0)
+        Post.objects.using('shard').update(comments_count=0)
+        call_command('recount_counters', stdout=StringIO())
+        for author in self.authors:
+            with self.subTest(author=author.username):
+                self.assertEqual(
+                    UserCounters.objects.get(user=author).posts_count,
+                    len([post for post in self.posts
+                         if post.author == author]))
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, len(self.posts))
+        self.assertEqual(
+            Post.objects.for_pk(post.pk).get().comments_count, 1)
+
+    def test_author_pages_read_one_shard(self):
+        '''Профиль и страница поста не читают чужой шард.'''
+        author = self.authors[1]
+        post = next(post for post in self.posts if post.author == author)
+        Comment.objects.create(post=post, author=self.authors[0],
+                               text='Комментарий')
+        for url in (reverse(PROFILE_URL, args=[author.username]),
+                    reverse(POST_DETAIL_URL, args=[post.pk]),
+                    reverse(API_PROFILE_URL, args=[author.username]),
+                    reverse(API_POST_DETAIL_URL, args=[post.pk])):
+            with self.subTest(url=url):
+                with CaptureQueriesContext(self.other_shard(author)) as other:
+                    response, _ = self.get_within_budget(self.client, url)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, post.text)
+                self.assertFalse(
+                    [query for query in other.captured_queries
+                     if '"posts_post"' in query['sql']])
+
+    def test_feeds_merge_shards(self):
+        '''Главная и лента группы сливают шарды по дате публикации.'''
+        expected = sorted(self.posts, key=lambda post: post.pub_date,
+                          reverse=True)
+        for url in (reverse(INDEX_URL),
+                    reverse(GROUP_LIST_URL, args=[self.group.slug])):
+            with self.subTest(url=url):
+                response, _ = self.get_within_budget(self.client, url)
+                page_obj = response.context['page_obj']
+                self.assertEqual(
+                    list(page_obj),
+                    expected[:EXPECTED_POSTS_ON_FIRST_PAGE])
+                response, _ = self.get_within_budget(
+                    self.client, f'{url}?{page_obj.paginator.next_query}')
+                self.assertEqual(
+                    list(response.context['page_obj']),
+                    expected[EXPECTED_POSTS_ON_FIRST_PAGE:])
+
+    def test_comment_stored_in_post_shard(self):
+        '''Комментарий пишется в шард поста и двигает его счетчик.'''
+        post = next(post for post in self.posts
+                    if shards.for_author(post.author_id) == 'shard')
+        self.client.post(reverse('posts:add_comment', args=[post.pk]),
+                         {'text': 'Комментарий'})
+        Comment.objects.create(post=post, author=self.authors[0],
+                               text='Второй комментарий')
+        self.assertEqual(
+            Comment.objects.using('shard').filter(post_id=post.pk).count(),
+            2)
+        self.assertEqual(Post.objects.for_pk(post.pk).get().comments_count,
+                         2)
+
+    def test_aggregates_combined_by_type(self):
+        '''Агрегаты сводятся по своему типу, остальные отклоняются.'''
+        posts = Post.objects.everywhere()
+        pks = [post.pk for post in self.posts]
+        self.assertEqual(
+            posts.aggregate(first=Min('pk'), last=Max('pk'),
+                            total=Count('pk'), sum=Sum('author_id')),
+            {'first': min(pks), 'last': max(pks), 'total': len(pks),
+             'sum': sum(post.author_id for post in self.posts)})
+        for expression in (Avg('pk'), Count('author', distinct=True)):
+            with self.subTest(expression=expression):
+                with self.assertRaises(TypeError):
+                    posts.aggregate(value=expression)
+
+    def test_search_reads_every_shard(self):
+        '''Поиск находит посты во всех шардах.'''
+        response = self.client.get(reverse(SEARCH_URL), {'q': 'Пост'})
+        found = list(response.context['page_obj'])
+        self.assertEqual(response.context['page_obj'].paginator.count,
+                         len(self.posts))
+        self.assertEqual({post._state.db for post in found},
+                         {'default', 'shard'})
+
+    def test_export_group_from_default(self):
+        '''Выгрузка постов из шарда берет slug группы из основной базы.'''
+        author = next(author for author in self.authors
+                      if shards.for_author(author.pk) == 'shard')
+        records = [record for record in export.records(author)
+                   if record['type'] == 'post']
+        self.assertTrue(records)
+        self.assertEqual({record['group'] for record in records},
+                         {self.group.slug})
+
+    def test_import_refuses_shards(self):
+        '''Импорт, который пишет только в основную базу, отказывается
+        работать с шардами.'''
+        with self.assertRaises(ImproperlyConfigured):
+            importer.Importer('import.jsonl')
+
+    def test_follow_index_merges_shards(self):
+        '''Лента подписок собирает посты авторов из их шардов.'''
+        for author in self.authors:
+            Follow.objects.create(user=self.authors[0], author=author)
+        expected = sorted(self.posts, key=lambda post: post.pub_date,
+                          reverse=True)
+        for url in (reverse(FOLLOW_PAGE_URL), reverse(API_FOLLOW_URL)):
+            with self.subTest(url=url):
+                response, _ = self.get_pages_within_budget(self.client, url)
+                self.assertContains(response, expected[0].text)
+                self.assertNotContains(
+                    response, expected[EXPECTED_POSTS_ON_FIRST_PAGE].text)
+        self.assertEqual(
+            list(self.client.get(reverse(FOLLOW_PAGE_URL))
+                 .context['page_obj']),
+            expected[:EXPECTED_POSTS_ON_FIRST_PAGE])
+
+
+class FollowGraphTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='auth')
+        cls.other = User.objects.create_user(username='other')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='test-slug')
+        for author in (cls.author, cls.other):
+            Post.objects.create(author=author, text=f'Пост {author}',
+                                group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+        on_commit = mock.patch('django.db.transaction.on_commit',
+                               side_effect=lambda func, using=None: func())
+        on_commit.start()
+        self.addCleanup(on_commit.stop)
+
+    def follow(self, author):
+        return self.client.get(reverse(PROFILE_FOLLOW_URL,
+                                       args=[author.username]))
+
+    def unfollow(self, author):
+        return self.client.get(reverse(PROFILE_UNFOLLOW_URL,
+                                       args=[author.username]))
+
+    def test_views_update_loaded_graph(self):
+        '''Подписка и отписка обновляют уже загруженные массивы.'''
+        self.assertEqual(list(follow_graph.following(self.reader.pk)), [])
+        self.assertEqual(list(follow_graph.followers(self.author.pk)), [])
+        self.follow(self.author)
+        self.follow(self.other)
+        with self.assertNumQueries(0):
+            self.assertEqual(list(follow_graph.following(self.reader.pk)),
+                             sorted([self.author.pk, self.other.pk]))
+            self.assertEqual(list(follow_graph.followers(self.author.pk)),
+                             [self.reader.pk])
+            self.assertTrue(
+                follow_graph.is_following(self.reader.pk, self.author.pk))
+        self.unfollow(self.author)
+        self.assertEqual(list(follow_graph.following(self.reader.pk)),
+                         [self.other.pk])
+        self.assertEqual(list(follow_graph.followers(self.author.pk)), [])
+        self.assertEqual(self.unfollow(self.author).status_code, 404)
+
+    def test_writes_checked_against_table(self):
+        '''Подписка и отписка решают по таблице, а не по массиву в кэше.'''
+        follow_graph.following(self.reader.pk)
+        Follow.objects.bulk_create([Follow(user=self.reader,
+                                           author=self.author)])
+        self.assertEqual(self.unfollow(self.author).status_code, 302)
+        self.assertFalse(Follow.objects.filter(user=self.reader).exists())
+        self.follow(self.author)
+        Follow.objects.all().delete()
+        self.follow(self.author)
+        self.assertTrue(Follow.objects.filter(user=self.reader).exists())
+
+    def test_array_read_before_commit_reloaded(self):
+        '''Массив, прочитанный до коммита подписки, не остается в кэше.'''
+        key = follow_graph.graph_key('following', self.reader.pk)
+        follow_graph.following(self.reader.pk)
+        stale = cache.get(key)
+        self.follow(self.author)
+        cache.set(key, stale)
+        self.assertEqual(list(follow_graph.following(self.reader.pk)),
+                         [self.author.pk])
+
+    def test_group_marks_followed_authors(self):
+        '''Лента группы отмечает посты авторов, на которых подписан
+        читатель.'''
+        url = reverse(GROUP_LIST_URL, args=[self.group.slug])
+        self.assertNotContains(self.client.get(url),
+                               'Вы подписаны на автора')
+        self.follow(self.author)
+        self.assertContains(self.client.get(url),
+                            'Вы подписаны на автора', count=1)
+
+    def test_group_etag_depends_on_follows(self):
+        '''Подписка меняет ETag ленты группы для читателя.'''
+        url = reverse(GROUP_LIST_URL, args=[self.group.slug])
+        etag = self.client.get(url)['ETag']
+        self.follow(self.author)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class SuggestionTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader')
+        cls.friend = User.objects.create_user(username='friend')
+        cls.star = User.objects.create_user(username='star')
+        cls.groupmate = User.objects.create_user(username='groupmate')
+        cls.stranger = User.objects.create_user(username='stranger')
+        group = Group.objects.create(title='Группа', slug='test-slug')
+        Follow.objects.create(user=cls.reader, author=cls.friend)
+        Follow.objects.create(user=cls.friend, author=cls.star)
+        for author in (cls.reader, cls.groupmate):
+            Post.objects.create(author=author, text='Пост', group=group)
+        Post.objects.create(author=cls.stranger, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        call_command('compute_suggestions', stdout=StringIO())
+        self.client.force_login(self.reader)
+
+    def test_candidates_scored_by_follows_and_groups(self):
+        '''Подписки подписок весят больше общих групп, свои не в счет.'''
+        self.assertEqual(
+            list(Suggestion.objects.filter(user=self.reader)
+                 .order_by('-score').values_list('author', 'score')),
+            [(self.star.pk, 1.0), (self.groupmate.pk, 0.5)])
+        self.assertEqual(
+            list(Suggestion.objects.filter(user=self.groupmate)
+                 .values_list('author', flat=True)),
+            [self.reader.pk])
+
+    def test_sidebar_reads_one_query(self):
+        '''Боковая панель подписок читает рекомендации одним запросом.'''
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(FOLLOW_PAGE_URL))
+        self.assertEqual(response.context['suggestions'],
+                         [self.star, self.groupmate])
+        self.assertEqual(
+            len([query for query in queries.captured_queries
+                 if 'posts_suggestion' in query['sql']]), 1)
+
+    def test_followed_authors_hidden(self):
+        '''Автор, на которого подписались после расчета, скрыт.'''
+        self.client.get(reverse(PROFILE_FOLLOW_URL,
+                                args=[self.star.username]))
+        response = self.client.get(reverse(FOLLOW_PAGE_URL))
+        self.assertEqual(response.context['suggestions'], [self.groupmate])
+
+    def test_recompute_replaces_suggestions(self):
+        '''Повторный расчет заменяет рекомендации, а не добавляет.'''
+        Follow.objects.create(user=self.reader, author=self.star)
+        call_command('compute_suggestions', stdout=StringIO())
+        self.assertEqual(
+            list(Suggestion.objects.filter(user=self.reader)
+                 .values_list('author', flat=True)),
+            [self.groupmate.pk])
+
+
+class TrendingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='auth')
+        cls.hot, cls.cooling, cls.viewed, cls.quiet, cls.old = (
+            Post.objects.create(author=cls.author, text=f'Пост {name}')
+            for name in ('hot', 'cooling', 'viewed', 'quiet', 'old'))
+        now = timezone.now()
+        Post.objects.filter(pk=cls.old.pk).update(
+            pub_date=now - timedelta(days=30))
+        for post, hours_ago in ((cls.hot, 0), (cls.hot, 0),
+                                (cls.cooling, 12), (cls.cooling, 12),
+                                (cls.old, 24 * 5)):
+            comment = Comment.objects.create(post=post, author=cls.author,
+                                             text='Комментарий')
+            Comment.objects.filter(pk=comment.pk).update(
+                created=now - timedelta(hours=hours_ago))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_ranked_by_decayed_activity(self):
+        '''Недавние комментарии весят больше старых, окно ограничено.'''
+        for _ in range(2):
+            self.client.get(reverse(POST_DETAIL_URL, args=[self.viewed.pk]))
+        call_command('compute_trending', stdout=StringIO())
+        self.assertEqual(list(trending.ranking()),
+                         [self.hot.pk, self.viewed.pk, self.cooling.pk])
+
+    def test_ranking_and_views_stored_in_database(self):
+        '''Рейтинг и просмотры не зависят от кэша процесса, просмотры
+        старше окна удаляются.'''
+        self.client.get(reverse(POST_DETAIL_URL, args=[self.viewed.pk]))
+        self.client.get(reverse(POST_DETAIL_URL, args=[self.viewed.pk]))
+        PostViews.objects.create(
+            post_id=self.quiet.pk, count=100,
+            hour=timezone.now() - timedelta(hours=trending.WINDOW_HOURS + 2))
+        trending.compute()
+        self.assertEqual(PostViews.objects.get(post_id=self.viewed.pk).count,
+                         2)
+        cache.clear()
+        self.assertEqual(list(self.client.get(reverse(POPULAR_URL))
+                              .context['page_obj']),
+                         [self.hot, self.viewed, self.cooling])
+        self.assertFalse(PostViews.objects.filter(
+            post_id=self.quiet.pk).exists())
+
+    def test_not_modified_counts_view(self):
+        '''Ответ 304 на странице поста тоже считается просмотром.'''
+        url = reverse(POST_DETAIL_URL, args=[self.viewed.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        trending.compute()
+        self.assertEqual(PostViews.objects.get(post_id=self.viewed.pk).count,
+                         2)
+
+    def test_views_buffered_in_cache(self):
+        '''Просмотр не пишет в базу, расчет переносит просмотры и не
+        считает их дважды.'''
+        url = reverse(POST_DETAIL_URL, args=[self.viewed.pk])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'posts_postviews' in query['sql']])
+        trending.compute()
+        for _ in range(2):
+            trending.record_view(self.viewed.pk)
+        trending.compute()
+        trending.compute()
+        self.assertEqual(PostViews.objects.get(post_id=self.viewed.pk).count,
+                         3)
+
+    def test_page_reads_ranking(self):
+        '''Страница выводит посты в порядке рейтинга одним запросом.'''
+        trending.compute()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(POPULAR_URL))
+        self.assertTemplateUsed(response, POPULAR_TEMPLATE)
+        self.assertEqual(list(response.context['page_obj']),
+                         [self.hot, self.cooling])
+        self.assertEqual(
+            len([query for query in queries.captured_queries
+                 if 'FROM "posts_post"' in query['sql']]), 1)
+
+    def test_empty_until_computed(self):
+        '''До первого расчета лента пуста, а не падает.'''
+        response = self.client.get(reverse(POPULAR_URL))
+        self.assertContains(response, 'Подборка пока пуста.')
+
+    def test_recompute_changes_etag(self):
+        '''Новый расчет меняет ETag страницы.'''
+        url = reverse(POPULAR_URL)
+        trending.compute()
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        trending.compute(now=timezone.now() + timedelta(minutes=5))
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
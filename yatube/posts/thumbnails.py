@@ -0,0 +1,180 @@
+"""Фоновая подготовка вариантов картинок постов.
+
+Для каждой картинки один раз создаются варианты нескольких ширин в JPEG
+и, если Pillow собран с libwebp, в WebP. Варианты создаются в пуле
+потоков после коммита транзакции, в которой сохранен пост, и
+записываются в ``PostImageVariant``, поэтому шаблоны строят ``srcset``
+по готовым записям и не режут картинку внутри запроса. Пока вариантов
+нет, выводится исходная картинка.
+
+С ``THUMBNAIL_SYNC`` и для базы в памяти (тестовой) варианты создаются
+в том же потоке сразу после коммита: другой поток не может безопасно
+работать с такой базой.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import features
+from sorl.thumbnail import get_thumbnail
+
+from core.cache import bump_version
+from core.sqlite import immediate
+
+from . import fragments
+from .constants import FEED_VERSION_KEY
+from .models import Post, PostImageVariant
+
+logger = logging.getLogger(__name__)
+
+# Пропорции картинки в ленте и ширины, под которые готовятся варианты.
+FEED_SIZE = (960, 339)
+VARIANT_WIDTHS = getattr(settings, 'POST_IMAGE_WIDTHS', (480, 960, 1440))
+FORMATS = ('webp', 'jpeg') if features.check('webp') else ('jpeg',)
+FALLBACK_FORMAT = 'jpeg'
+WORKERS = getattr(settings, 'THUMBNAIL_WORKERS', 2)
+SYNC = getattr(settings, 'THUMBNAIL_SYNC', False)
+
+executor = ThreadPoolExecutor(max_workers=WORKERS,
+                              thread_name_prefix='thumbnails')
+pending = set()
+pending_lock = threading.Lock()
+
+
+def variant_sizes():
+    feed_width, feed_height = FEED_SIZE
+    for width in VARIANT_WIDTHS:
+        yield width, round(width * feed_height / feed_width)
+
+
+def generate(post_id):
+    """Создать и записать варианты картинки поста."""
+    try:
+        post = Post.objects.for_pk(post_id).first()
+        if post is None or not post.image:
+            return
+        variants = copy_existing(post) or list(cut(post))
+        using = post._state.db
+        with immediate(using):
+            post.image_variants.all().delete()
+            PostImageVariant.objects.using(using).bulk_create(variants)
+            Post.objects.for_pk(post_id).update(updated=timezone.now())
+        fragments.bump('post', post_id)
+        bump_version(FEED_VERSION_KEY)
+    except Exception:
+        logger.exception('Не удалось создать варианты картинки поста %s',
+                         post_id)
+    finally:
+        with pending_lock:
+            pending.discard(post_id)
+
+
+def cut(post):
+    for image_format in FORMATS:
+        for width, height in variant_sizes():
+            thumbnail = get_thumbnail(
+                post.image.name, f'{width}x{height}', crop='center',
+                upscale=True, format=image_format.upper())
+            yield PostImageVariant(
+                post=post, source=post.image.name,
+                image=thumbnail.name, format=image_format,
+                width=thumbnail.width, height=thumbnail.height)
+
+
+def copy_existing(post):
+    """Варианты той же картинки, уже созданные для другого поста.
+
+    Одинаковые загрузки хранятся одним файлом (см.
+    ``core.storage.ContentAddressedStorage``), поэтому варианты можно
+    не резать заново, а взять по имени исходного файла.
+    """
+    existing = (PostImageVariant.objects.using(post._state.db)
+                .filter(source=post.image.name)
+                .exclude(post=post)
+                .values('post_id', 'image', 'format', 'width', 'height'))
+    first_post = None
+    variants = []
+    for values in existing.order_by('post_id'):
+        post_id = values.pop('post_id')
+        if first_post is None:
+            first_post = post_id
+        if post_id != first_post:
+            break
+        variants.append(PostImageVariant(
+            post=post, source=post.image.name, **values))
+    return variants
+
+
+def work(post_id):
+    try:
+        generate(post_id)
+    finally:
+        # Соединения с БД у каждого потока свои, их нужно закрыть явно.
+        for connection in connections.all():
+            connection.close()
+
+
+def is_sync(using):
+    connection = connections[using]
+    return SYNC or (connection.vendor == 'sqlite'
+                    and connection.is_in_memory_db())
+
+
+def submit(post_id, using):
+    with pending_lock:
+        if post_id in pending:
+            return
+        pending.add(post_id)
+    if is_sync(using):
+        generate(post_id)
+    else:
+        executor.submit(work, post_id)
+
+
+def queue_post(post):
+    """Поставить подготовку вариантов картинки в очередь после коммита.
+
+    В ``pending`` пост попадает только после коммита, поэтому откат
+    транзакции ничего в нем не оставляет.
+    """
+    if not post.image:
+        return
+    using = post._state.db or 'default'
+    transaction.on_commit(lambda: submit(post.pk, using), using=using)
+
+
+def picture(post):
+    """Данные для ``<picture>``: источники по форматам и запасной ``<img>``.
+
+    Варианты берутся из ``post.image_variants`` (их стоит получить через
+    ``prefetch_related``). Если для текущей картинки вариантов нет, они
+    ставятся в очередь, а вернется None.
+    """
+    if not post.image:
+        return None
+    by_format = {}
+    for variant in post.image_variants.all():
+        if variant.source == post.image.name:
+            by_format.setdefault(variant.format, []).append(variant)
+    if FALLBACK_FORMAT not in by_format:
+        queue_post(post)
+        return None
+    fallback = by_format.pop(FALLBACK_FORMAT)
+    feed_width = FEED_SIZE[0]
+    return {
+        'sources': [
+            (f'image/{image_format}', srcset(variants))
+            for image_format, variants in by_format.items()
+        ],
+        'srcset': srcset(fallback),
+        'image': min(fallback, key=lambda item: abs(item.width - feed_width)),
+        'sizes': f'(max-width: {feed_width}px) 100vw, {feed_width}px',
+    }
+
+
+def srcset(variants):
+    return ', '.join(f'{variant.image.url} {variant.width}w'
+                     for variant in variants)
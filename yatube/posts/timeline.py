@@ -0,0 +1,183 @@
+"""Материализованная лента подписок (fan-out on write).
+
+Каждый новый пост раскладывается в ``TimelineEntry`` всех подписчиков
+автора, поэтому вкладка «Избранные авторы» читает один диапазон индекса
+``(user, -pub_date, -post)``. Когда у автора становится больше
+``TIMELINE_FANOUT_LIMIT`` подписчиков, раскладка его постов
+приостанавливается: время остановки хранится в
+``UserCounters.fanout_paused``, и при чтении ленты посты таких авторов
+берутся из таблицы постов и сливаются с записями ленты (pull-and-merge).
+Чтение ничего не пишет.
+
+Раскладку возобновляет только команда ``resume_timelines``: она
+дописывает пропущенные посты в ленты подписчиков автора, у которого их
+стало не больше ``TIMELINE_RESUME_LIMIT``. Порог ниже
+``TIMELINE_FANOUT_LIMIT``, поэтому подписка и отписка у границы не
+гоняют автора туда и обратно.
+"""
+from datetime import datetime
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from core.sqlite import immediate
+
+from . import shards
+from .models import Follow, Post, TimelineEntry, UserCounters
+
+FANOUT_LIMIT = getattr(settings, 'TIMELINE_FANOUT_LIMIT', 1000)
+RESUME_LIMIT = getattr(settings, 'TIMELINE_RESUME_LIMIT',
+                       FANOUT_LIMIT * 9 // 10)
+BATCH_SIZE = getattr(settings, 'TIMELINE_BATCH_SIZE', 500)
+FEED_KEYS = ('-feed_pub_date', '-feed_post_id')
+# Остановка «с начала»: в лентах нет ни одного поста автора.
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def paused_authors():
+    """Запрос id авторов, раскладка постов которых приостановлена."""
+    return (UserCounters.objects.filter(fanout_paused__isnull=False)
+            .values('user_id'))
+
+
+def feed(user):
+    """Посты ленты подписок пользователя в порядке ленты."""
+    posts = (
+        Post.objects
+        .filter(timeline_entries__user=user)
+        .annotate(feed_pub_date=F('timeline_entries__pub_date'),
+                  feed_post_id=F('timeline_entries__post_id'))
+    )
+    paused = list(Follow.objects.filter(
+        user=user, author_id__in=paused_authors())
+        .values_list('author_id', flat=True))
+    if paused:
+        # Записи ленты до остановки остаются, посты этих авторов
+        # целиком берутся из второго запроса.
+        posts = shards.MergedFeed([
+            posts.exclude(author_id__in=paused),
+            Post.objects.filter(author_id__in=paused)
+            .annotate(feed_pub_date=F('pub_date'), feed_post_id=F('pk')),
+        ])
+    return posts.select_related('author', 'group')
+
+
+def _entries(user_ids, posts):
+    return (
+        TimelineEntry(user_id=user_id, post_id=post_id,
+                      author_id=author_id, pub_date=pub_date)
+        for user_id in user_ids
+        for post_id, author_id, pub_date in posts
+    )
+
+
+def _bulk_insert(entries):
+    while True:
+        batch = list(islice(entries, BATCH_SIZE))
+        if not batch:
+            return
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out(post):
+    """Разложить новый пост по лентам подписчиков автора."""
+    counters = (UserCounters.objects.filter(user_id=post.author_id)
+                .values_list('followers_count', 'fanout_paused').first())
+    if counters is not None:
+        followers_count, paused = counters
+        if paused is not None:
+            return
+        if followers_count > FANOUT_LIMIT:
+            UserCounters.objects.filter(
+                user_id=post.author_id, fanout_paused__isnull=True,
+            ).update(fanout_paused=post.pub_date)
+            return
+    followers = (Follow.objects.filter(author_id=post.author_id)
+                 .values_list('user_id', flat=True).iterator())
+    _bulk_insert(_entries(
+        followers, [(post.pk, post.author_id, post.pub_date)]))
+
+
+def backfill(user_id, author_id):
+    """Добавить в ленту посты автора после подписки на него."""
+    posts = (Post.objects.filter(author_id=author_id)
+             .values_list('pk', 'author_id', 'pub_date').iterator())
+    _bulk_insert(_entries([user_id], posts))
+
+
+def prune(user_id, author_id):
+    """Убрать из ленты посты автора после отписки от него."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, author_id=author_id).delete()
+
+
+def _insert_from_follows(cursor, author_ids, since=None):
+    """Записи лент всех подписчиков для постов ``author_ids``.
+
+    С ``since`` — только для постов, опубликованных не раньше него.
+    """
+    entry, follow, post = (model._meta.db_table
+                           for model in (TimelineEntry, Follow, Post))
+    params = list(author_ids)
+    since_sql = ''
+    if since is not None:
+        since_sql = ' AND p.pub_date >= %s'
+        params.append(connection.ops.adapt_datetimefield_value(since))
+    cursor.execute(
+        f'INSERT OR IGNORE INTO {entry} '
+        f'(user_id, post_id, author_id, pub_date) '
+        f'SELECT f.user_id, p.id, p.author_id, p.pub_date '
+        f'FROM {follow} f JOIN {post} p ON p.author_id = f.author_id '
+        f'WHERE f.author_id IN ({", ".join(["%s"] * len(author_ids))})'
+        f'{since_sql}',
+        params)
+
+
+def resume():
+    """Возобновить раскладку авторов с подписчиками не больше порога.
+
+    Каждый автор — своя транзакция: пропущенные с остановки посты
+    дописываются в ленты подписчиков, и остановка снимается. Возвращает
+    число авторов.
+    """
+    resumable = UserCounters.objects.filter(
+        fanout_paused__isnull=False, followers_count__lte=RESUME_LIMIT)
+    resumed = 0
+    for author_id in list(resumable.values_list('user_id', flat=True)):
+        with immediate():
+            paused = (resumable.filter(user_id=author_id)
+                      .values_list('fanout_paused', flat=True).first())
+            if paused is None:
+                continue
+            with connection.cursor() as cursor:
+                _insert_from_follows(cursor, [author_id], since=paused)
+            UserCounters.objects.filter(user_id=author_id).update(
+                fanout_paused=None)
+        resumed += 1
+    return resumed
+
+
+def rebuild(chunk_size=100):
+    """Заново собрать ленты всех подписчиков по таблице подписок.
+
+    Нужна после массовой загрузки через ``bulk_create``, которая не
+    вызывает сигналов. Ленты пишутся запросом ``INSERT ... SELECT`` по
+    ``chunk_size`` авторов за транзакцию, без объектов в памяти. Посты
+    популярных авторов не раскладываются, их раскладка остановлена «с
+    начала».
+    """
+    TimelineEntry.objects.all().delete()
+    UserCounters.objects.filter(followers_count__gt=FANOUT_LIMIT).update(
+        fanout_paused=EPOCH)
+    UserCounters.objects.filter(followers_count__lte=FANOUT_LIMIT).update(
+        fanout_paused=None)
+    authors = (Follow.objects.exclude(author_id__in=paused_authors())
+               .values_list('author_id', flat=True).distinct()
+               .order_by('author_id'))
+    ids = list(authors)
+    for start in range(0, len(ids), chunk_size):
+        with immediate(), connection.cursor() as cursor:
+            _insert_from_follows(cursor, ids[start:start + chunk_size])
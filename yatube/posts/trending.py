@@ -0,0 +1,220 @@
+"""Лента «Популярное»: посты по недавним комментариям и просмотрам.
+
+Команда ``compute_trending`` раз в несколько минут считает рейтинг и
+сохраняет его в таблицу ``TrendingPost`` по месту в рейтинге, поэтому
+страница читает срез этой таблицы и затем только посты своей страницы.
+Рейтинг и просмотры лежат в основной базе и общие для всех процессов.
+
+Просмотр не пишет в базу: страница поста атомарно увеличивает счетчик
+поста за час в общем кэше, а расчет переносит накопленное в
+``PostViews`` одной транзакцией. Первый просмотр часа дописывает пост в
+список счетчиков этого часа, чтобы расчет не перебирал все посты.
+
+Активность считается по часам за последние ``WINDOW_HOURS``:
+комментарии — запросом с группировкой по посту и часу, который читает
+только окно индекса по дате комментария, просмотры — счетчиками
+``PostViews`` по часам, которые старше окна расчет удаляет. Каждый час
+активности весит ``0.5 ** (возраст / HALF_LIFE_HOURS)``, так что время
+и память расчета зависят от активности за окно, а не от размера таблиц.
+
+Кандидаты — посты с комментариями за окно и посты, опубликованные за
+окно. Просмотры старого поста без новых комментариев не поднимают его в
+ленту.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from core.sqlite import immediate
+
+from . import shards
+from .models import Comment, Post, PostViews, TrendingPost
+
+WINDOW_HOURS = getattr(settings, 'TRENDING_WINDOW_HOURS', 48)
+HALF_LIFE_HOURS = getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 6)
+SIZE = getattr(settings, 'TRENDING_SIZE', 100)
+COMMENT_WEIGHT = 3
+VIEW_WEIGHT = 1
+VIEWS_KEY = 'trending_views'
+# Счетчики старше окна расчету не нужны.
+VIEWS_TIMEOUT = (WINDOW_HOURS + 1) * 3600
+
+
+def hour_of(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def hour_key(hour):
+    return f'{VIEWS_KEY}:{int(hour.timestamp())}'
+
+
+def _incr(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, 1, VIEWS_TIMEOUT):
+            return 1
+        return cache.incr(key)
+
+
+def record_view(post_id):
+    """Засчитать просмотр поста в текущем часе, не обращаясь к базе."""
+    key = hour_key(hour_of(timezone.now()))
+    if _incr(f'{key}:{post_id}') == 1:
+        slot = _incr(key)
+        cache.set(f'{key}:slot:{slot}', post_id, VIEWS_TIMEOUT)
+
+
+def buffered_views(hours):
+    """Накопленные в кэше просмотры: (ключ счетчика, пост, час, число)."""
+    hours = {hour_key(hour): hour for hour in hours}
+    slots = {f'{key}:slot:{slot}': key
+             for key, total in cache.get_many(hours).items()
+             for slot in range(1, total + 1)}
+    counters = {f'{slots[slot]}:{post_id}': (post_id, hours[slots[slot]])
+                for slot, post_id in cache.get_many(slots).items()}
+    for key, total in cache.get_many(counters).items():
+        if total > 0:
+            yield (key, *counters[key], total)
+
+
+def flush_views(now):
+    """Перенести просмотры из кэша в ``PostViews``.
+
+    Счетчики уменьшаются на перенесенное, поэтому просмотры, пришедшие
+    во время переноса, остаются до следующего расчета.
+    """
+    since = hour_of(now) - timedelta(hours=WINDOW_HOURS)
+    views = list(buffered_views(
+        since + timedelta(hours=age) for age in range(WINDOW_HOURS + 1)))
+    if not views:
+        return
+    with immediate(), connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {PostViews._meta.db_table} '
+            f'(post_id, hour, "count") VALUES (%s, %s, %s) '
+            f'ON CONFLICT (hour, post_id) '
+            f'DO UPDATE SET "count" = "count" + excluded."count"',
+            [(post_id, connection.ops.adapt_datetimefield_value(hour), total)
+             for _, post_id, hour, total in views])
+    for key, _, _, total in views:
+        try:
+            cache.decr(key, total)
+        except ValueError:
+            # Счетчик вытеснен из кэша, пришедшие после переноса
+            # просмотры пропали вместе с ним.
+            pass
+
+
+def decay(hour, now):
+    age = (now - hour).total_seconds() / 3600
+    return 0.5 ** (max(age, 0) / HALF_LIFE_HOURS)
+
+
+def comments_per_hour(comments, since, until):
+    """Число комментариев по постам и часам окна.
+
+    Окно задано с обеих сторон: с одной нижней границей планировщик
+    SQLite предпочитает обойти весь индекс ``(post, created)`` ради
+    группировки вместо диапазона индекса ``(created, post)``.
+    """
+    return (comments.filter(created__gte=since, created__lt=until)
+            .annotate(hour=Trunc('created', 'hour'))
+            .values('post_id', 'hour')
+            .annotate(total=Count('pk'))
+            .order_by()
+            .values_list('post_id', 'hour', 'total'))
+
+
+def comment_activity(since, until):
+    """Тройки (пост, час, число комментариев) во всех шардах."""
+    for using in shards.databases():
+        yield from comments_per_hour(
+            Comment.objects.using(using), since, until).iterator()
+
+
+def new_posts(since, until):
+    for using in shards.databases():
+        yield from (Post.objects.using(using)
+                    .filter(pub_date__gte=since, pub_date__lt=until)
+                    .values_list('pk', flat=True).iterator())
+
+
+def view_activity(post_ids, since):
+    """Тройки (пост, час, число просмотров) из счетчиков окна."""
+    for post_id, hour, total in (
+            PostViews.objects.filter(hour__gte=since)
+            .values_list('post_id', 'hour', 'count').iterator()):
+        if post_id in post_ids:
+            yield post_id, hour, total
+
+
+def compute(size=SIZE, now=None):
+    """Пересчитать и сохранить рейтинг, вернуть список id."""
+    now = now or timezone.now()
+    flush_views(now)
+    since = hour_of(now) - timedelta(hours=WINDOW_HOURS)
+    scores = {}
+    for post_id, hour, total in comment_activity(since, now):
+        scores[post_id] = (scores.get(post_id, 0)
+                           + COMMENT_WEIGHT * total * decay(hour, now))
+    candidates = set(scores).union(new_posts(since, now))
+    for post_id, hour, total in view_activity(candidates, since):
+        scores[post_id] = (scores.get(post_id, 0)
+                           + VIEW_WEIGHT * total * decay(hour, now))
+    ranking = sorted(scores, key=lambda post_id: (-scores[post_id],
+                                                  -post_id))[:size]
+    with immediate():
+        TrendingPost.objects.all().delete()
+        TrendingPost.objects.bulk_create(
+            TrendingPost(rank=rank, post_id=post_id,
+                         score=scores[post_id], computed=now)
+            for rank, post_id in enumerate(ranking))
+        PostViews.objects.filter(hour__lt=since).delete()
+    return ranking
+
+
+def ranking():
+    """Id постов последнего рейтинга в его порядке."""
+    return TrendingPost.objects.values_list('post_id', flat=True)
+
+
+def computed():
+    """Время последнего расчета или None, если рейтинг пуст."""
+    return TrendingPost.objects.values_list('computed', flat=True).first()
+
+
+class TrendingPosts:
+    """Посты рейтинга в его порядке для ``Paginator``.
+
+    Срез читает свой отрезок рейтинга и посты одним запросом на шард;
+    удаленные после расчета посты пропускаются.
+    """
+
+    def __init__(self, post_ids):
+        self.post_ids = post_ids
+
+    def count(self):
+        return self.post_ids.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        ids = list(self.post_ids[key])
+        by_db = {}
+        for post_id in ids:
+            by_db.setdefault(shards.for_post(post_id), []).append(post_id)
+        posts = {}
+        for using, chunk in by_db.items():
+            posts.update(
+                shards.related(Post.objects.using(using), 'author', 'group')
+                .in_bulk(chunk))
+        return [posts[post_id] for post_id in ids if post_id in posts]
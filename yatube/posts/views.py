@@ -1,34 +1,40 @@
 
-from django.views.decorators.cache import cache_page
 from django.contrib.auth.decorators import login_required
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
-from django.core.paginator import Paginator
 
+from core.cache import cache_view
+from core.conditional import conditional
+from core.sqlite import immediate
+
+from . import (changes, export, feeds, follow_graph, search, shards,
+               suggestions, thumbnails, timeline, trending)
+from .constants import (COMMENTS_PER_PAGE, FEED_VERSION_KEY,
+                        INDEX_CACHE_TIMEOUT)
 from .models import Follow, Group, Post, User
 from .forms import CommentForm, PostForm
+from .paginator import KeysetPaginator, OffsetPaginator
 
 
-def page(request, post, posts_per_page=10):
-    paginator = Paginator(post, posts_per_page)
-    page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+def page(request, post, posts_per_page=10, **kwargs):
+    paginator = KeysetPaginator(post, posts_per_page, **kwargs)
+    return paginator.paginate(request.GET)
 
 
-@cache_page(20, key_prefix='index_page')
+@cache_view(INDEX_CACHE_TIMEOUT, key_prefix='index_page',
+            version_key=FEED_VERSION_KEY, shared=True)
 def index(request):
     return render(
         request,
         'posts/index.html',
-        {'page_obj': page(
-            request,
-            Post.objects.select_related('author', 'group').all())}
+        {'page_obj': page(request, feeds.index_posts())}
     )
 
 
+@conditional(lambda request, slug: changes.group(slug, request.user))
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    page_obj = page(request, posts)
+    page_obj = page(request, feeds.group_posts(group))
     context = {
         'page_obj': page_obj,
         'group': group,
@@ -36,25 +42,59 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@conditional(lambda request, username: changes.profile(
+    username, request.user))
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(
+        User.objects.select_related('counters'), username=username)
     user = request.user
     return render(
         request,
         'posts/profile.html',
-        {'page_obj': page(request, author.posts.all()),
+        {'page_obj': page(request, feeds.author_posts(author)),
          'author': author,
          'following': (user.is_authenticated
                        and user != author
-                       and not author.following.filter(
-                           user_id=request.user.id).exists())})
+                       and not follow_graph.is_following(user.pk,
+                                                         author.pk))})
+
+
+@conditional(lambda request: changes.popular())
+def popular(request):
+    paginator = OffsetPaginator(trending.TrendingPosts(trending.ranking()),
+                                10)
+    return render(
+        request,
+        'posts/popular.html',
+        {'page_obj': paginator.paginate(request.GET), 'popular': True})
+
+
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    paginator = OffsetPaginator(search.SearchResults(query), 10)
+    return render(
+        request,
+        'posts/search.html',
+        {'page_obj': paginator.paginate(request.GET), 'query': query})
+
+
+def viewed_post(request, post_id):
+    """Состояние страницы поста; просмотр засчитывается и для ответа 304."""
+    current = changes.post(post_id)
+    if current is not None:
+        trending.record_view(post_id)
+    return current
 
 
+@conditional(viewed_post)
 def post_detail(request, post_id):
+    post = get_object_or_404(feeds.post(post_id))
     return render(
         request,
         'posts/post_detail.html',
-        {'post': get_object_or_404(Post, pk=post_id),
+        {'post': post,
+         'page_obj': page(request, feeds.post_comments(post),
+                          COMMENTS_PER_PAGE, keys=('created', 'pk')),
          'form': CommentForm(request.POST or None)})
 
 
@@ -66,13 +106,15 @@ def post_create(request):
         return render(request, 'posts/create_post.html', {'form': form})
     post = form.save(commit=False)
     post.author = request.user
-    post.save()
+    with immediate(shards.for_author(request.user.pk)):
+        post.save()
+        thumbnails.queue_post(post)
     return redirect('posts:profile', request.user)
 
 
 @login_required
 def post_edit(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(Post.objects.for_pk(post_id))
     if post.author != request.user:
         return redirect('posts:post_detail', post_id=post_id)
     form = PostForm(
@@ -82,30 +124,49 @@ def post_edit(request, post_id):
     if not form.is_valid():
         return render(request, 'posts/create_post.html',
                       {'form': form, 'is_edit': True})
-    form.save()
+    with immediate(post._state.db):
+        form.save()
+        if 'image' in form.changed_data:
+            thumbnails.queue_post(post)
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(Post.objects.for_pk(post_id))
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        with immediate(post._state.db):
+            comment.save()
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@login_required
+def export_data(request):
+    file_format = request.GET.get('format')
+    if file_format not in export.FORMATS:
+        file_format = 'ndjson'
+    response = StreamingHttpResponse(
+        export.lines(
+            export.records(request.user, request.build_absolute_uri),
+            file_format),
+        content_type=export.FORMATS[file_format])
+    response['Content-Disposition'] = (
+        f'attachment; filename="{request.user.username}.{file_format}"')
+    return response
+
+
 @login_required
 def follow_index(request):
     return render(
         request,
         'posts/follow.html',
-        {'page_obj': page(
-            request,
-            Post.objects.filter(author__following__user=request.user))})
+        {'page_obj': page(request, feeds.follow_posts(request.user),
+                          keys=timeline.FEED_KEYS),
+         'suggestions': suggestions.for_user(request.user)})
 
 
 @login_required
@@ -116,17 +177,20 @@ def profile_follow(request, username):
         'user': request.user,
         'author': get_object_or_404(User, username=username)
     }
-    Follow.objects.get_or_create(**data)
+    with immediate():
+        Follow.objects.get_or_create(**data)
     return redirect('posts:profile', data['author'])
 
 
 @login_required
 def profile_unfollow(request, username):
-    get_object_or_404(
-        Follow,
-        user=request.user,
-        author__username=username
-    ).delete()
+    author_id = get_object_or_404(
+        User.objects.values_list('pk', flat=True), username=username)
+    with immediate():
+        deleted, _ = Follow.objects.filter(
+            user=request.user, author_id=author_id).delete()
+    if not deleted:
+        raise Http404('Подписки нет')
     return redirect(
         'posts:profile',
         username
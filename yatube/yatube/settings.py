@@ -56,6 +56,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.queries.QueryBudgetMiddleware',
+    'core.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -93,11 +95,48 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'core.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
     }
 }
 
+# Профиль PRAGMA соединений SQLite (core.sqlite): tuned — WAL и прочее,
+# stock — умолчания SQLite. Движок core.backends.sqlite3 позволяет
+# начинать транзакции записи с BEGIN IMMEDIATE (core.sqlite.immediate).
+SQLITE_PROFILE = os.environ.get('YATUBE_SQLITE_PROFILE', 'tuned')
+SQLITE_PRAGMAS = {}
+
+# Реплики для чтения лент (core.replicas): пути к копиям базы через запятую
+# в переменной окружения YATUBE_REPLICAS. Копии обновляет sync_replicas.
+DATABASE_REPLICAS = []
+for number, path in enumerate(
+        filter(None, os.environ.get('YATUBE_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'core.backends.sqlite3',
+        'NAME': path.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+DATABASE_ROUTERS = ['posts.shards.ShardRouter', 'core.replicas.ReplicaRouter']
+# Сколько секунд после записи пользователь читает основную базу.
+REPLICA_PIN_SECONDS = 10
+
+# Шарды постов и комментариев (posts.shards): пути к файлам SQLite через
+# запятую в YATUBE_POST_SHARDS. Первым шардом служит основная база, пустой
+# список выключает разбиение. Файлы создает migrate --database shardN.
+POST_SHARDS = []
+for number, path in enumerate(
+        filter(None, os.environ.get('YATUBE_POST_SHARDS', '').split(',')), 1):
+    DATABASES[f'shard{number}'] = {
+        'ENGINE': 'core.backends.sqlite3',
+        'NAME': path.strip(),
+    }
+    POST_SHARDS.append(f'shard{number}')
+if POST_SHARDS:
+    POST_SHARDS.insert(0, 'default')
+# Потоки для параллельного чтения шардов.
+POST_SHARD_WORKERS = 4
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -143,8 +182,51 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+# Общий для всех воркеров кэш включается переменной окружения
+# YATUBE_SHARED_CACHE с путем к файлу, например /dev/shm/yatube-cache.sqlite3
+SHARED_CACHE_LOCATION = os.environ.get('YATUBE_SHARED_CACHE')
+
+if SHARED_CACHE_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache_backend.SharedMemoryCache',
+            'LOCATION': SHARED_CACHE_LOCATION,
+            'OPTIONS': {
+                'MAX_SIZE': 64 * 1024 * 1024,
+            },
+        }
     }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# sorl-thumbnail хранит сведения о миниатюрах в БД и в этом же кэше.
+THUMBNAIL_KVSTORE = 'sorl.thumbnail.kvstores.cached_db_kvstore.KVStore'
+THUMBNAIL_CACHE = 'default'
+# Создавать варианты картинок в потоке запроса, а не в пуле (posts.thumbnails).
+THUMBNAIL_SYNC = bool(os.environ.get('YATUBE_THUMBNAIL_SYNC'))
+
+# Бюджет SQL-запросов на одно открытие страницы (core.queries).
+# Превышение пишется в лог, тесты posts проверяют его для каждой ленты.
+QUERY_BUDGET = 20
+QUERY_BUDGETS = {
+    'posts:index': 8,
+    'posts:group_list': 10,
+    'posts:profile': 10,
+    'posts:follow_index': 10,
+    'posts:post_detail': 8,
+}
+# Бюджеты, которые меняются при включенных шардах (POST_SHARDS): связи
+# поста читаются отдельными запросами вместо JOIN, ленты — из каждого шарда.
+# Числа — по страницам с холодным кэшем фрагментов, страница по курсору
+# читает на один-два запроса больше первой.
+SHARDED_QUERY_BUDGETS = {
+    'posts:index': 14,
+    'posts:group_list': 19,
+    'posts:profile': 11,
+    'posts:follow_index': 15,
+    'posts:post_detail': 13,
 }